@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0004_remove_assignment_max_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='batch_analysis',
+            field=models.BooleanField(default=False, help_text='Collect submissions and analyze them in batches at the deadline'),
+        ),
+    ]
@@ -92,6 +92,10 @@ class Assignment(models.Model):
     
     # Teacher controls
     allow_late_submissions = models.BooleanField(default=False, help_text='Allow submissions after deadline')
+    batch_analysis = models.BooleanField(
+        default=False,
+        help_text='Collect submissions and analyze them in batches at the deadline'
+    )
 
     class Meta:
         db_table = 'assignments'
@@ -53,7 +53,7 @@ class AssignmentSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'class_obj', 'title', 'description', 'deadline', 
             'created_by', 'created_at', 'updated_at',
-            'is_active', 'allow_late_submissions', 'submission_count',
+            'is_active', 'allow_late_submissions', 'batch_analysis', 'submission_count',
             'is_past_deadline'
         ]
         read_only_fields = ['id', 'created_by', 'created_at', 'updated_at']
@@ -64,7 +64,7 @@ class AssignmentCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Assignment
-        fields = ['class_id', 'title', 'description', 'deadline',  'allow_late_submissions']
+        fields = ['class_id', 'title', 'description', 'deadline',  'allow_late_submissions', 'batch_analysis']
 
     def validate_deadline(self, value):
         if value < timezone.now():
@@ -75,4 +75,4 @@ class AssignmentUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating assignment"""
     class Meta:
         model = Assignment
-        fields = ['title', 'description', 'deadline',  'is_active', 'allow_late_submissions']
\ No newline at end of file
+        fields = ['title', 'description', 'deadline',  'is_active', 'allow_late_submissions', 'batch_analysis']
\ No newline at end of file
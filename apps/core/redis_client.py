@@ -0,0 +1,20 @@
+"""
+Shared Redis connection for coordination state that needs more than the
+Django cache API (atomic counters, hashes, locks, pub/sub).
+"""
+import os
+
+import redis
+from django.conf import settings
+
+_client = None
+_client_pid = None
+
+
+def get_redis():
+    """Return this process's Redis client, reconnecting after a fork"""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+        _client_pid = os.getpid()
+    return _client
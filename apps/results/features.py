@@ -0,0 +1,196 @@
+"""
+Local linguistic features for ParagraphResult.features.
+
+The ML service only returns a BERT score and perplexity per paragraph. The
+text statistics, readability metrics, burstiness and n-gram repetition are
+computed here from the paragraph text when the paragraphs are persisted.
+
+Each paragraph is tokenized once into flat per-word and per-sentence arrays
+tagged with the paragraph's index, and every feature is then computed for
+all paragraphs of the batch at once with NumPy (bincount over the paragraph
+index, unique over (paragraph, token) pairs), instead of looping over the
+paragraphs feature by feature.
+"""
+import re
+
+from django.conf import settings
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - features are optional
+    np = None
+
+_SENTENCE = re.compile(r'[^.!?]+(?:[.!?]+|$)')
+_WORD = re.compile(r"\w+(?:['’]\w+)*")
+_VOWEL_GROUPS = re.compile(r'[aeiouy]+')
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+# Words longer than this count as long words
+LONG_WORD_LENGTH = 6
+# Words with at least this many syllables count as complex (Gunning Fog)
+COMPLEX_SYLLABLES = 3
+
+
+def count_syllables(word):
+    """Rough English syllable count: vowel groups, minus a silent final e"""
+    word = word.lower()
+    count = len(_VOWEL_GROUPS.findall(word))
+    if count > 1 and word.endswith('e') and not word.endswith(('le', 'ee')):
+        count -= 1
+    return max(count, 1)
+
+
+def _ratio(numerator, denominator):
+    return np.divide(
+        numerator, denominator,
+        out=np.zeros(len(denominator)), where=denominator > 0,
+    )
+
+
+def _tokenize(texts):
+    """Flat arrays of words and sentences, tagged with their paragraph index"""
+    vocabulary = {}
+    word_para, word_ids, word_lengths, word_syllables = [], [], [], []
+    sentence_para, sentence_lengths, starter_ids = [], [], []
+    characters, punctuation = [], []
+
+    for index, text in enumerate(texts):
+        characters.append(len(text))
+        punctuation.append(len(_PUNCTUATION.findall(text)))
+        for sentence in _SENTENCE.findall(text):
+            words = _WORD.findall(sentence)
+            if not words:
+                continue
+            sentence_para.append(index)
+            sentence_lengths.append(len(words))
+            for word in words:
+                word_id = vocabulary.setdefault(word.lower(), len(vocabulary))
+                word_para.append(index)
+                word_ids.append(word_id)
+                word_lengths.append(len(word))
+                word_syllables.append(count_syllables(word))
+            starter_ids.append(vocabulary[words[0].lower()])
+
+    return {
+        'vocabulary_size': max(len(vocabulary), 1),
+        'word_para': np.array(word_para, dtype=np.int64),
+        'word_ids': np.array(word_ids, dtype=np.int64),
+        'word_lengths': np.array(word_lengths, dtype=np.float64),
+        'word_syllables': np.array(word_syllables, dtype=np.float64),
+        'sentence_para': np.array(sentence_para, dtype=np.int64),
+        'sentence_lengths': np.array(sentence_lengths, dtype=np.float64),
+        'starter_ids': np.array(starter_ids, dtype=np.int64),
+        'characters': np.array(characters, dtype=np.float64),
+        'punctuation': np.array(punctuation, dtype=np.float64),
+    }
+
+
+def _distinct_per_paragraph(para, ids, vocabulary_size, count):
+    """(distinct ids, ids seen once) per paragraph"""
+    pairs, occurrences = np.unique(para * vocabulary_size + ids, return_counts=True)
+    owners = pairs // vocabulary_size
+    distinct = np.bincount(owners, minlength=count)
+    once = np.bincount(owners[occurrences == 1], minlength=count)
+    return distinct, once
+
+
+def _trigram_repetition(para, ids, count):
+    """Share of each paragraph's word trigrams that repeat an earlier one"""
+    if len(ids) < 3:
+        return np.zeros(count)
+    same = (para[:-2] == para[2:])
+    trigrams = np.stack([para[:-2], ids[:-2], ids[1:-1], ids[2:]], axis=1)[same]
+    if not len(trigrams):
+        return np.zeros(count)
+    unique, occurrences = np.unique(trigrams, axis=0, return_counts=True)
+    total = np.bincount(trigrams[:, 0], minlength=count)
+    repeated = np.bincount(unique[:, 0], weights=occurrences - 1, minlength=count)
+    return _ratio(repeated, total)
+
+
+def extract_features(texts):
+    """Feature dicts for paragraph texts, in order (empty when disabled)"""
+    if np is None or not settings.PARAGRAPH_FEATURES_ENABLED or not texts:
+        return [{} for _ in texts]
+
+    count = len(texts)
+    tokens = _tokenize(texts)
+    word_para = tokens['word_para']
+    sentence_para = tokens['sentence_para']
+    sentence_lengths = tokens['sentence_lengths']
+
+    # ── Text statistics ──
+    words = np.bincount(word_para, minlength=count).astype(np.float64)
+    sentences = np.bincount(sentence_para, minlength=count).astype(np.float64)
+    letters = np.bincount(word_para, weights=tokens['word_lengths'], minlength=count)
+    syllables = np.bincount(word_para, weights=tokens['word_syllables'], minlength=count)
+    words_per_sentence = _ratio(words, sentences)
+    mean_square = _ratio(
+        np.bincount(sentence_para, weights=sentence_lengths ** 2, minlength=count), sentences,
+    )
+    sentence_variance = np.maximum(mean_square - words_per_sentence ** 2, 0)
+    sentence_std = np.sqrt(sentence_variance)
+
+    # ── Linguistic complexity ──
+    distinct, hapax = _distinct_per_paragraph(
+        word_para, tokens['word_ids'], tokens['vocabulary_size'], count,
+    )
+    long_words = np.bincount(
+        word_para, weights=tokens['word_lengths'] > LONG_WORD_LENGTH, minlength=count,
+    )
+    complex_words = np.bincount(
+        word_para, weights=tokens['word_syllables'] >= COMPLEX_SYLLABLES, minlength=count,
+    )
+    syllables_per_word = _ratio(syllables, words)
+    letters_per_word = _ratio(letters, words)
+
+    # ── Readability ──
+    has_words = words > 0
+    flesch = np.where(has_words, 206.835 - 1.015 * words_per_sentence - 84.6 * syllables_per_word, 0)
+    flesch_kincaid = np.where(has_words, 0.39 * words_per_sentence + 11.8 * syllables_per_word - 15.59, 0)
+    gunning_fog = 0.4 * (words_per_sentence + 100 * _ratio(complex_words, words))
+    coleman_liau = np.where(
+        has_words, 5.88 * letters_per_word - 29.6 * _ratio(sentences, words) - 15.8, 0,
+    )
+    automated_readability = np.where(
+        has_words, 4.71 * letters_per_word + 0.5 * words_per_sentence - 21.43, 0,
+    )
+
+    # ── AI detection patterns ──
+    # Goh & Barabási burstiness of sentence lengths: -1 regular, 0 random, 1 bursty
+    burstiness = _ratio(sentence_std - words_per_sentence, sentence_std + words_per_sentence)
+    starters, _ = _distinct_per_paragraph(
+        sentence_para, tokens['starter_ids'], tokens['vocabulary_size'], count,
+    )
+
+    columns = {
+        'word_count': words,
+        'character_count': tokens['characters'],
+        'sentence_count': sentences,
+        'avg_sentence_length': words_per_sentence,
+        'avg_word_length': letters_per_word,
+        'sentence_length_variance': sentence_variance,
+        'lexical_diversity': _ratio(distinct, words),
+        'hapax_legomena_ratio': _ratio(hapax, words),
+        'long_word_ratio': _ratio(long_words, words),
+        'complex_word_ratio': _ratio(complex_words, words),
+        'avg_syllables_per_word': syllables_per_word,
+        'flesch_reading_ease': flesch,
+        'flesch_kincaid_grade': flesch_kincaid,
+        'gunning_fog': gunning_fog,
+        'coleman_liau': coleman_liau,
+        'automated_readability_index': automated_readability,
+        'burstiness': burstiness,
+        'ngram_repetition': _trigram_repetition(word_para, tokens['word_ids'], count),
+        'sentence_starter_diversity': _ratio(starters, sentences),
+        'punctuation_ratio': _ratio(tokens['punctuation'], tokens['characters']),
+    }
+    counts = {'word_count', 'character_count', 'sentence_count'}
+    rounded = {
+        name: values.astype(np.int64).tolist() if name in counts else np.round(values, 4).tolist()
+        for name, values in columns.items()
+    }
+    return [
+        {name: values[index] for name, values in rounded.items()}
+        for index in range(count)
+    ]
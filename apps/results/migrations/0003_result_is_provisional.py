@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('results', '0002_paragraphresult_highlighted_html_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='is_provisional',
+            field=models.BooleanField(default=False, help_text='Quick estimate from a sample of paragraphs, replaced by the full analysis'),
+        ),
+    ]
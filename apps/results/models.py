@@ -17,6 +17,10 @@ class Result(models.Model):
     # COmpletion tracking
     is_complete = models.BooleanField(default=False, help_text='All paragraphs analyzed')
     completed_paragraphs = models.IntegerField(default=0, help_text='Paragraphs with results')
+    is_provisional = models.BooleanField(
+        default=False,
+        help_text='Quick estimate from a sample of paragraphs, replaced by the full analysis'
+    )
 
     report_pdf = models.FileField(upload_to='reports/%Y/%m/%d/', null=True, blank= True)
     processing_time = models.FloatField(help_text='Processing time in seconds', null=True)
@@ -28,7 +28,7 @@ class ResultSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'submission', 'student_name', 'student_email',
             'assignment_name', 'ai_percentage', 'human_percentage',
-            'grammar_score', 'total_paragraphs', 'ai_paragraphs',
+            'grammar_score', 'total_paragraphs', 'ai_paragraphs', 'is_provisional',
             'report_pdf', 'report_url', 'processing_time', 'created_at',
             'paragraphs'
         ]
@@ -62,7 +62,7 @@ class ResultSummarySerializer(serializers.ModelSerializer):
         fields = [
             'id', 'submission', 'student_name', 'student_email',
             'assignment_name', 'ai_percentage', 'human_percentage',
-            'grammar_score', 'total_paragraphs', 'ai_paragraphs',
+            'grammar_score', 'total_paragraphs', 'ai_paragraphs', 'is_provisional',
             'report_url', 'processing_time', 'created_at'
         ]
     
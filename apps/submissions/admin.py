@@ -1,7 +1,8 @@
 from django.contrib import admin
 
-from .models import Submission
+from .models import Submission, UploadSession
 
 # Register your models here.
 
-admin.site.register(Submission)
\ No newline at end of file
+admin.site.register(Submission)
+admin.site.register(UploadSession)
\ No newline at end of file
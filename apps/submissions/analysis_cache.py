@@ -0,0 +1,127 @@
+"""
+Content-addressed analysis cache.
+
+Identical PDFs analyzed with the same ML model version give the same result,
+so a repeated upload is answered by cloning the earlier Result and
+ParagraphResult rows instead of calling the ML service again. The hash is
+computed by the preflight stage in the worker, never in the upload request.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.results.models import Result, ParagraphResult
+
+logger = logging.getLogger(__name__)
+
+
+def hash_chunks(chunks):
+    """Return the SHA-256 hex digest of an iterable of byte chunks"""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_key(content_hash, model_version):
+    return f'analysis:{model_version}:{content_hash}'
+
+
+def lookup(submission):
+    """
+    Find a completed Result for the same file bytes and model version.
+    Redis is checked first, the database is the fallback.
+    """
+    if not submission.content_hash:
+        return None
+
+    model_version = settings.ML_MODEL_VERSION
+    key = _cache_key(submission.content_hash, model_version)
+
+    try:
+        source_id = cache.get(key)
+    except Exception as exc:
+        logger.warning("Analysis cache unavailable: %s", exc)
+        source_id = None
+
+    results = Result.objects.filter(is_complete=True).exclude(submission_id=submission.id)
+
+    if source_id:
+        result = results.filter(submission_id=source_id).first()
+        if result:
+            return result
+
+    result = (
+        results
+        .filter(
+            submission__content_hash=submission.content_hash,
+            submission__model_version=model_version,
+            submission__status='completed',
+        )
+        .order_by('-created_at')
+        .first()
+    )
+    if result:
+        _set(key, result.submission_id)
+    return result
+
+
+def remember(submission):
+    """Record a freshly analyzed submission as the cache source for its hash"""
+    if submission.content_hash and submission.model_version:
+        _set(_cache_key(submission.content_hash, submission.model_version), submission.id)
+
+
+def _set(key, submission_id):
+    try:
+        cache.set(key, str(submission_id), settings.ANALYSIS_CACHE_TIMEOUT)
+    except Exception as exc:
+        logger.warning("Analysis cache unavailable: %s", exc)
+
+
+@transaction.atomic
+def clone_result(source, submission):
+    """Copy a cached Result and its paragraphs onto another submission"""
+    result = Result.objects.create(
+        submission=submission,
+        ai_percentage=source.ai_percentage,
+        human_percentage=source.human_percentage,
+        grammar_score=source.grammar_score,
+        total_paragraphs=source.total_paragraphs,
+        ai_paragraphs=source.ai_paragraphs,
+        is_complete=True,
+        completed_paragraphs=source.completed_paragraphs,
+        processing_time=0,
+    )
+
+    # Reports are immutable once written, so the stored file is shared
+    if source.report_pdf:
+        result.report_pdf.name = source.report_pdf.name
+        result.save(update_fields=['report_pdf'])
+
+    ParagraphResult.objects.bulk_create([
+        ParagraphResult(
+            result=result,
+            paragraph_number=para.paragraph_number,
+            text_content=para.text_content,
+            status=para.status,
+            ai_probability=para.ai_probability,
+            ai_level=para.ai_level,
+            is_flagged=para.is_flagged,
+            confidence=para.confidence,
+            features=para.features,
+            grammar_issues=para.grammar_issues,
+            sentence_highlights=para.sentence_highlights,
+            highlighted_html=para.highlighted_html,
+        )
+        for para in source.paragraphs.all()
+    ])
+
+    logger.info(
+        "Cloned cached analysis from submission %s to %s",
+        source.submission_id, submission.id,
+    )
+    return result, result.total_paragraphs
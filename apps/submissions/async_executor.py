@@ -0,0 +1,242 @@
+"""
+Async multiplexed analyze stage.
+
+Enabled with SUBMISSION_EXECUTION_MODE = 'async'. Submissions still go
+through the scheduler and the staged pipeline; only the ML call of a
+whole-PDF analysis is different. Instead of queuing analyze_submission,
+the preflight stage hands the submission's lease to the executor queue
+(PENDING_KEY), and run_async_executor awaits many of those calls
+concurrently through one AsyncMLClient, so a worker slot is not idle for
+the whole length of a single analysis.
+
+For each submission the executor does what the analyze stage would: it
+adopts the handed-off lease, stops for terminated or paused submissions,
+parks the submission when ml_guard turns the call away, checkpoints the
+response and hands the lease on to persist_paragraphs. Analyses it cannot
+multiplex (extracted text, shards or chunks, webhook mode, a checkpoint
+to resume from) and failed calls go to analyze_submission, whose retries back off.
+
+Redis and database work runs in worker threads, never on the event loop.
+An executor stops taking work after ASYNC_EXECUTOR_RUN_SECONDS, finishes
+the calls it has in flight and queues a successor if work is left, so it
+stays inside the Celery time limit. If one is killed anyway, its
+submissions lose their lease and reap_stale_submissions requeues them.
+
+Terminating a submission cancels its coroutine through its cancellation
+token, which aborts the HTTP request at once.
+"""
+import asyncio
+import json
+import logging
+import tempfile
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from apps.core.redis_client import get_redis
+from . import cancellation, checkpoints, ml_guard, scheduler, sharding, slimming, text_extraction
+from .ml_client import AsyncMLClient
+from .ml_guard import MLUnavailable
+from .models import Submission
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'submission:async:pending'
+
+# Failed calls go to analyze_submission after the same delay as a stage retry
+RETRY_DELAY = 60
+
+
+def submit(submission_id, lease_token):
+    """Queue a submission's ML call for the executor; its lease must be handed off"""
+    get_redis().rpush(PENDING_KEY, json.dumps([str(submission_id), lease_token]))
+    from .tasks import run_async_executor
+    run_async_executor.apply_async(queue='submissions')
+
+
+def run_executor():
+    """Run queued ML calls for at most ASYNC_EXECUTOR_RUN_SECONDS; returns counts"""
+    counts = asyncio.run(_run(deadline=time.monotonic() + settings.ASYNC_EXECUTOR_RUN_SECONDS))
+    if counts['left_over']:
+        from .tasks import run_async_executor
+        run_async_executor.apply_async(countdown=counts['retry_after'], queue='submissions')
+    return counts
+
+
+async def _run(deadline):
+    max_in_flight = settings.ASYNC_EXECUTOR_MAX_IN_FLIGHT
+    client = AsyncMLClient(max_connections=max_in_flight)
+    in_flight = set()
+    counts = {'analyzed': 0, 'handed_over': 0, 'stopped': 0, 'left_over': 0, 'retry_after': 0}
+
+    try:
+        while True:
+            free_slots = max_in_flight - len(in_flight)
+            if free_slots > 0 and time.monotonic() < deadline and not counts['retry_after']:
+                if await asyncio.to_thread(ml_guard.is_accepting):
+                    claimed = await asyncio.to_thread(_pop, min(free_slots, settings.ASYNC_EXECUTOR_CLAIM_BATCH))
+                    for submission_id, lease_token in claimed:
+                        in_flight.add(asyncio.create_task(_process(client, submission_id, lease_token)))
+                else:
+                    # Leave the queue alone until the breaker lets calls through again
+                    counts['retry_after'] = settings.ML_DEFER_SECONDS
+
+            if not in_flight:
+                break
+
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                counts[task.result()] += 1
+    finally:
+        await client.aclose()
+
+    counts['left_over'] = await asyncio.to_thread(_pending_count)
+    logger.info(
+        "Async executor finished: %d analyzed, %d handed over, %d stopped, %d left queued",
+        counts['analyzed'], counts['handed_over'], counts['stopped'], counts['left_over'],
+    )
+    return counts
+
+
+def _pop(count):
+    try:
+        entries = get_redis().lpop(PENDING_KEY, count) or []
+    except RedisError as exc:
+        logger.warning("Executor queue unavailable: %s", exc)
+        return []
+    return [json.loads(entry) for entry in entries]
+
+
+def _pending_count():
+    try:
+        return get_redis().llen(PENDING_KEY)
+    except RedisError as exc:
+        logger.warning("Executor queue unavailable: %s", exc)
+        return 0
+
+
+async def _process(client, submission_id, lease_token):
+    from .tasks import _adopt_lease
+
+    lease = await sync_to_async(_adopt_lease)(submission_id, lease_token, 'analyze')
+    if lease is None:
+        return 'stopped'
+
+    submission, outcome = await sync_to_async(_route)(submission_id, lease)
+    if submission is None:
+        return outcome
+
+    started_at, started = timezone.now(), time.monotonic()
+    try:
+        with ExitStack() as stack:
+            cancel_token = await asyncio.to_thread(stack.enter_context, cancellation.watch(submission_id))
+            # Terminating the submission cancels this coroutine and its HTTP request
+            current, loop = asyncio.current_task(), asyncio.get_running_loop()
+            cancel_token.on_cancel(lambda: loop.call_soon_threadsafe(current.cancel))
+            try:
+                upload_size = await _analyze(client, submission)
+            except asyncio.CancelledError:
+                if not cancel_token.cancelled:
+                    raise
+                logger.info("Submission %s terminated during ML call — aborted", submission_id)
+                await sync_to_async(_stop)(submission, lease, discard=True)
+                return 'stopped'
+
+    except MLUnavailable as exc:
+        await sync_to_async(_park)(submission, lease, exc.retry_after)
+        return 'stopped'
+
+    except Exception as exc:
+        logger.exception("Submission %s failed in async executor: %s", submission_id, exc)
+        await sync_to_async(_hand_over)(submission, lease, countdown=RETRY_DELAY)
+        return 'handed_over'
+
+    await sync_to_async(_analyzed)(submission, lease, started_at, time.monotonic() - started, upload_size)
+    return 'analyzed'
+
+
+def _route(submission_id, lease):
+    """(submission, None) to analyze here, or (None, outcome) once dealt with"""
+    submission = Submission.objects.filter(id=submission_id).first()
+    if submission is None:
+        logger.error("Submission %s not found", submission_id)
+        _stop(None, lease, submission_id=submission_id)
+        return None, 'stopped'
+
+    if submission.status == 'terminated':
+        logger.info("Submission %s was terminated — stopping at analyze", submission_id)
+        _stop(submission, lease, discard=True)
+        return None, 'stopped'
+
+    if submission.is_paused:
+        from .tasks import _pause_at_stage
+        _pause_at_stage(submission, 'analyze')
+        _stop(submission, lease)
+        return None, 'stopped'
+
+    if (
+        checkpoints.latest_checkpoint(submission)
+        or text_extraction.has_paragraphs(submission)
+        or settings.ML_COMPLETION_MODE == 'webhook'
+        or sharding.plan_shards(submission)
+        or sharding.plan_chunks(submission)
+    ):
+        _hand_over(submission, lease)
+        return None, 'handed_over'
+
+    return submission, None
+
+
+async def _analyze(client, submission):
+    """Checkpoint the ML response for the submission; returns the bytes uploaded"""
+    name = await sync_to_async(slimming.analysis_name)(submission)
+    async with client.analyze_pdf(submission, name=name) as response:
+        # Spool to disk so hundreds of in-flight responses stay bounded
+        with tempfile.SpooledTemporaryFile(max_size=settings.ASYNC_EXECUTOR_SPOOL_SIZE) as spool:
+            async for chunk in response.aiter_bytes(settings.ML_RESPONSE_CHUNK_SIZE):
+                spool.write(chunk)
+            spool.seek(0)
+            await sync_to_async(_checkpoint_spooled)(submission, spool)
+    return await sync_to_async(submission.file.storage.size)(name)
+
+
+def _checkpoint_spooled(submission, spool):
+    chunks = iter(lambda: spool.read(settings.ML_RESPONSE_CHUNK_SIZE), b'')
+    checkpoints.save_checkpoint(submission, 0, chunks)
+
+
+def _analyzed(submission, lease, started_at, seconds, upload_size):
+    from .tasks import _queue_stage, _record_stage_timing, persist_paragraphs
+
+    scheduler.record_ml_time(upload_size, seconds)
+    _record_stage_timing(submission.id, 'analyze', started_at, seconds)
+    if lease.lost:
+        # Another worker may own the submission now; leave the rest to it
+        logger.warning("Submission %s lease lost after analyze — stopping", submission.id)
+        return
+    _queue_stage(persist_paragraphs, submission.id, lease)
+
+
+def _hand_over(submission, lease, countdown=None):
+    """Leave the analysis to the regular analyze stage"""
+    from .tasks import _queue_stage, analyze_submission
+    _queue_stage(analyze_submission, submission.id, lease, countdown=countdown)
+
+
+def _park(submission, lease, retry_after):
+    from .tasks import _park_submission
+    _park_submission(submission, retry_after)
+    _stop(submission, lease)
+
+
+def _stop(submission, lease, discard=False, submission_id=None):
+    """End the pipeline here: drop the lease and give up the scheduler slot"""
+    from .tasks import _discard_work_files, _release_slot
+    if discard:
+        _discard_work_files(submission)
+    lease.release()
+    _release_slot(submission_id or submission.id)
@@ -0,0 +1,87 @@
+"""
+Assignment-deadline batch analysis.
+
+For assignments with batch_analysis on, submissions made before the
+deadline are not scheduled one by one. They wait with status 'batched'
+until the deadline passes (flush-assignment-batches in the beat schedule)
+or until ML_BATCH_SIZE of them have collected, and are then claimed in
+groups of up to ML_BATCH_SIZE files / ML_BATCH_MAX_BYTES and analyzed with
+one /api/analyze_pdf_batch request per group (tasks.analyze_batch). Each
+analysis in the batch response becomes that submission's ML checkpoint, and
+the regular persist/report/finalize stages take it from there.
+
+Late submissions, paused ones and batch members the ML service could not
+analyze go through the normal per-submission pipeline.
+"""
+import logging
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+from apps.classes.models import Assignment
+from .models import Submission
+
+logger = logging.getLogger(__name__)
+
+
+def collects(submission):
+    """Whether a new submission should wait for its assignment's batch"""
+    assignment = submission.assignment
+    return bool(assignment and assignment.batch_analysis and not assignment.is_past_deadline)
+
+
+def hold(submission):
+    """Park a submission until its batch is flushed; returns how many are waiting"""
+    Submission.objects.filter(id=submission.id, status='queued').update(status='batched')
+    logger.info("Submission %s waiting for the batch of assignment %s", submission.id, submission.assignment_id)
+    return Submission.objects.filter(assignment_id=submission.assignment_id, status='batched').count()
+
+
+def due_assignments():
+    """Batch-mode assignments past their deadline with submissions waiting"""
+    return (
+        Assignment.objects
+        .filter(batch_analysis=True, deadline__lte=timezone.now(), submissions__status='batched')
+        .values_list('id', flat=True)
+        .distinct()
+    )
+
+
+def claim_batches(assignment_id):
+    """
+    Split an assignment's waiting submissions into batches and claim each
+    one for a task; returns [(task_id, [submission_id, ...]), ...].
+    """
+    waiting = (
+        Submission.objects
+        .filter(assignment_id=assignment_id, status='batched', is_paused=False)
+        .order_by('submitted_at')
+        .values_list('id', 'file_size')
+    )
+
+    groups, group, group_bytes = [], [], 0
+    for submission_id, file_size in waiting:
+        if group and (
+            len(group) >= settings.ML_BATCH_SIZE
+            or group_bytes + file_size > settings.ML_BATCH_MAX_BYTES
+        ):
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append(submission_id)
+        group_bytes += file_size
+    if group:
+        groups.append(group)
+
+    claimed = []
+    for group in groups:
+        task_id = str(uuid.uuid4())
+        # Another flush may have claimed some of these meanwhile
+        Submission.objects.filter(id__in=group, status='batched').update(status='processing', task_id=task_id)
+        submission_ids = [
+            str(submission_id)
+            for submission_id in Submission.objects.filter(task_id=task_id).values_list('id', flat=True)
+        ]
+        if submission_ids:
+            claimed.append((task_id, submission_ids))
+    return claimed
@@ -0,0 +1,147 @@
+"""
+Cooperative cancellation of in-flight submissions.
+
+Terminating a submission sets a Redis flag and publishes its id on a
+pub/sub channel. Every worker process runs one listener thread on that
+channel and fires the CancelTokens of the submissions it is working on:
+
+- the streamed upload and response of an ML call check their token
+  between chunks and stop with SubmissionCancelled,
+- the async executor cancels the submission's coroutine, which aborts its
+  HTTP request immediately.
+
+Prefork workers blocked waiting for the ML service to answer are also
+stopped by the revoke(terminate=True) that SubmissionViewSet.terminate
+sends with the token.
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from apps.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'submission:cancel'
+KEY_PREFIX = 'submission:cancelled'
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+_listener = None
+_listener_pid = None
+
+
+class SubmissionCancelled(Exception):
+    """The submission was terminated while it was being processed"""
+
+
+class CancelToken:
+    """Cancellation signal for one submission inside this process"""
+
+    def __init__(self, submission_id):
+        self.submission_id = str(submission_id)
+        self._event = threading.Event()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def on_cancel(self, callback):
+        self._callbacks.append(callback)
+        if self.cancelled:
+            callback()
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self._event.set()
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception as exc:
+                logger.warning("Cancel callback for submission %s failed: %s", self.submission_id, exc)
+
+    def check(self):
+        if self.cancelled:
+            raise SubmissionCancelled(f'Submission {self.submission_id} was terminated')
+
+    def iter_checked(self, chunks):
+        """Pass chunks through, stopping as soon as the token fires"""
+        for chunk in chunks:
+            self.check()
+            yield chunk
+
+
+def _key(submission_id):
+    return f'{KEY_PREFIX}:{submission_id}'
+
+
+def cancel(submission_id):
+    """Flag a submission as terminated and notify the workers processing it"""
+    try:
+        redis_client = get_redis()
+        redis_client.set(_key(submission_id), 1, ex=settings.SUBMISSION_CANCEL_TTL)
+        redis_client.publish(CHANNEL, str(submission_id))
+    except RedisError as exc:
+        logger.warning("Could not publish cancellation of submission %s: %s", submission_id, exc)
+
+
+def clear(submission_id):
+    """Forget an earlier cancellation when the submission is queued again"""
+    try:
+        get_redis().delete(_key(submission_id))
+    except RedisError as exc:
+        logger.warning("Could not clear cancellation of submission %s: %s", submission_id, exc)
+
+
+def is_cancelled(submission_id):
+    try:
+        return bool(get_redis().exists(_key(submission_id)))
+    except RedisError:
+        return False
+
+
+def _on_message(message):
+    with _tokens_lock:
+        tokens = list(_tokens.get(message['data'], ()))
+    for token in tokens:
+        token.cancel()
+
+
+def _ensure_listener():
+    """Start this process's pub/sub listener thread, once per process"""
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid() and _listener.is_alive():
+        return
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(**{CHANNEL: _on_message})
+    _listener = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+    _listener_pid = os.getpid()
+
+
+@contextmanager
+def watch(submission_id):
+    """Yield a CancelToken that fires when the submission is terminated"""
+    token = CancelToken(submission_id)
+    with _tokens_lock:
+        _tokens.setdefault(token.submission_id, set()).add(token)
+    try:
+        try:
+            _ensure_listener()
+            # A cancellation published before we subscribed is still flagged
+            if is_cancelled(submission_id):
+                token.cancel()
+        except RedisError as exc:
+            logger.warning("Cancellation listener unavailable: %s", exc)
+        yield token
+    finally:
+        with _tokens_lock:
+            watchers = _tokens.get(token.submission_id, set())
+            watchers.discard(token)
+            if not watchers:
+                _tokens.pop(token.submission_id, None)
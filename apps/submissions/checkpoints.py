@@ -0,0 +1,78 @@
+"""
+Checkpoints of raw ML responses.
+
+The ML response is gzipped into storage, keyed by submission and attempt,
+before anything is persisted from it. When persistence fails (a storage
+error while saving the report, a database conflict) the retry replays the
+checkpoint instead of running the inference again, so each submission is
+analyzed by the ML service once.
+"""
+import gzip
+import logging
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from .models import Submission
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = 'ml-checkpoints'
+
+
+def checkpoint_name(submission_id, attempt):
+    return f'{CHECKPOINT_DIR}/{submission_id}/attempt-{attempt}.json.gz'
+
+
+def write_checkpoint(name, chunks):
+    """Gzip a streamed ML response into storage; returns the stored name"""
+    with tempfile.TemporaryFile() as spool:
+        with gzip.GzipFile(fileobj=spool, mode='wb') as compressed:
+            for chunk in chunks:
+                compressed.write(chunk)
+        spool.seek(0)
+        return default_storage.save(name, File(spool))
+
+
+def save_checkpoint(submission, attempt, chunks):
+    """Write a streamed ML response to storage and record it on the submission"""
+    name = write_checkpoint(checkpoint_name(submission.id, attempt), chunks)
+
+    submission.ml_checkpoint = name
+    Submission.objects.filter(id=submission.id).update(ml_checkpoint=name)
+    logger.info("Checkpointed ML response for submission %s to %s", submission.id, name)
+    return name
+
+
+def latest_checkpoint(submission):
+    """Name of the submission's stored ML response, or None"""
+    name = submission.ml_checkpoint
+    if name and default_storage.exists(name):
+        return name
+    return None
+
+
+def iter_checkpoint(name, chunk_size=None):
+    """Yield the decompressed ML response from a checkpoint"""
+    chunk_size = chunk_size or settings.ML_RESPONSE_CHUNK_SIZE
+    with default_storage.open(name, 'rb') as fh, gzip.GzipFile(fileobj=fh) as compressed:
+        while True:
+            chunk = compressed.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def discard_checkpoint(submission):
+    """Delete the checkpoint once its analysis has been persisted"""
+    name = submission.ml_checkpoint
+    if not name:
+        return
+    try:
+        default_storage.delete(name)
+    except Exception as exc:
+        logger.warning("Could not delete checkpoint %s: %s", name, exc)
+    submission.ml_checkpoint = ''
+    Submission.objects.filter(id=submission.id).update(ml_checkpoint='')
@@ -0,0 +1,217 @@
+"""
+Direct-to-storage uploads.
+
+Uploading a PDF through Django ties a web worker to the student's
+connection for as long as the upload takes, then spends it again copying
+the spooled file to S3/MinIO. With S3 storage the client can instead:
+
+1. POST /api/submissions/upload/ with the file name and size; this creates
+   the Submission in the 'uploading' state and returns a presigned POST
+   for its object key under submissions/,
+2. upload the file straight to the bucket with that form,
+3. POST /api/submissions/{id}/finalize/; the object's size and PDF magic
+   bytes are checked and the submission is queued for processing.
+
+Large files can instead go up resumably as an S3 multipart upload
+(UploadSession, /api/submissions/uploads/): the file is cut into
+RESUMABLE_UPLOAD_PART_SIZE parts, the client asks for presigned PUT URLs
+for any parts (in parallel, or again after a failure), and GET/HEAD on the
+session reports the contiguous offset received so far and the parts
+present, straight from S3. Re-sending a part replaces it, so duplicate
+chunks are harmless. Completing the session assembles the parts, checks
+the result like a finalized upload and only then creates the Submission.
+
+The content hash is left for the preflight stage to compute. Uploads and
+upload sessions that are never finished are removed by
+expire_direct_uploads.
+"""
+import logging
+
+from django.conf import settings
+
+from .models import Submission, UploadSession
+from .streaming import is_s3_storage, s3_key
+
+logger = logging.getLogger(__name__)
+
+# The PDF header may follow a little junk, as readers accept
+MAGIC_BYTES = b'%PDF-'
+MAGIC_SEARCH = 1024
+
+
+class UploadRejected(Exception):
+    """The uploaded object is missing or is not the PDF that was announced"""
+
+
+def _storage():
+    return Submission._meta.get_field('file').storage
+
+
+def available():
+    return settings.DIRECT_UPLOADS_ENABLED and is_s3_storage(_storage())
+
+
+def assign_upload_name(submission):
+    """Give an unsaved submission its object name under the upload_to prefix"""
+    field = Submission._meta.get_field('file')
+    submission.file.name = field.generate_filename(submission, f'{submission.id}.pdf')
+
+
+def presigned_post(submission):
+    """Presigned POST form for uploading the submission's PDF to the bucket"""
+    storage = _storage()
+    post = storage.bucket.meta.client.generate_presigned_post(
+        Bucket=storage.bucket_name,
+        Key=s3_key(storage, submission.file.name),
+        Fields={'Content-Type': 'application/pdf'},
+        Conditions=[
+            {'Content-Type': 'application/pdf'},
+            ['content-length-range', submission.file_size, submission.file_size],
+        ],
+        ExpiresIn=settings.DIRECT_UPLOAD_EXPIRY,
+    )
+    return {
+        'url': post['url'],
+        'fields': post['fields'],
+        'expires_in': settings.DIRECT_UPLOAD_EXPIRY,
+    }
+
+
+def verify_upload(submission):
+    """Check the uploaded object against the submission; raises UploadRejected"""
+    from botocore.exceptions import ClientError
+
+    storage = _storage()
+    obj = storage.bucket.Object(s3_key(storage, submission.file.name))
+    try:
+        size = obj.content_length
+    except ClientError:
+        raise UploadRejected('File has not been uploaded')
+
+    if size != submission.file_size or size > settings.MAX_UPLOAD_SIZE:
+        discard_upload(submission)
+        raise UploadRejected('Uploaded file size does not match')
+
+    body = obj.get(Range=f'bytes=0-{MAGIC_SEARCH - 1}')['Body']
+    try:
+        head = body.read()
+    finally:
+        body.close()
+    if MAGIC_BYTES not in head:
+        discard_upload(submission)
+        raise UploadRejected('Only PDF files are allowed')
+
+
+def new_session(user, filename, file_size, assignment=None, assignment_name=''):
+    """Open an S3 multipart upload and record it as an UploadSession"""
+    session = UploadSession(
+        user=user,
+        assignment=assignment,
+        assignment_name=assignment_name,
+        original_filename=filename,
+        file_size=file_size,
+        part_size=settings.RESUMABLE_UPLOAD_PART_SIZE,
+    )
+    field = Submission._meta.get_field('file')
+    session.file_name = field.generate_filename(None, f'{session.id}.pdf')
+
+    storage = _storage()
+    upload = storage.bucket.meta.client.create_multipart_upload(
+        Bucket=storage.bucket_name,
+        Key=s3_key(storage, session.file_name),
+        ContentType='application/pdf',
+    )
+    session.multipart_upload_id = upload['UploadId']
+    session.save()
+    return session
+
+
+def presigned_part_url(session, part_number):
+    """Presigned PUT URL for one part of an upload session"""
+    storage = _storage()
+    return storage.bucket.meta.client.generate_presigned_url(
+        'upload_part',
+        Params={
+            'Bucket': storage.bucket_name,
+            'Key': s3_key(storage, session.file_name),
+            'UploadId': session.multipart_upload_id,
+            'PartNumber': part_number,
+        },
+        ExpiresIn=settings.DIRECT_UPLOAD_EXPIRY,
+    )
+
+
+def uploaded_parts(session):
+    """Parts S3 holds for the session, [{'PartNumber', 'Size', 'ETag'}, ...] in order"""
+    storage = _storage()
+    client = storage.bucket.meta.client
+    params = {
+        'Bucket': storage.bucket_name,
+        'Key': s3_key(storage, session.file_name),
+        'UploadId': session.multipart_upload_id,
+    }
+    parts = []
+    while True:
+        page = client.list_parts(**params)
+        parts.extend(page.get('Parts', []))
+        if not page.get('IsTruncated'):
+            return parts
+        params['PartNumberMarker'] = page['NextPartNumberMarker']
+
+
+def received_offset(session, parts):
+    """Bytes received without a gap from the start of the file"""
+    sizes = {part['PartNumber']: part['Size'] for part in parts}
+    offset = 0
+    for number in range(1, session.part_count + 1):
+        if sizes.get(number) != _expected_part_size(session, number):
+            break
+        offset += sizes[number]
+    return offset
+
+
+def _expected_part_size(session, number):
+    return min(session.part_size, session.file_size - (number - 1) * session.part_size)
+
+
+def missing_parts(session, parts):
+    """Part numbers that are absent or not of the expected size"""
+    sizes = {part['PartNumber']: part['Size'] for part in parts}
+    return [
+        number for number in range(1, session.part_count + 1)
+        if sizes.get(number) != _expected_part_size(session, number)
+    ]
+
+
+def complete_session(session, parts):
+    """Assemble the uploaded parts into the session's object"""
+    storage = _storage()
+    storage.bucket.meta.client.complete_multipart_upload(
+        Bucket=storage.bucket_name,
+        Key=s3_key(storage, session.file_name),
+        UploadId=session.multipart_upload_id,
+        MultipartUpload={'Parts': [
+            {'PartNumber': part['PartNumber'], 'ETag': part['ETag']}
+            for part in parts
+            if part['PartNumber'] <= session.part_count
+        ]},
+    )
+
+
+def abort_session(session):
+    storage = _storage()
+    try:
+        storage.bucket.meta.client.abort_multipart_upload(
+            Bucket=storage.bucket_name,
+            Key=s3_key(storage, session.file_name),
+            UploadId=session.multipart_upload_id,
+        )
+    except Exception as exc:
+        logger.warning("Could not abort multipart upload of session %s: %s", session.id, exc)
+
+
+def discard_upload(submission):
+    try:
+        _storage().delete(submission.file.name)
+    except Exception as exc:
+        logger.warning("Could not delete upload %s: %s", submission.file.name, exc)
@@ -0,0 +1,40 @@
+"""
+Quick provisional estimates for long documents.
+
+When a long document is analyzed from extracted text, the analyze stage
+first scores a stratified sample of QUICK_ESTIMATE_SAMPLE paragraphs (one
+from each equal slice of the document) and stores the outcome as a Result
+with is_provisional set, which the status endpoint and the results API
+show within seconds. The full analysis then runs as usual and the persist
+stage replaces the provisional Result. Sampled paragraphs are not sent to
+the ML service a second time.
+"""
+import random
+
+from django.conf import settings
+
+from apps.results.models import Result
+
+
+def wants_estimate(submission, paragraphs):
+    """Whether to estimate before the full analysis (not again on a retry)"""
+    return (
+        settings.QUICK_ESTIMATE_ENABLED
+        and len(paragraphs) >= settings.QUICK_ESTIMATE_MIN_PARAGRAPHS
+        and not Result.objects.filter(submission=submission).exists()
+    )
+
+
+def stratified_sample(submission_id, paragraph_count, size=None):
+    """
+    Paragraph numbers (1-based, ascending) of one random paragraph from
+    each of `size` equal slices of the document; repeatable per submission.
+    """
+    size = min(size or settings.QUICK_ESTIMATE_SAMPLE, paragraph_count)
+    rng = random.Random(str(submission_id))
+    numbers = []
+    for stratum in range(size):
+        start = stratum * paragraph_count // size
+        end = (stratum + 1) * paragraph_count // size
+        numbers.append(rng.randrange(start, end) + 1)
+    return numbers
@@ -0,0 +1,233 @@
+"""
+Per-submission processing leases.
+
+A submission can be delivered to more than one worker at once: a retry
+scheduled while _defer_and_process_next kicks the same row, a resume that
+queues it again, or a broker redelivery. extract_paragraphs_from_pdf takes
+a Redis lease before doing any work, and a second delivery that finds the
+lease held returns straight away. The lease token travels with the
+submission through the pipeline stages, so each stage re-adopts the same
+lease instead of competing for a new one.
+
+Handing the lease to the next stage rewrites it to a handed-off marker
+(HANDED_OFF_PREFIX + token), and only that marker can be adopted. Once a
+stage has adopted the lease, a duplicate delivery of the same message
+finds the plain token, or no lease at all, and stops.
+
+The lease expires after SUBMISSION_LEASE_SECONDS unless a heartbeat
+thread keeps extending it, so a crashed worker never blocks a submission
+for long. In webhook mode the lease is handed off to the pending callback,
+and MLCallbackView releases it once the result arrives.
+
+Since every live stage holds the lease or has it handed off, a processing
+submission without one has been abandoned by a worker that died;
+unleased_for() tells reap_stale_submissions which ones have stayed so.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from apps.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'submission:lease'
+HANDED_OFF_PREFIX = 'handed:'
+# When each unleased processing submission was first seen without a lease
+UNLEASED_KEY = 'submission:lease:missing'
+
+# Only the holder may extend or release its lease
+_EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Mark our lease as handed off, to be adopted by the next stage
+_HAND_OFF_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Only a lease in the handed-off state can be adopted, and only once
+_ADOPT_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _key(submission_id):
+    return f'{KEY_PREFIX}:{submission_id}'
+
+
+def _handed_off(token):
+    return f'{HANDED_OFF_PREFIX}{token}'
+
+
+class SubmissionLease:
+    """Exclusive, self-extending claim on one submission"""
+
+    def __init__(self, submission_id, ttl=None, token=None):
+        self.submission_id = submission_id
+        self.ttl = ttl or settings.SUBMISSION_LEASE_SECONDS
+        self.token = token or uuid.uuid4().hex
+        self.lost = False
+        self._held = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self):
+        """Take the lease; False when another worker holds it"""
+        try:
+            acquired = get_redis().set(_key(self.submission_id), self.token, nx=True, ex=self.ttl)
+        except RedisError as exc:
+            logger.warning("Lease store unavailable, processing %s unlocked: %s", self.submission_id, exc)
+            return True
+        if not acquired:
+            return False
+
+        self._start_heartbeat()
+        return True
+
+    def adopt(self):
+        """Take over a lease handed off by an earlier stage; False if it was claimed"""
+        try:
+            adopted = get_redis().eval(
+                _ADOPT_SCRIPT, 1, _key(self.submission_id), _handed_off(self.token), self.token, self.ttl,
+            )
+        except RedisError as exc:
+            logger.warning("Lease store unavailable, processing %s unlocked: %s", self.submission_id, exc)
+            return True
+        if not adopted:
+            return False
+
+        self._start_heartbeat()
+        return True
+
+    def _start_heartbeat(self):
+        self._held = True
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl / 3):
+            if not self._extend(self.ttl):
+                self.lost = True
+                logger.warning("Lease on submission %s was lost", self.submission_id)
+                return
+
+    def _extend(self, seconds):
+        try:
+            return bool(get_redis().eval(
+                _EXTEND_SCRIPT, 1, _key(self.submission_id), self.token, int(seconds * 1000),
+            ))
+        except RedisError as exc:
+            logger.warning("Could not extend lease on submission %s: %s", self.submission_id, exc)
+            # Keep working; the key simply expires if the outage lasts
+            return True
+
+    def _stop_heartbeat(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+
+    def hand_off(self, seconds):
+        """Keep the lease for `seconds` for whoever adopts it next"""
+        self._stop_heartbeat()
+        if not self._held:
+            return
+        self._held = False
+        try:
+            get_redis().eval(
+                _HAND_OFF_SCRIPT, 1, _key(self.submission_id),
+                self.token, _handed_off(self.token), int(seconds * 1000),
+            )
+        except RedisError as exc:
+            logger.warning("Could not hand off lease on submission %s: %s", self.submission_id, exc)
+
+    def release(self):
+        self._stop_heartbeat()
+        if not self._held:
+            return
+        self._held = False
+        try:
+            get_redis().eval(_RELEASE_SCRIPT, 1, _key(self.submission_id), self.token)
+        except RedisError as exc:
+            logger.warning("Could not release lease on submission %s: %s", self.submission_id, exc)
+
+
+def handed_off_lease(submission_id, seconds):
+    """
+    A new lease, already handed off, for a stage queued without one (a
+    resumed submission); returns its token, or None if the submission is
+    claimed.
+    """
+    token = uuid.uuid4().hex
+    try:
+        if not get_redis().set(_key(submission_id), _handed_off(token), nx=True, ex=seconds):
+            return None
+    except RedisError as exc:
+        logger.warning("Lease store unavailable, resuming %s unlocked: %s", submission_id, exc)
+    return token
+
+
+def release_handed_off_lease(submission_id):
+    """Drop a lease that was handed off to an ML callback"""
+    try:
+        get_redis().delete(_key(submission_id))
+    except RedisError as exc:
+        logger.warning("Could not release lease on submission %s: %s", submission_id, exc)
+
+
+def unleased_for(submission_ids, seconds):
+    """
+    Of the given processing submissions, those that have had no lease on
+    every check for at least `seconds`. Submissions that hold a lease again
+    or are no longer passed in are forgotten.
+    """
+    redis_client = get_redis()
+    submission_ids = [str(submission_id) for submission_id in submission_ids]
+    pipe = redis_client.pipeline()
+    for submission_id in submission_ids:
+        pipe.exists(_key(submission_id))
+    held = pipe.execute()
+    missing = {submission_id for submission_id, exists in zip(submission_ids, held) if not exists}
+
+    now = time.time()
+    first_seen = dict(redis_client.zrange(UNLEASED_KEY, 0, -1, withscores=True))
+    pipe = redis_client.pipeline()
+    forgotten = [submission_id for submission_id in first_seen if submission_id not in missing]
+    if forgotten:
+        pipe.zrem(UNLEASED_KEY, *forgotten)
+    if missing:
+        pipe.zadd(UNLEASED_KEY, {submission_id: now for submission_id in missing}, nx=True)
+    pipe.execute()
+    return [
+        submission_id for submission_id in missing
+        if first_seen.get(submission_id, now) <= now - seconds
+    ]
+
+
+def forget_unleased(submission_id):
+    try:
+        get_redis().zrem(UNLEASED_KEY, str(submission_id))
+    except RedisError as exc:
+        logger.warning("Could not update unleased submissions: %s", exc)
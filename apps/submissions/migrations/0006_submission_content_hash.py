@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0004_remove_assignment_max_score'),
+        ('submissions', '0005_alter_submission_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the uploaded file', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='model_version',
+            field=models.CharField(blank=True, default='', help_text='ML model version used for analysis', max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['content_hash', 'model_version'], name='submissions_content_89d9a9_idx'),
+        ),
+    ]
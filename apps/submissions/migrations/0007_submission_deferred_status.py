@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0006_submission_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submission',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('processing', 'Processing'), ('deferred', 'Deferred'), ('completed', 'Completed'), ('failed', 'Failed'), ('terminated', 'Terminated')], default='queued', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0007_submission_deferred_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='ml_checkpoint',
+            field=models.CharField(blank=True, default='', help_text='Stored ML response awaiting persistence', max_length=255),
+        ),
+    ]
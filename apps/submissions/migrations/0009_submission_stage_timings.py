@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0008_submission_ml_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict, help_text='Start time and duration of each pipeline stage'),
+        ),
+    ]
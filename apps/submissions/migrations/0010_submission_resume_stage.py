@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0009_submission_stage_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='resume_stage',
+            field=models.CharField(blank=True, default='', help_text='Pipeline stage to continue from after a pause', max_length=20),
+        ),
+    ]
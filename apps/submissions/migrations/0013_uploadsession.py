@@ -0,0 +1,39 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:50
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0005_assignment_batch_analysis'),
+        ('submissions', '0012_submission_uploading_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('assignment_name', models.CharField(max_length=255)),
+                ('original_filename', models.CharField(max_length=255)),
+                ('file_size', models.IntegerField(help_text='File size in bytes')),
+                ('part_size', models.IntegerField(help_text='Bytes per part; the last part may be shorter')),
+                ('file_name', models.CharField(help_text='Storage name the parts are assembled into', max_length=255)),
+                ('multipart_upload_id', models.CharField(help_text='S3 multipart upload id', max_length=1024)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('assignment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='classes.assignment')),
+                ('submission', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_session', to='submissions.submission')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'upload_sessions',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,288 @@
+"""
+Pooled HTTP client for the ML service.
+
+Each worker process keeps one httpx.Client so submissions reuse keep-alive
+connections instead of paying TCP/TLS setup on every request. The client is
+created in Celery's worker_process_init hook (see config/celery.py) and
+lazily anywhere else, and is rebuilt automatically after a fork. Requests
+are routed across the ML node pool by ml_pool.lease() and admitted by the
+shared circuit breaker / concurrency limiter in ml_guard.
+"""
+import asyncio
+import json
+import logging
+import os
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+
+import httpx
+from django.conf import settings
+
+from apps.core.exceptions import MLServiceError
+from . import ml_guard, ml_pool
+from .cancellation import SubmissionCancelled
+from .streaming import multipart_for_batch, multipart_for_submission
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def _client_options(max_connections=None):
+    max_connections = max_connections or settings.ML_CLIENT_MAX_CONNECTIONS
+    return {
+        'headers': {
+            'X-API-Key': settings.ML_SERVICE_API_KEY or 'ai-content-evaluator-by-salman-and-ali',
+        },
+        'limits': httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(settings.ML_CLIENT_MAX_KEEPALIVE, max_connections),
+            keepalive_expiry=settings.ML_CLIENT_KEEPALIVE_EXPIRY,
+        ),
+        'timeout': MLClient.timeout_for(0),
+    }
+
+
+def _origin(url):
+    url = httpx.URL(url)
+    return url.scheme, url.host, url.port
+
+
+def _admit(timeout):
+    """Ask the shared guard for a call slot; slow calls count against the window"""
+    return ml_guard.admit(timeout.read * settings.ML_LIMIT_LATENCY_FRACTION)
+
+
+@contextmanager
+def _abandon_on_cancel(permit, node):
+    # A terminated submission says nothing about the service's health
+    try:
+        yield
+    except (SubmissionCancelled, asyncio.CancelledError):
+        permit.abandon()
+        node.abandon()
+        raise
+
+
+def _record_answer(response, permit, node):
+    # Client errors (bad PDF, auth) still mean the service itself is healthy
+    if response.status_code < 500:
+        permit.succeeded()
+        node.succeeded()
+
+
+def _upload_headers(body):
+    return {
+        'Content-Type': body.content_type,
+        'Content-Length': str(len(body)),
+    }
+
+
+class MLClient:
+    """Thin wrapper around a pooled httpx.Client for the ML endpoints"""
+
+    def __init__(self):
+        self._http = httpx.Client(**_client_options())
+
+    @staticmethod
+    def timeout_for(size_bytes):
+        """Per-phase timeouts scaled by the size of the uploaded file"""
+        size_mb = size_bytes / MB
+        read = min(
+            settings.ML_READ_TIMEOUT_BASE + settings.ML_READ_TIMEOUT_PER_MB * size_mb,
+            settings.ML_READ_TIMEOUT_MAX,
+        )
+        write = settings.ML_WRITE_TIMEOUT_BASE + settings.ML_WRITE_TIMEOUT_PER_MB * size_mb
+        return httpx.Timeout(
+            connect=settings.ML_CONNECT_TIMEOUT,
+            read=read,
+            write=write,
+            pool=settings.ML_POOL_TIMEOUT,
+        )
+
+    @contextmanager
+    def analyze_pdf(self, submission, callback=None, name=None, cancel_token=None):
+        """
+        Stream a submission's PDF to /api/analyze_pdf and yield the open
+        response so the body can be decoded incrementally. `name` sends
+        another stored file instead, e.g. a page-range shard. The upload
+        stops between chunks once `cancel_token` fires.
+
+        With `callback` form fields the ML service may instead answer
+        202 Accepted and POST the analysis back to the callback URL later.
+        """
+        body = multipart_for_submission(submission, fields=callback, name=name)
+        timeout = self.timeout_for(len(body))
+        with _admit(timeout) as permit, ml_pool.lease() as node, _abandon_on_cancel(permit, node):
+            with self._http.stream(
+                'POST', f'{node.url}/api/analyze_pdf',
+                content=body if cancel_token is None else cancel_token.iter_checked(body),
+                headers=_upload_headers(body),
+                timeout=timeout,
+            ) as response:
+                _record_answer(response, permit, node)
+                if response.status_code not in (200, 202):
+                    response.read()
+                    raise MLServiceError(f"ML service error {response.status_code}: {response.text}")
+                yield response
+
+    @contextmanager
+    def analyze_batch(self, submissions):
+        """
+        Stream several submissions' PDFs to /api/analyze_pdf_batch in one
+        request and yield the open response. Its "results" array holds one
+        analysis per file in upload order (see ml_stream.iter_batch_results);
+        an entry with an "error" key means that file could not be analyzed.
+        """
+        body = multipart_for_batch(submissions)
+        timeout = self.timeout_for(len(body))
+        with _admit(timeout) as permit, ml_pool.lease() as node, _abandon_on_cancel(permit, node):
+            with self._http.stream(
+                'POST', f'{node.url}/api/analyze_pdf_batch',
+                content=body,
+                headers=_upload_headers(body),
+                timeout=timeout,
+            ) as response:
+                _record_answer(response, permit, node)
+                if response.status_code != 200:
+                    response.read()
+                    raise MLServiceError(f"ML service error {response.status_code}: {response.text}")
+                yield response
+
+    @contextmanager
+    def analyze_text(self, texts):
+        """
+        Send paragraph texts to /api/analyze_text and yield the open
+        response. The request body is {"paragraphs": [text, ...]} and the
+        answer has the shape of an /api/analyze_pdf response without the
+        report, with one paragraph per text in the same order.
+        """
+        body = json.dumps({'paragraphs': texts}).encode('utf-8')
+        timeout = self.timeout_for(len(body))
+        with _admit(timeout) as permit, ml_pool.lease() as node, _abandon_on_cancel(permit, node):
+            with self._http.stream(
+                'POST', f'{node.url}/api/analyze_text',
+                content=body,
+                headers={'Content-Type': 'application/json'},
+                timeout=timeout,
+            ) as response:
+                _record_answer(response, permit, node)
+                if response.status_code != 200:
+                    response.read()
+                    raise MLServiceError(f"ML service error {response.status_code}: {response.text}")
+                yield response
+
+    @contextmanager
+    def render_report(self, submission, analysis):
+        """
+        Have /api/render_report draw the PDF report on the original for an
+        analysis made from extracted text or a slim copy and yield the open
+        response (the PDF bytes).
+        The multipart request carries the analysis JSON as the "analysis"
+        field and the submission's PDF as "file".
+        """
+        body = multipart_for_submission(submission, fields={'analysis': analysis})
+        timeout = self.timeout_for(len(body))
+        with _admit(timeout) as permit, ml_pool.lease() as node, _abandon_on_cancel(permit, node):
+            with self._http.stream(
+                'POST', f'{node.url}/api/render_report',
+                content=body,
+                headers=_upload_headers(body),
+                timeout=timeout,
+            ) as response:
+                _record_answer(response, permit, node)
+                if response.status_code != 200:
+                    response.read()
+                    raise MLServiceError(f"ML service error {response.status_code}: {response.text}")
+                yield response
+
+    def download(self, url):
+        """
+        Fetch a report the ML service returned as a URL. The pooled client
+        sends the API key, so it is only used for the ML nodes' own URLs;
+        anything else (e.g. a presigned storage URL) is fetched without it.
+        """
+        if _origin(url) in {_origin(node) for node in ml_pool.nodes()}:
+            response = self._http.get(url)
+        else:
+            response = httpx.get(url, timeout=self.timeout_for(0))
+        if response.status_code != 200:
+            return None
+        return response.content
+
+    def close(self):
+        self._http.close()
+
+
+class AsyncMLClient:
+    """asyncio counterpart of MLClient used by the async executor"""
+
+    def __init__(self, max_connections=None):
+        self._http = httpx.AsyncClient(**_client_options(max_connections))
+
+    @asynccontextmanager
+    async def analyze_pdf(self, submission, name=None):
+        """
+        Stream a stored PDF (`name`, by default the submission's own) to
+        /api/analyze_pdf and yield the open response. The guard and the
+        node pool talk to Redis, so they are entered and left in a thread.
+        """
+        body = await asyncio.to_thread(multipart_for_submission, submission, name=name)
+        timeout = MLClient.timeout_for(len(body))
+        guards = ExitStack()
+        try:
+            permit = await asyncio.to_thread(guards.enter_context, _admit(timeout))
+            node = await asyncio.to_thread(guards.enter_context, ml_pool.lease())
+            with _abandon_on_cancel(permit, node):
+                async with self._http.stream(
+                    'POST', f'{node.url}/api/analyze_pdf',
+                    content=_aiter_body(body),
+                    headers=_upload_headers(body),
+                    timeout=timeout,
+                ) as response:
+                    _record_answer(response, permit, node)
+                    if response.status_code != 200:
+                        await response.aread()
+                        raise MLServiceError(f"ML service error {response.status_code}: {response.text}")
+                    yield response
+        finally:
+            await asyncio.to_thread(guards.close)
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+async def _aiter_body(body):
+    """Read a blocking body iterator from a worker thread, chunk by chunk"""
+    chunks = iter(body)
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+_client = None
+_client_pid = None
+
+
+def init_client():
+    """Create this process's client, replacing any inherited from a parent"""
+    global _client, _client_pid
+    _client = MLClient()
+    _client_pid = os.getpid()
+    logger.info("ML client initialised for process %s", _client_pid)
+    return _client
+
+
+def get_client():
+    if _client is None or _client_pid != os.getpid():
+        return init_client()
+    return _client
+
+
+def close_client():
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        _client.close()
+    _client = None
+    _client_pid = None
@@ -0,0 +1,187 @@
+"""
+Circuit breaker and adaptive concurrency limiter for ML calls.
+
+Both are kept in Redis so every Celery worker shares them:
+
+- The breaker opens after ML_BREAKER_FAILURE_THRESHOLD consecutive failed
+  calls and rejects calls for ML_BREAKER_RESET_SECONDS. After that a single
+  trial call is let through (half-open); its outcome closes or re-opens it.
+- The limiter caps in-flight ML calls with an AIMD window: every fast
+  success grows the limit by 1/limit, every failure or slow call multiplies
+  it by ML_LIMIT_BACKOFF.
+
+Callers that are turned away get MLUnavailable with a retry_after hint and
+should park the submission instead of hammering a degraded service.
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from apps.core.exceptions import MLServiceError
+from apps.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+BREAKER_OPEN_UNTIL_KEY = 'ml:breaker:open_until'
+BREAKER_FAILURES_KEY = 'ml:breaker:failures'
+BREAKER_TRIAL_KEY = 'ml:breaker:trial'
+LIMIT_KEY = 'ml:limiter:limit'
+INFLIGHT_KEY = 'ml:limiter:inflight'
+
+# Drop stale permits, then take one if the in-flight set is below the limit
+_ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local limit = tonumber(redis.call('GET', KEYS[2]) or ARGV[3])
+if redis.call('ZCARD', KEYS[1]) < math.floor(limit) then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[4])
+    return 1
+end
+return 0
+"""
+
+# Additive increase on fast success, multiplicative decrease otherwise
+_ADJUST_SCRIPT = """
+local limit = tonumber(redis.call('GET', KEYS[1]) or ARGV[1])
+if ARGV[2] == '1' then
+    limit = limit + 1 / limit
+else
+    limit = limit * tonumber(ARGV[3])
+end
+limit = math.max(tonumber(ARGV[4]), math.min(tonumber(ARGV[5]), limit))
+redis.call('SET', KEYS[1], limit)
+return tostring(limit)
+"""
+
+
+class MLUnavailable(MLServiceError):
+    """The breaker is open or the concurrency limit is reached"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CallPermit:
+    """One admitted ML call; call succeeded() once the service answered"""
+
+    def __init__(self, expected_seconds):
+        self.id = uuid.uuid4().hex
+        self.expected_seconds = expected_seconds
+        self.started = time.monotonic()
+        self.latency = None
+        self.abandoned = False
+
+    def succeeded(self):
+        self.latency = time.monotonic() - self.started
+
+    def abandon(self):
+        """The caller gave up (e.g. cancellation); free the slot without judging the service"""
+        self.abandoned = True
+
+
+def breaker_state():
+    """Return ('closed' | 'open' | 'half_open', seconds until the next trial)"""
+    open_until = get_redis().get(BREAKER_OPEN_UNTIL_KEY)
+    if not open_until:
+        return 'closed', 0
+    remaining = float(open_until) - time.time()
+    if remaining > 0:
+        return 'open', remaining
+    return 'half_open', 0
+
+
+def is_accepting():
+    """Cheap check used before dispatching more work to the ML service"""
+    try:
+        return breaker_state()[0] != 'open'
+    except RedisError:
+        return True
+
+
+@contextmanager
+def admit(expected_seconds):
+    """
+    Admit one ML call or raise MLUnavailable. `expected_seconds` is the
+    latency budget; slower successful calls still shrink the window.
+    """
+    try:
+        permit = _acquire(expected_seconds)
+    except RedisError as exc:
+        logger.warning("ML guard unavailable, allowing call: %s", exc)
+        yield CallPermit(expected_seconds)
+        return
+
+    try:
+        yield permit
+    finally:
+        _release(permit)
+
+
+def _acquire(expected_seconds):
+    redis_client = get_redis()
+
+    state, retry_after = breaker_state()
+    if state == 'open':
+        raise MLUnavailable('ML circuit breaker is open', retry_after=retry_after)
+    if state == 'half_open':
+        trial = redis_client.set(BREAKER_TRIAL_KEY, 1, nx=True, ex=settings.ML_BREAKER_RESET_SECONDS)
+        if not trial:
+            raise MLUnavailable('ML circuit breaker trial in progress', retry_after=settings.ML_DEFER_SECONDS)
+
+    permit = CallPermit(expected_seconds)
+    now = time.time()
+    acquired = redis_client.eval(
+        _ACQUIRE_SCRIPT, 2, INFLIGHT_KEY, LIMIT_KEY,
+        now - settings.ML_READ_TIMEOUT_MAX * 2, now, settings.ML_LIMIT_INITIAL, permit.id,
+    )
+    if not acquired:
+        raise MLUnavailable('ML concurrency limit reached', retry_after=settings.ML_DEFER_SECONDS)
+    return permit
+
+
+def _release(permit):
+    ok = permit.latency is not None
+    fast = ok and permit.latency <= permit.expected_seconds
+    try:
+        redis_client = get_redis()
+        redis_client.zrem(INFLIGHT_KEY, permit.id)
+        if permit.abandoned:
+            return
+        redis_client.eval(
+            _ADJUST_SCRIPT, 1, LIMIT_KEY,
+            settings.ML_LIMIT_INITIAL, '1' if fast else '0', settings.ML_LIMIT_BACKOFF,
+            settings.ML_LIMIT_MIN, settings.ML_LIMIT_MAX,
+        )
+        if ok:
+            redis_client.delete(BREAKER_FAILURES_KEY, BREAKER_OPEN_UNTIL_KEY, BREAKER_TRIAL_KEY)
+        else:
+            _record_failure(redis_client)
+    except RedisError as exc:
+        logger.warning("ML guard unavailable: %s", exc)
+
+
+def _record_failure(redis_client):
+    failures = redis_client.incr(BREAKER_FAILURES_KEY)
+    half_open = redis_client.exists(BREAKER_OPEN_UNTIL_KEY)
+    if half_open or failures >= settings.ML_BREAKER_FAILURE_THRESHOLD:
+        redis_client.set(BREAKER_OPEN_UNTIL_KEY, time.time() + settings.ML_BREAKER_RESET_SECONDS)
+        redis_client.delete(BREAKER_TRIAL_KEY)
+        logger.warning(
+            "ML circuit breaker opened for %ds after %d failures",
+            settings.ML_BREAKER_RESET_SECONDS, failures,
+        )
+
+
+def limiter_stats():
+    redis_client = get_redis()
+    state, retry_after = breaker_state()
+    return {
+        'breaker': state,
+        'retry_after': round(retry_after, 1),
+        'limit': float(redis_client.get(LIMIT_KEY) or settings.ML_LIMIT_INITIAL),
+        'in_flight': redis_client.zcard(INFLIGHT_KEY),
+    }
@@ -0,0 +1,215 @@
+"""
+Health-weighted routing across a pool of ML nodes.
+
+ML_SERVICE_URLS lists the FastAPI ML workers. Each analysis is routed to
+the admitted node with the fewest outstanding requests (ties go to the
+lower latency EWMA). Counters and stats live in Redis so every Celery
+worker shares one view of the pool. Nodes are ejected after repeated
+failures or a failed/slow health probe and re-admitted by the periodic
+probe_ml_nodes task, or automatically once ML_NODE_EJECT_SECONDS passes.
+
+In-flight requests are kept per node as a sorted set of call ids scored by
+start time. Entries older than any call can last (twice ML_READ_TIMEOUT_MAX)
+are ignored and pruned, so a worker killed mid-call cannot leave a node
+looking busy for good.
+"""
+import logging
+import random
+import time
+import uuid
+from contextlib import contextmanager
+
+import httpx
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from apps.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ml:node'
+
+
+def _key(url, suffix):
+    return f'{KEY_PREFIX}:{url}:{suffix}'
+
+
+def nodes():
+    return list(settings.ML_SERVICE_URLS) or [settings.ML_SERVICE_URL.rstrip('/')]
+
+
+def choose_node():
+    """Pick the admitted node with the fewest in-flight requests"""
+    urls = nodes()
+    if len(urls) == 1:
+        return urls[0]
+
+    cutoff = _inflight_cutoff()
+    try:
+        pipe = get_redis().pipeline()
+        for url in urls:
+            pipe.zcount(_key(url, 'calls'), cutoff, '+inf')
+            pipe.hmget(_key(url, 'stats'), 'ejected_until', 'latency_ewma')
+        values = pipe.execute()
+    except RedisError as exc:
+        logger.warning("ML node registry unavailable, routing randomly: %s", exc)
+        return random.choice(urls)
+
+    now = time.time()
+    admitted, everyone = [], []
+    for index, url in enumerate(urls):
+        inflight = int(values[index * 2] or 0)
+        ejected_until, latency = values[index * 2 + 1]
+        candidate = (inflight, float(latency or 0), random.random(), url)
+        everyone.append(candidate)
+        if not ejected_until or float(ejected_until) <= now:
+            admitted.append(candidate)
+
+    if not admitted:
+        logger.warning("All ML nodes are ejected, routing to the least loaded one")
+        admitted = everyone
+    return min(admitted)[-1]
+
+
+class NodeLease:
+    """One request's claim on a node; call succeeded() once it answered"""
+
+    def __init__(self, url):
+        self.url = url
+        self.id = uuid.uuid4().hex
+        self.started = time.monotonic()
+        self.latency = None
+        self.abandoned = False
+
+    def succeeded(self):
+        self.latency = time.monotonic() - self.started
+
+    def abandon(self):
+        """The caller gave up; keep the node's stats out of it"""
+        self.abandoned = True
+
+
+@contextmanager
+def lease():
+    """Route a request to a node and account for it while it is in flight"""
+    node = NodeLease(choose_node())
+    _track_call(node)
+    try:
+        yield node
+    finally:
+        _untrack_call(node)
+        if not node.abandoned:
+            ok = node.latency is not None
+            record_outcome(node.url, node.latency if ok else time.monotonic() - node.started, ok)
+
+
+def _inflight_cutoff():
+    # No call outlives its read timeout; older entries were left by killed workers
+    return time.time() - settings.ML_READ_TIMEOUT_MAX * 2
+
+
+def _track_call(node):
+    key = _key(node.url, 'calls')
+    try:
+        pipe = get_redis().pipeline()
+        pipe.zremrangebyscore(key, '-inf', _inflight_cutoff())
+        pipe.zadd(key, {node.id: time.time()})
+        pipe.execute()
+    except RedisError as exc:
+        logger.warning("ML node registry unavailable: %s", exc)
+
+
+def _untrack_call(node):
+    try:
+        get_redis().zrem(_key(node.url, 'calls'), node.id)
+    except RedisError as exc:
+        logger.warning("ML node registry unavailable: %s", exc)
+
+
+def record_outcome(url, seconds, ok):
+    """Update a node's latency EWMA and failure streak"""
+    stats_key = _key(url, 'stats')
+    try:
+        redis_client = get_redis()
+        if ok:
+            previous = redis_client.hget(stats_key, 'latency_ewma')
+            alpha = settings.ML_NODE_LATENCY_ALPHA
+            ewma = seconds if previous is None else alpha * seconds + (1 - alpha) * float(previous)
+            pipe = redis_client.pipeline()
+            pipe.hset(stats_key, mapping={'latency_ewma': round(ewma, 3), 'consecutive_failures': 0})
+            pipe.hincrby(stats_key, 'requests', 1)
+            pipe.execute()
+            return
+
+        redis_client.hincrby(stats_key, 'errors', 1)
+        failures = redis_client.hincrby(stats_key, 'consecutive_failures', 1)
+    except RedisError as exc:
+        logger.warning("ML node registry unavailable: %s", exc)
+        return
+
+    if failures >= settings.ML_NODE_MAX_FAILURES:
+        eject(url, f'{failures} consecutive failures')
+
+
+def eject(url, reason):
+    ejected_until = time.time() + settings.ML_NODE_EJECT_SECONDS
+    get_redis().hset(_key(url, 'stats'), 'ejected_until', ejected_until)
+    logger.warning("ML node %s ejected for %ds: %s", url, settings.ML_NODE_EJECT_SECONDS, reason)
+
+
+def readmit(url):
+    stats_key = _key(url, 'stats')
+    redis_client = get_redis()
+    if redis_client.hdel(stats_key, 'ejected_until'):
+        logger.info("ML node %s re-admitted", url)
+    redis_client.hset(stats_key, 'consecutive_failures', 0)
+
+
+def probe_nodes():
+    """Health-check every node, ejecting failing or slow ones"""
+    with httpx.Client(timeout=settings.ML_NODE_PROBE_TIMEOUT) as http:
+        for url in nodes():
+            started = time.monotonic()
+            try:
+                healthy = http.get(f'{url}{settings.ML_NODE_HEALTH_PATH}').status_code == 200
+            except httpx.HTTPError:
+                healthy = False
+            elapsed = time.monotonic() - started
+
+            try:
+                get_redis().hset(_key(url, 'stats'), mapping={
+                    'probe_latency': round(elapsed, 3),
+                    'last_probe': time.time(),
+                })
+                if not healthy:
+                    eject(url, 'health probe failed')
+                elif elapsed > settings.ML_NODE_SLOW_PROBE_SECONDS:
+                    eject(url, f'health probe took {elapsed:.1f}s')
+                else:
+                    readmit(url)
+            except RedisError as exc:
+                logger.warning("ML node registry unavailable: %s", exc)
+                break
+
+    return node_stats()
+
+
+def node_stats():
+    """Per-node load, latency and admission state"""
+    now = time.time()
+    cutoff = _inflight_cutoff()
+    stats = []
+    redis_client = get_redis()
+    for url in nodes():
+        node = redis_client.hgetall(_key(url, 'stats'))
+        ejected_until = float(node.get('ejected_until') or 0)
+        stats.append({
+            'url': url,
+            'in_flight': redis_client.zcount(_key(url, 'calls'), cutoff, '+inf'),
+            'latency_ewma': float(node.get('latency_ewma') or 0),
+            'probe_latency': float(node.get('probe_latency') or 0),
+            'requests': int(node.get('requests') or 0),
+            'errors': int(node.get('errors') or 0),
+            'ejected': ejected_until > now,
+        })
+    return stats
@@ -0,0 +1,284 @@
+"""
+Incremental decoding of ML service responses.
+
+The analyze endpoints return one JSON object holding every paragraph and a
+base64 PDF report. Instead of materialising it with response.json(), the
+body is scanned chunk by chunk: paragraphs are yielded one at a time and
+the report string is yielded as a stream of text segments, so memory use
+does not grow with document length.
+
+Batch responses ({"results": [<analysis>, ...]}) are scanned the same way,
+one analysis at a time, and encode_ml_events() turns an analysis back into
+a stand-alone response body.
+"""
+import base64
+import binascii
+import codecs
+import json
+
+REPORT_KEYS = (
+    'pdf_report_base64', 'report_pdf_base64', 'pdf_base64', 'report_base64',
+)
+
+_WHITESPACE = ' \t\n\r'
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class MLStreamError(ValueError):
+    """Raised when the ML response body is not the expected JSON shape"""
+
+
+class _CharStream:
+    """Text cursor over an iterable of UTF-8 byte chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self._buf += text
+                return True
+        self._buf += self._decoder.decode(b'', final=True)
+        self._eof = True
+        return True
+
+    def peek(self):
+        """Next non-whitespace character without consuming it ('' at EOF)"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def next(self):
+        char = self.peek()
+        if not char:
+            raise MLStreamError('Unexpected end of ML response')
+        self._pos += 1
+        return char
+
+    def expect(self, char):
+        found = self.next()
+        if found != char:
+            raise MLStreamError(f'Expected {char!r} in ML response, found {found!r}')
+
+    def read_value(self):
+        """Decode one complete JSON value, pulling more chunks as needed"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise MLStreamError('Malformed JSON in ML response')
+                self._fill()
+                continue
+            # A number ending exactly at the buffer edge may be truncated
+            if end == len(self._buf) and not self._eof:
+                self._fill()
+                continue
+            self._pos = end
+            return value
+
+    def iter_string(self):
+        """Yield the text of a JSON string in segments; the opening quote is already consumed"""
+        while True:
+            if self._pos >= len(self._buf) and not self._fill():
+                raise MLStreamError('Unterminated string in ML response')
+            start = self._pos
+            buf = self._buf
+            while self._pos < len(buf) and buf[self._pos] not in '"\\':
+                self._pos += 1
+            if self._pos > start:
+                yield buf[start:self._pos]
+            if self._pos >= len(buf):
+                if self._eof:
+                    raise MLStreamError('Unterminated string in ML response')
+                continue
+            if buf[self._pos] == '"':
+                self._pos += 1
+                return
+            yield self._read_escape()
+
+    def _read_escape(self):
+        while len(self._buf) - self._pos < 6 and not self._eof:
+            self._fill()
+        escape = self._buf[self._pos + 1:self._pos + 2]
+        if escape == 'u':
+            try:
+                char = chr(int(self._buf[self._pos + 2:self._pos + 6], 16))
+            except ValueError:
+                raise MLStreamError('Invalid unicode escape in ML response')
+            self._pos += 6
+            return char
+        if escape not in _ESCAPES:
+            raise MLStreamError('Invalid escape in ML response')
+        self._pos += 2
+        return _ESCAPES[escape]
+
+
+def iter_ml_events(chunks):
+    """
+    Scan an ML analysis response and yield events in document order:
+
+    - ('paragraph', dict)            one entry of the "paragraphs" array
+    - ('report', iterator_of_str)    segments of a base64 report string
+    - ('field', key, value)          any other top-level key
+
+    A report iterator must be consumed before advancing; anything left
+    unread is drained automatically.
+    """
+    return _iter_object_events(_CharStream(chunks))
+
+
+def _iter_object_events(stream):
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+
+    while True:
+        key = stream.read_value()
+        if not isinstance(key, str):
+            raise MLStreamError('Expected an object key in ML response')
+        stream.expect(':')
+
+        if key == 'paragraphs' and stream.peek() == '[':
+            stream.next()
+            if stream.peek() == ']':
+                stream.next()
+            else:
+                while True:
+                    yield ('paragraph', stream.read_value())
+                    separator = stream.next()
+                    if separator == ']':
+                        break
+                    if separator != ',':
+                        raise MLStreamError('Malformed paragraphs array in ML response')
+        elif key in REPORT_KEYS and stream.peek() == '"':
+            stream.next()
+            segments = stream.iter_string()
+            yield ('report', segments)
+            for _ in segments:
+                pass
+        else:
+            yield ('field', key, stream.read_value())
+
+        separator = stream.next()
+        if separator == '}':
+            return
+        if separator != ',':
+            raise MLStreamError('Malformed object in ML response')
+
+
+def iter_batch_results(chunks):
+    """
+    Scan a batch response {"results": [<analysis>, ...]} and yield one event
+    iterator per analysis (see iter_ml_events), in upload order. Each must
+    be consumed before advancing; anything left unread is drained.
+    """
+    stream = _CharStream(chunks)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+
+    while True:
+        key = stream.read_value()
+        if not isinstance(key, str):
+            raise MLStreamError('Expected an object key in ML response')
+        stream.expect(':')
+
+        if key == 'results' and stream.peek() == '[':
+            stream.next()
+            if stream.peek() == ']':
+                stream.next()
+            else:
+                while True:
+                    events = _iter_object_events(stream)
+                    yield events
+                    for _ in events:
+                        pass
+                    separator = stream.next()
+                    if separator == ']':
+                        break
+                    if separator != ',':
+                        raise MLStreamError('Malformed results array in ML response')
+        else:
+            stream.read_value()
+
+        separator = stream.next()
+        if separator == '}':
+            return
+        if separator != ',':
+            raise MLStreamError('Malformed object in ML response')
+
+
+def encode_ml_events(events):
+    """Serialize iter_ml_events() events back into an analysis response body"""
+    separator = b''
+    paragraph_separator = None
+    yield b'{'
+    for event in events:
+        if event[0] == 'paragraph':
+            if paragraph_separator is None:
+                yield separator + b'"paragraphs": ['
+                paragraph_separator = b''
+            yield paragraph_separator + json.dumps(event[1]).encode('utf-8')
+            paragraph_separator = b', '
+            continue
+        if paragraph_separator is not None:
+            yield b']'
+            paragraph_separator = None
+            separator = b', '
+
+        if event[0] == 'report':
+            yield separator + b'"pdf_report_base64": "'
+            for segment in event[1]:
+                yield json.dumps(segment)[1:-1].encode('utf-8')
+            yield b'"'
+        else:
+            yield separator + json.dumps(event[1]).encode('utf-8') + b': ' + json.dumps(event[2]).encode('utf-8')
+        separator = b', '
+
+    if paragraph_separator is not None:
+        yield b']'
+    yield b'}'
+
+
+class Base64StreamDecoder:
+    """Decode base64 text that arrives in arbitrary-sized segments"""
+
+    def __init__(self):
+        self._pending = ''
+
+    def decode(self, text):
+        text = self._pending + ''.join(text.split())
+        usable = len(text) - len(text) % 4
+        self._pending = text[usable:]
+        if not usable:
+            return b''
+        try:
+            return base64.b64decode(text[:usable])
+        except (binascii.Error, ValueError):
+            raise MLStreamError('Invalid base64 report in ML response')
+
+    def flush(self):
+        if not self._pending:
+            return b''
+        pending, self._pending = self._pending, ''
+        try:
+            return base64.b64decode(pending + '=' * (-len(pending) % 4))
+        except (binascii.Error, ValueError):
+            raise MLStreamError('Invalid base64 report in ML response')
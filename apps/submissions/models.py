@@ -9,8 +9,11 @@ class Submission(models.Model):
     """PDF submission for AI detection"""
 
     STATUS_CHOICES = [
+        ('uploading', 'Waiting for upload'),
         ('queued', 'Queued'),
+        ('batched', 'Waiting for batch'),
         ('processing', 'Processing'),
+        ('deferred', 'Deferred'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
         ('terminated', 'Terminated'),
@@ -37,6 +40,11 @@ class Submission(models.Model):
     file = models.FileField(upload_to='submissions/%Y/%m/%d/')
     original_filename = models.CharField(max_length=255)
     file_size = models.IntegerField(help_text='File size in bytes')
+    content_hash = models.CharField(max_length=64, blank=True, default='', help_text='SHA-256 of the uploaded file')
+    model_version = models.CharField(max_length=50, blank=True, default='', help_text='ML model version used for analysis')
+    ml_checkpoint = models.CharField(max_length=255, blank=True, default='', help_text='Stored ML response awaiting persistence')
+    stage_timings = models.JSONField(default=dict, blank=True, help_text='Start time and duration of each pipeline stage')
+    resume_stage = models.CharField(max_length=20, blank=True, default='', help_text='Pipeline stage to continue from after a pause')
 
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
@@ -70,6 +78,7 @@ class Submission(models.Model):
             models.Index(fields=['user', '-submitted_at']),
             models.Index(fields=['status']),
             models.Index(fields=['assignment']),
+            models.Index(fields=['content_hash', 'model_version']),
         ]
 
     def __str__(self):
@@ -119,18 +128,58 @@ class Submission(models.Model):
         self.is_paused = True
         self.paused_at = timezone.now()
         self.paused_by = user
-        self.save()
+        # Only touch the pause fields; a worker may be updating status meanwhile
+        self.save(update_fields=['is_paused', 'paused_at', 'paused_by'])
 
     def resume(self):
         """Resume submission processing"""
         self.is_paused = False
         self.paused_at = None
         self.paused_by = None
-        self.save()
+        self.save(update_fields=['is_paused', 'paused_at', 'paused_by'])
     
     @property
     def class_obj(self):
         """Get class from assignment (for backward compatibility)"""
         if self.assignment:
             return self.assignment.class_obj
-        return None
\ No newline at end of file
+        return None
+
+class UploadSession(models.Model):
+    """Resumable multipart upload of a PDF; the Submission is created once it is complete"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    assignment = models.ForeignKey(
+        'classes.Assignment',
+        on_delete=models.CASCADE,
+        related_name='upload_sessions',
+        null=True,
+        blank=True
+    )
+    assignment_name = models.CharField(max_length=255)
+    original_filename = models.CharField(max_length=255)
+    file_size = models.IntegerField(help_text='File size in bytes')
+    part_size = models.IntegerField(help_text='Bytes per part; the last part may be shorter')
+    file_name = models.CharField(max_length=255, help_text='Storage name the parts are assembled into')
+    multipart_upload_id = models.CharField(max_length=1024, help_text='S3 multipart upload id')
+    submission = models.OneToOneField(
+        Submission,
+        on_delete=models.SET_NULL,
+        related_name='upload_session',
+        null=True,
+        blank=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'upload_sessions'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.original_filename} - {self.user.email}"
+
+    @property
+    def part_count(self):
+        return max(-(-self.file_size // self.part_size), 1)
@@ -0,0 +1,149 @@
+"""
+Paragraph-level analysis cache.
+
+Class submissions share a lot of text: the assignment prompt, standard
+citations, templates, and whole paragraphs carried over between
+resubmissions. Every analyzed paragraph is cached under a hash of its
+normalized text and the ML model version, and when the paragraph texts of
+a document are known up front, iter_text_analysis() sends only the
+uncached ones to the ML service (/api/analyze_text) and fills the rest
+from the cache.
+
+Normalization only folds Unicode forms and whitespace; case and
+punctuation can change a paragraph's score and are kept.
+"""
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .ml_client import get_client
+from .ml_stream import iter_ml_events
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+# Same cut-off as ParagraphResult.is_flagged
+FLAG_PERCENTAGE = 50.0
+
+
+def normalize_text(text):
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def paragraph_key(text, model_version=None):
+    digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+    return f'paragraph:{model_version or settings.ML_MODEL_VERSION}:{digest}'
+
+
+def lookup_many(texts):
+    """Cached ML paragraph entries for `texts`, in order; None where missing"""
+    if not settings.PARAGRAPH_CACHE_ENABLED:
+        return [None] * len(texts)
+    keys = [paragraph_key(text) for text in texts]
+    try:
+        found = cache.get_many(keys)
+    except Exception as exc:
+        logger.warning("Paragraph cache unavailable: %s", exc)
+        found = {}
+    return [
+        {**found[key], 'paragraph_text': text} if key in found else None
+        for key, text in zip(keys, texts)
+    ]
+
+
+def remember_many(paragraphs):
+    """Cache ML paragraph entries ({'paragraph_text': ..., 'ai_percentage': ...})"""
+    if not settings.PARAGRAPH_CACHE_ENABLED or not paragraphs:
+        return
+    entries = {
+        paragraph_key(paragraph['paragraph_text']): {
+            key: value for key, value in paragraph.items() if key != 'paragraph_text'
+        }
+        for paragraph in paragraphs
+        if paragraph.get('paragraph_text')
+    }
+    try:
+        cache.set_many(entries, settings.PARAGRAPH_CACHE_TIMEOUT)
+    except Exception as exc:
+        logger.warning("Paragraph cache unavailable: %s", exc)
+
+
+def iter_text_analysis(texts, cancel_token=None, known=None, grammar_score=None):
+    """
+    Yield an ML response (JSON bytes, without a report) for a document
+    given as paragraph texts. Paragraphs found in `known` (entries keyed by
+    normalized text, e.g. from a previous draft) or in the cache are
+    reused and only the rest is sent to the ML service; the document
+    summary is recomputed over all paragraphs. The grammar score comes
+    from the ML call, or `grammar_score` (default 0) when nothing was sent.
+    """
+    paragraphs = lookup_many(texts)
+    for index, text in enumerate(texts):
+        reused = (known or {}).get(normalize_text(text))
+        if reused is not None:
+            paragraphs[index] = {**reused, 'paragraph_text': text}
+
+    misses = list(dict.fromkeys(
+        text for text, paragraph in zip(texts, paragraphs) if paragraph is None
+    ))
+    logger.info("Reusing %d of %d paragraphs", len(texts) - len(misses), len(texts))
+
+    if misses:
+        analyzed, grammar_score = _analyze_texts(misses, cancel_token)
+    else:
+        analyzed, grammar_score = {}, grammar_score or 0
+    remember_many(list(analyzed.values()))
+    paragraphs = [
+        paragraph or analyzed[text]
+        for text, paragraph in zip(texts, paragraphs)
+    ]
+
+    yield b'{"paragraphs": ['
+    for index, paragraph in enumerate(paragraphs):
+        yield (b', ' if index else b'') + json.dumps(paragraph).encode('utf-8')
+
+    ai_total = sum(float(paragraph['ai_percentage']) for paragraph in paragraphs)
+    average_ai = round(ai_total / len(paragraphs), 2) if paragraphs else 0
+    document_summary = {
+        'average_ai_percentage': average_ai,
+        'average_human_percentage': round(100 - average_ai, 2),
+        'average_grammar_score': grammar_score,
+        'paragraphs_flagged_as_ai': sum(
+            1 for paragraph in paragraphs if float(paragraph['ai_percentage']) >= FLAG_PERCENTAGE
+        ),
+    }
+    yield b'], "document_summary": ' + json.dumps(document_summary).encode('utf-8') + b'}'
+
+
+def _analyze_texts(texts, cancel_token):
+    """Analyze paragraph texts with the ML service; returns ({text: entry}, grammar score)"""
+    analyzed = {}
+    summary = {}
+    with get_client().analyze_text(texts) as response:
+        chunks = response.iter_bytes(settings.ML_RESPONSE_CHUNK_SIZE)
+        if cancel_token is not None:
+            chunks = cancel_token.iter_checked(chunks)
+        returned = []
+        for event in iter_ml_events(chunks):
+            if event[0] == 'paragraph':
+                returned.append(event[1])
+            elif event[0] == 'field' and event[1] == 'document_summary':
+                summary = event[2] or {}
+            elif event[0] == 'report':
+                for _ in event[1]:
+                    pass
+
+    if len(returned) != len(texts):
+        raise ValueError(f'ML service returned {len(returned)} paragraphs for {len(texts)} texts')
+    for text, paragraph in zip(texts, returned):
+        # Keep our text; the cache key and the paragraph rows must match it
+        analyzed[text] = {**paragraph, 'paragraph_text': text}
+
+    grammar_score = summary.get('average_grammar_score') or summary.get('grammar_score', 0)
+    return analyzed, grammar_score
@@ -0,0 +1,67 @@
+"""
+Incremental re-analysis of resubmitted drafts.
+
+A student's resubmission for the same assignment usually changes a small
+part of the text. When the paragraphs are extracted locally (see
+text_extraction.py), each paragraph of the new draft whose normalized text
+also appears in the student's previous completed submission reuses that
+submission's ParagraphResult instead of being analyzed again; only changed
+and new paragraphs go to the ML service, and the Result summary is
+recomputed over the whole draft.
+
+Only a previous analysis made with the current ML model version is reused.
+"""
+import logging
+
+from django.conf import settings
+
+from .models import Submission
+from .paragraph_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+def previous_submission(submission):
+    """The student's latest earlier completed submission for the same assignment"""
+    if not submission.assignment_id:
+        return None
+    return (
+        Submission.objects
+        .filter(
+            user_id=submission.user_id,
+            assignment_id=submission.assignment_id,
+            status='completed',
+            model_version=settings.ML_MODEL_VERSION,
+            submitted_at__lt=submission.submitted_at,
+            result__isnull=False,
+        )
+        .exclude(id=submission.id)
+        .select_related('result')
+        .order_by('-submitted_at')
+        .first()
+    )
+
+
+def previous_paragraphs(submission):
+    """
+    ({normalized text: ML paragraph entry}, grammar score) of the previous
+    draft, or ({}, None) when there is nothing to reuse.
+    """
+    previous = previous_submission(submission)
+    if previous is None:
+        return {}, None
+
+    known = {}
+    for paragraph in previous.result.paragraphs.all():
+        features = paragraph.features or {}
+        known[normalize_text(paragraph.text_content)] = {
+            'paragraph_text': paragraph.text_content,
+            'ai_percentage': float(paragraph.ai_probability) * 100,
+            'bert': features.get('bert_score'),
+            'perplexity': features.get('perplexity'),
+        }
+    logger.info(
+        "Submission %s revises %s (%d paragraphs available for reuse)",
+        submission.id, previous.id, len(known),
+    )
+    return known, float(previous.result.grammar_score)
@@ -0,0 +1,332 @@
+"""
+Fair-share scheduling of submissions.
+
+Submissions are not sent to Celery as soon as they are uploaded. They wait
+in Redis and are dispatched only while fewer than SCHEDULER_MAX_IN_FLIGHT
+are in the pipeline. Dispatch order is weighted fair queuing:
+
+- every class (assignment submissions) or user (own evaluations) is a
+  flow; a submission's virtual finish tag is
+  max(virtual time, flow's last tag) + 1 / weight, and the lowest tag goes
+  next, so a class uploading 300 PDFs at a deadline takes turns with
+  everyone else instead of queueing in front of them,
+- guest uploads are a separate tier that gets one dispatch in
+  SCHEDULER_GUEST_EVERY while standard work is waiting,
+- aging: anything that has waited SCHEDULER_MAX_WAIT seconds goes next
+  regardless of tags, so no submission starves.
+
+Pipeline exits call release() to free the slot and dispatch the next
+submission. Slots of crashed workers expire after SCHEDULER_SLOT_TTL.
+
+Released slots feed an exponentially decayed count of completions per
+tier (time constant SCHEDULER_RATE_WINDOW); with the running average of
+ML seconds per MB it gives each waiting submission a queue position and
+an estimated completion time, and lets guest uploads be refused with a
+Retry-After while their backlog is too long (SCHEDULER_ADMISSION_CONTROL).
+"""
+import logging
+import math
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from apps.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+STANDARD_TIER = 'standard'
+GUEST_TIER = 'guest'
+
+QUEUE_KEY = 'sched:queue:{tier}'
+VTIME_KEY = 'sched:vtime:{tier}'
+FLOW_FINISH_KEY = 'sched:flow_finish:{tier}'
+ENQUEUED_KEY = 'sched:enqueued'
+TIER_KEY = 'sched:tier'
+FLOW_KEY = 'sched:flow'
+TURN_KEY = 'sched:turn'
+INFLIGHT_KEY = 'sched:inflight'
+INFLIGHT_TIER_KEY = 'sched:inflight_tier'
+RATE_KEY = 'sched:rate:{tier}'
+ML_SPEED_KEY = 'sched:ml_speed'
+
+MB = 1024 * 1024
+
+# Weight of the newest sample in the ML speed averages
+_SPEED_ALPHA = 0.2
+
+# Tag a submission with its virtual finish time; no-op if already waiting
+_PUSH_SCRIPT = """
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return false
+end
+local vtime = tonumber(redis.call('GET', KEYS[3]) or '0')
+local last = tonumber(redis.call('HGET', KEYS[2], ARGV[2]) or '0')
+local tag = math.max(vtime, last) + tonumber(ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[2], tag)
+redis.call('ZADD', KEYS[1], tag, ARGV[1])
+redis.call('ZADD', KEYS[4], 'NX', ARGV[4], ARGV[1])
+redis.call('HSET', KEYS[5], ARGV[1], ARGV[5])
+redis.call('HSET', KEYS[6], ARGV[1], ARGV[2])
+return tostring(tag)
+"""
+
+# Take the next submission if a pipeline slot is free
+_POP_SCRIPT = """
+local now = tonumber(ARGV[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[8], '-inf', now - tonumber(ARGV[4]))
+for _, member in ipairs(expired) do
+    redis.call('ZREM', KEYS[8], member)
+    redis.call('HDEL', KEYS[10], member)
+end
+if redis.call('ZCARD', KEYS[8]) >= tonumber(ARGV[5]) then
+    return false
+end
+
+local pick, tier
+local oldest = redis.call('ZRANGE', KEYS[5], 0, 0, 'WITHSCORES')
+if oldest[1] and now - tonumber(oldest[2]) >= tonumber(ARGV[2]) then
+    pick = oldest[1]
+    tier = redis.call('HGET', KEYS[6], pick)
+else
+    local standard = redis.call('ZRANGE', KEYS[1], 0, 0)
+    local guest = redis.call('ZRANGE', KEYS[2], 0, 0)
+    if not standard[1] and not guest[1] then
+        return false
+    end
+    local turn = redis.call('INCR', KEYS[7])
+    if guest[1] and (not standard[1] or turn % tonumber(ARGV[3]) == 0) then
+        pick, tier = guest[1], 'guest'
+    else
+        pick, tier = standard[1], 'standard'
+    end
+end
+
+local queue, vtime = KEYS[1], KEYS[3]
+if tier == 'guest' then
+    queue, vtime = KEYS[2], KEYS[4]
+end
+local tag = tonumber(redis.call('ZSCORE', queue, pick))
+if tag and tag > tonumber(redis.call('GET', vtime) or '0') then
+    redis.call('SET', vtime, tostring(tag))
+end
+redis.call('ZREM', queue, pick)
+redis.call('ZREM', KEYS[5], pick)
+redis.call('HDEL', KEYS[6], pick)
+redis.call('HDEL', KEYS[9], pick)
+redis.call('ZADD', KEYS[8], now, pick)
+redis.call('HSET', KEYS[10], pick, tier)
+return {pick, tier}
+"""
+
+# Free a slot and count the completion in its tier's decayed rate
+_RELEASE_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+local tier = redis.call('HGET', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+local rate = KEYS[3]
+if tier == 'guest' then
+    rate = KEYS[4]
+end
+local now = tonumber(ARGV[2])
+local count = tonumber(redis.call('HGET', rate, 'count') or '0')
+local at = tonumber(redis.call('HGET', rate, 'at') or ARGV[2])
+count = count * math.exp(-(now - at) / tonumber(ARGV[3])) + 1
+redis.call('HSET', rate, 'count', tostring(count), 'at', ARGV[2])
+return 1
+"""
+
+# Running averages of ML call seconds and MB; their ratio is the speed,
+# which tiny documents dominated by fixed overhead cannot skew
+_SPEED_SCRIPT = """
+local alpha = tonumber(ARGV[3])
+for i, field in ipairs({'seconds', 'mb'}) do
+    local sample = tonumber(ARGV[i])
+    local current = tonumber(redis.call('HGET', KEYS[1], field) or ARGV[i])
+    redis.call('HSET', KEYS[1], field, tostring(alpha * sample + (1 - alpha) * current))
+end
+return 1
+"""
+
+
+def flow_for(submission, user_role=None, is_teacher_view=False):
+    """(tier, flow, weight) a submission is scheduled under"""
+    user_role = user_role or submission.user.role
+    if user_role == 'guest':
+        return GUEST_TIER, f'guest:{submission.user_id}', 1
+    weight = settings.SCHEDULER_TEACHER_VIEW_WEIGHT if is_teacher_view else 1
+    if submission.assignment_id:
+        return STANDARD_TIER, f'class:{submission.assignment.class_obj_id}', weight
+    return STANDARD_TIER, f'user:{submission.user_id}', weight
+
+
+def enqueue(submission, user_role=None, is_teacher_view=False):
+    """Add a submission to its flow; returns its virtual finish tag"""
+    tier, flow, weight = flow_for(submission, user_role, is_teacher_view)
+    tag = get_redis().eval(
+        _PUSH_SCRIPT, 6,
+        QUEUE_KEY.format(tier=tier), FLOW_FINISH_KEY.format(tier=tier), VTIME_KEY.format(tier=tier),
+        ENQUEUED_KEY, TIER_KEY, FLOW_KEY,
+        str(submission.id), flow, 1 / weight, time.time(), tier,
+    )
+    logger.info("Submission %s scheduled in %s/%s (tag %s)", submission.id, tier, flow, tag)
+    return tag
+
+
+def pop():
+    """Claim a pipeline slot for the next submission; None if none is due"""
+    picked = get_redis().eval(
+        _POP_SCRIPT, 10,
+        QUEUE_KEY.format(tier=STANDARD_TIER), QUEUE_KEY.format(tier=GUEST_TIER),
+        VTIME_KEY.format(tier=STANDARD_TIER), VTIME_KEY.format(tier=GUEST_TIER),
+        ENQUEUED_KEY, TIER_KEY, TURN_KEY, INFLIGHT_KEY, FLOW_KEY, INFLIGHT_TIER_KEY,
+        time.time(), settings.SCHEDULER_MAX_WAIT, settings.SCHEDULER_GUEST_EVERY,
+        settings.SCHEDULER_SLOT_TTL, settings.SCHEDULER_MAX_IN_FLIGHT,
+    )
+    return picked[0] if picked else None
+
+
+def dispatch(start):
+    """Start submissions with `start(submission_id)` while slots are free"""
+    dispatched = 0
+    while True:
+        submission_id = pop()
+        if submission_id is None:
+            return dispatched
+        try:
+            start(submission_id)
+        except Exception:
+            release(submission_id)
+            raise
+        dispatched += 1
+
+
+def release(submission_id):
+    """Free the pipeline slot held by a submission; True if it held one"""
+    try:
+        return bool(get_redis().eval(
+            _RELEASE_SCRIPT, 4,
+            INFLIGHT_KEY, INFLIGHT_TIER_KEY,
+            RATE_KEY.format(tier=STANDARD_TIER), RATE_KEY.format(tier=GUEST_TIER),
+            str(submission_id), time.time(), settings.SCHEDULER_RATE_WINDOW,
+        ))
+    except RedisError as exc:
+        logger.warning("Scheduler unavailable, could not release %s: %s", submission_id, exc)
+        return False
+
+
+def record_ml_time(size_bytes, seconds):
+    """Fold one ML call into the running ML speed averages"""
+    try:
+        get_redis().eval(_SPEED_SCRIPT, 1, ML_SPEED_KEY, seconds, size_bytes / MB, _SPEED_ALPHA)
+    except RedisError as exc:
+        logger.warning("Could not record ML timing: %s", exc)
+
+
+def ml_seconds_per_mb(redis_client=None):
+    speed = (redis_client or get_redis()).hgetall(ML_SPEED_KEY)
+    if not speed or float(speed['mb']) <= 0:
+        return float(settings.SCHEDULER_SECONDS_PER_MB)
+    return float(speed['seconds']) / float(speed['mb'])
+
+
+def completions_per_minute(tier, redis_client=None):
+    """Decayed completion rate of a tier's pipelines"""
+    stats = (redis_client or get_redis()).hgetall(RATE_KEY.format(tier=tier))
+    if not stats:
+        return 0.0
+    window = settings.SCHEDULER_RATE_WINDOW
+    count = float(stats['count']) * math.exp(-(time.time() - float(stats['at'])) / window)
+    return count * 60 / window
+
+
+def _wait_seconds(tier, ahead, position, service_seconds, redis_client):
+    """Seconds until a submission with `ahead` tier peers before it is dispatched"""
+    rate = completions_per_minute(tier, redis_client)
+    if rate > 0:
+        return (ahead + 1) * 60 / rate
+    # No recent completions to go by: assume full slots of similar work
+    return (position + 1) * service_seconds / settings.SCHEDULER_MAX_IN_FLIGHT
+
+
+def estimate(submission):
+    """
+    Queue position and estimated completion of a submission, or None when
+    the scheduler is not holding it (finished, paused, async mode).
+    """
+    redis_client = get_redis()
+    submission_id = str(submission.id)
+    now = time.time()
+    service_seconds = ml_seconds_per_mb(redis_client) * submission.file_size / MB
+
+    dispatched_at = redis_client.zscore(INFLIGHT_KEY, submission_id)
+    if dispatched_at is not None:
+        finish = max(dispatched_at + service_seconds, now)
+        return _estimate(0, 0, finish)
+
+    tier = redis_client.hget(TIER_KEY, submission_id)
+    if tier is None:
+        return None
+    ahead = redis_client.zrank(QUEUE_KEY.format(tier=tier), submission_id)
+    if ahead is None:
+        return None
+
+    every = settings.SCHEDULER_GUEST_EVERY
+    if tier == GUEST_TIER:
+        # N - 1 standard dispatches go before each guest one
+        others = redis_client.zcard(QUEUE_KEY.format(tier=STANDARD_TIER))
+        position = ahead + min(others, (ahead + 1) * (every - 1))
+    else:
+        others = redis_client.zcard(QUEUE_KEY.format(tier=GUEST_TIER))
+        position = ahead + min(others, ahead // max(every - 1, 1))
+
+    wait = _wait_seconds(tier, ahead, position, service_seconds, redis_client)
+    return _estimate(position, wait, now + wait + service_seconds)
+
+
+def _estimate(position, wait, finish):
+    return {
+        'queue_position': position,
+        'estimated_wait_seconds': round(wait),
+        'estimated_completion_at': datetime.fromtimestamp(finish, tz=dt_timezone.utc),
+    }
+
+
+def guest_retry_after():
+    """
+    Seconds a guest should wait before uploading, or 0 to admit the upload.
+    Always admits unless SCHEDULER_ADMISSION_CONTROL is on.
+    """
+    if not settings.SCHEDULER_ADMISSION_CONTROL:
+        return 0
+    try:
+        redis_client = get_redis()
+        waiting = redis_client.zcard(QUEUE_KEY.format(tier=GUEST_TIER))
+        service_seconds = ml_seconds_per_mb(redis_client)  # a 1 MB document
+        position = (waiting + 1) * settings.SCHEDULER_GUEST_EVERY
+        backlog = _wait_seconds(GUEST_TIER, waiting, position, service_seconds, redis_client)
+    except RedisError as exc:
+        logger.warning("Scheduler unavailable, admitting guest upload: %s", exc)
+        return 0
+
+    excess = backlog - settings.SCHEDULER_GUEST_MAX_BACKLOG
+    return math.ceil(excess) if excess > 0 else 0
+
+
+def queue_stats():
+    """Waiting counts, busy slots and throughput per tier"""
+    redis_client = get_redis()
+    return {
+        'standard': redis_client.zcard(QUEUE_KEY.format(tier=STANDARD_TIER)),
+        'guest': redis_client.zcard(QUEUE_KEY.format(tier=GUEST_TIER)),
+        'in_flight': redis_client.zcard(INFLIGHT_KEY),
+        'max_in_flight': settings.SCHEDULER_MAX_IN_FLIGHT,
+        'completions_per_minute': {
+            tier: round(completions_per_minute(tier, redis_client), 2)
+            for tier in (STANDARD_TIER, GUEST_TIER)
+        },
+        'ml_seconds_per_mb': round(ml_seconds_per_mb(redis_client), 2),
+    }
@@ -108,6 +108,39 @@ class SubmissionCreateSerializer(serializers.ModelSerializer):
         return attrs
 
 
+# 🔹 Direct Upload Serializer
+class DirectUploadSerializer(serializers.Serializer):
+    """Announces a PDF that the client uploads straight to storage"""
+    filename = serializers.CharField(max_length=255)
+    file_size = serializers.IntegerField(min_value=1)
+    assignment = serializers.PrimaryKeyRelatedField(
+        queryset=Assignment.objects.all(),
+        required=False,
+        allow_null=True
+    )
+    assignment_name = serializers.CharField(required=False, allow_blank=True)
+
+    def validate_filename(self, filename):
+        if not filename.lower().endswith('.pdf'):
+            raise serializers.ValidationError("Only PDF files are allowed")
+        return filename
+
+    def validate_file_size(self, file_size):
+        if file_size > settings.MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError("File size must be less than 50MB")
+        return file_size
+
+    def validate(self, attrs):
+        assignment = attrs.get('assignment')
+        if assignment:
+            if assignment.is_past_deadline and not assignment.allow_late_submissions:
+                raise serializers.ValidationError("Deadline has passed. Request an extension.")
+            attrs['assignment_name'] = attrs.get('assignment_name') or assignment.title
+        else:
+            attrs['assignment_name'] = attrs.get('assignment_name') or 'Document Evaluation'
+        return attrs
+
+
 # 🔹 Extension Request Serializer
 class ExtensionRequestSerializer(serializers.Serializer):
     reason = serializers.CharField(max_length=500)
\ No newline at end of file
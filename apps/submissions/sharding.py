@@ -0,0 +1,310 @@
+"""
+Page-range sharding of large PDFs.
+
+A long document is split into page ranges that are analyzed in parallel
+across the ML pool (a Celery chord of analyze_shard tasks). Each shard's
+response is checkpointed on its own; merge_shards then stitches them into
+one ML response in page order and stores that as the submission's regular
+checkpoint, so the persist/report/finalize stages do not know the
+difference:
+
+- paragraphs are concatenated, which renumbers them document-wide,
+- the document summary is recomputed with each shard weighted by its
+  paragraph count,
+- the shard reports are concatenated into a single PDF.
+
+Shards are also the unit of pause and resume: a shard that starts while
+its submission is paused returns SHARD_PAUSED instead of calling the ML
+service, and resuming re-runs the chord, where shards that already have a
+checkpoint finish immediately.
+
+Documents that are not sharded but run past ML_CHUNK_PAGES pages are
+analyzed in chunks instead: the same page ranges, sent one after another
+by the analyze stage itself. After each chunk its response is
+checkpointed, processed_paragraphs grows and the stage gives up its slot
+if the submission was paused; the resumed stage skips the chunks that
+already have a checkpoint.
+
+Paragraphs that run across a shard or chunk boundary are analyzed as two.
+Sharding and chunking need pypdf; without it every document goes in one
+piece.
+"""
+import base64
+import json
+import logging
+import math
+import tempfile
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from . import checkpoints, slimming
+from .ml_client import get_client
+from .ml_stream import Base64StreamDecoder, iter_ml_events
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pragma: no cover - sharding is optional
+    PdfReader = PdfWriter = None
+
+logger = logging.getLogger(__name__)
+
+SHARD_DIR = 'ml-shards'
+
+# analyze_shard result for a shard skipped because the submission is paused
+SHARD_PAUSED = 'paused'
+
+# Base64 encodes 3 bytes to 4 characters; keep report chunks aligned
+_REPORT_READ_SIZE = 3 * 64 * 1024
+
+
+def plan_shards(submission):
+    """Page ranges [(start, end), ...] to analyze separately, or [] for one piece"""
+    if PdfReader is None or not settings.ML_SHARDING_ENABLED:
+        return []
+    if submission.file_size < settings.ML_SHARD_MIN_BYTES:
+        return []
+
+    page_count = _page_count(submission)
+    if page_count is None:
+        return []
+
+    shard_count = max(
+        math.ceil(page_count / settings.ML_SHARD_PAGES),
+        math.ceil(submission.file_size / settings.ML_SHARD_BYTES),
+    )
+    shard_count = min(shard_count, settings.ML_SHARD_MAX_SHARDS, page_count)
+    if shard_count <= 1:
+        return []
+
+    return _page_ranges(page_count, math.ceil(page_count / shard_count))
+
+
+def plan_chunks(submission):
+    """Page ranges [(start, end), ...] to analyze one after another, or [] for one piece"""
+    if PdfReader is None or settings.ML_CHUNK_PAGES <= 0:
+        return []
+
+    page_count = _page_count(submission)
+    if page_count is None or page_count <= settings.ML_CHUNK_PAGES:
+        return []
+    return _page_ranges(page_count, settings.ML_CHUNK_PAGES)
+
+
+def _page_count(submission):
+    try:
+        with submission.file.storage.open(submission.file.name, 'rb') as fh:
+            return len(PdfReader(fh).pages)
+    except Exception as exc:
+        logger.warning("Could not count pages of submission %s, sending it in one piece: %s", submission.id, exc)
+        return None
+
+
+def _page_ranges(page_count, pages_per_range):
+    return [
+        (start, min(start + pages_per_range, page_count))
+        for start in range(0, page_count, pages_per_range)
+    ]
+
+
+def shard_name(submission_id, start, end):
+    return f'{SHARD_DIR}/{submission_id}/pages-{start + 1}-{end}.pdf'
+
+
+def write_shard(submission, start, end):
+    """Store pages [start, end) of the PDF sent for analysis as their own file"""
+    storage = submission.file.storage
+    name = shard_name(submission.id, start, end)
+    if storage.exists(name):
+        return name
+
+    with storage.open(slimming.analysis_name(submission), 'rb') as source, tempfile.TemporaryFile() as shard:
+        reader = PdfReader(source)
+        writer = PdfWriter()
+        for page in reader.pages[start:end]:
+            writer.add_page(page)
+        writer.write(shard)
+        shard.seek(0)
+        return storage.save(name, File(shard))
+
+
+def shard_checkpoint_name(submission_id, index):
+    return f'{checkpoints.CHECKPOINT_DIR}/{submission_id}/shard-{index}.json.gz'
+
+
+def existing_shard_checkpoint(submission_id, index):
+    """Checkpoint of a shard analyzed by an earlier attempt, or None"""
+    name = shard_checkpoint_name(submission_id, index)
+    return name if default_storage.exists(name) else None
+
+
+def save_shard_checkpoint(submission_id, index, chunks):
+    """Checkpoint one shard's ML response under a fixed name"""
+    return checkpoints.write_checkpoint(shard_checkpoint_name(submission_id, index), chunks)
+
+
+def chunk_checkpoint_name(submission_id, start, end):
+    # Named by pages, so a resumed stage never mistakes a shard's checkpoint for a chunk's
+    return f'{checkpoints.CHECKPOINT_DIR}/{submission_id}/shard-pages-{start + 1}-{end}.json.gz'
+
+
+def existing_chunk_checkpoint(submission_id, start, end):
+    """Checkpoint of a chunk analyzed before a pause or a retry, or None"""
+    name = chunk_checkpoint_name(submission_id, start, end)
+    return name if default_storage.exists(name) else None
+
+
+def save_chunk_checkpoint(submission_id, start, end, chunks):
+    return checkpoints.write_checkpoint(chunk_checkpoint_name(submission_id, start, end), chunks)
+
+
+def count_paragraphs(checkpoint):
+    """Number of paragraphs in a checkpointed ML response"""
+    count = 0
+    for event in iter_ml_events(checkpoints.iter_checkpoint(checkpoint)):
+        if event[0] == 'paragraph':
+            count += 1
+        elif event[0] == 'report':
+            for _ in event[1]:
+                pass
+    return count
+
+
+def discard_shards(submission, shard_names):
+    """Delete the shard PDFs and their checkpoints once they are merged"""
+    storage = submission.file.storage
+    for index, name in enumerate(shard_names):
+        for storage_backend, stored_name in (
+            (storage, name),
+            (default_storage, shard_checkpoint_name(submission.id, index)),
+        ):
+            try:
+                storage_backend.delete(stored_name)
+            except Exception as exc:
+                logger.warning("Could not delete shard file %s: %s", stored_name, exc)
+
+
+def discard_chunks(submission, page_ranges):
+    """Delete the chunk PDFs and their checkpoints once they are merged"""
+    for start, end in page_ranges:
+        for storage_backend, stored_name in (
+            (submission.file.storage, shard_name(submission.id, start, end)),
+            (default_storage, chunk_checkpoint_name(submission.id, start, end)),
+        ):
+            try:
+                storage_backend.delete(stored_name)
+            except Exception as exc:
+                logger.warning("Could not delete chunk file %s: %s", stored_name, exc)
+
+
+def discard_all_shards(submission):
+    """Delete every shard PDF and shard checkpoint of a submission that will not merge"""
+    for storage, directory, prefix in (
+        (submission.file.storage, f'{SHARD_DIR}/{submission.id}', ''),
+        (default_storage, f'{checkpoints.CHECKPOINT_DIR}/{submission.id}', 'shard-'),
+    ):
+        try:
+            _, files = storage.listdir(directory)
+        except FileNotFoundError:
+            continue
+        except Exception as exc:
+            logger.warning("Could not list shard files in %s: %s", directory, exc)
+            continue
+        for filename in files:
+            if not filename.startswith(prefix):
+                continue
+            try:
+                storage.delete(f'{directory}/{filename}')
+            except Exception as exc:
+                logger.warning("Could not delete shard file %s/%s: %s", directory, filename, exc)
+
+
+def iter_merged_response(shard_checkpoints):
+    """
+    Yield one ML response (JSON bytes) combining the shard responses in
+    order. Shard reports are spooled to temp files and concatenated last.
+    """
+    paragraph_total = 0
+    weighted = {'average_ai_percentage': 0.0, 'average_human_percentage': 0.0, 'average_grammar_score': 0.0}
+    flagged = 0
+
+    with ExitStack() as stack:
+        reports = []
+        yield b'{"paragraphs": ['
+
+        for checkpoint in shard_checkpoints:
+            summary = {}
+            shard_paragraphs = 0
+            for event in iter_ml_events(checkpoints.iter_checkpoint(checkpoint)):
+                if event[0] == 'paragraph':
+                    separator = b', ' if paragraph_total + shard_paragraphs else b''
+                    yield separator + json.dumps(event[1]).encode('utf-8')
+                    shard_paragraphs += 1
+                elif event[0] == 'report':
+                    report = _spool_report(event[1])
+                    if report is not None:
+                        reports.append(stack.enter_context(report))
+                elif event[0] == 'field' and event[1] == 'document_summary':
+                    summary = event[2] or {}
+
+            paragraph_total += shard_paragraphs
+            for key in weighted:
+                value = summary.get(key)
+                if key == 'average_grammar_score' and value is None:
+                    value = summary.get('grammar_score', 0)
+                weighted[key] += float(value or 0) * shard_paragraphs
+            flagged += int(summary.get('paragraphs_flagged_as_ai') or 0)
+
+        document_summary = {
+            key: round(total / paragraph_total, 2) if paragraph_total else 0
+            for key, total in weighted.items()
+        }
+        document_summary['paragraphs_flagged_as_ai'] = flagged
+        yield b'], "document_summary": ' + json.dumps(document_summary).encode('utf-8')
+
+        if reports:
+            yield b', "pdf_report_base64": "'
+            yield from _iter_merged_report_base64(reports)
+            yield b'"'
+        yield b'}'
+
+
+def _spool_report(segments):
+    """Decode one shard's report into a temp file; None if it is not a PDF"""
+    segments = iter(segments)
+    first = next(segments, '').lstrip()
+    report_file = tempfile.TemporaryFile()
+
+    if first.startswith('http'):
+        content = get_client().download(first + ''.join(segments))
+        report_file.write(content or b'')
+    else:
+        decoder = Base64StreamDecoder()
+        report_file.write(decoder.decode(first))
+        for segment in segments:
+            report_file.write(decoder.decode(segment))
+        report_file.write(decoder.flush())
+
+    report_file.seek(0)
+    if report_file.read(4) != b'%PDF':
+        report_file.close()
+        return None
+    report_file.seek(0)
+    return report_file
+
+
+def _iter_merged_report_base64(reports):
+    writer = PdfWriter()
+    for report in reports:
+        writer.append(report)
+
+    with tempfile.TemporaryFile() as merged:
+        writer.write(merged)
+        merged.seek(0)
+        while True:
+            chunk = merged.read(_REPORT_READ_SIZE)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
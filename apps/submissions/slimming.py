@@ -0,0 +1,131 @@
+"""
+Pre-flight slimming of PDFs sent to the ML service.
+
+Student PDFs are often large because of what the ML service never reads:
+photos and scanned figures, embedded font programs, page thumbnails. The
+preflight stage validates the PDF, counts its pages and, for a document
+with a text layer, writes a text-only copy with those stripped; the analyze
+stage (and its page-range shards) then upload the slim copy instead of the
+original. The report is still drawn on the original, so the student sees
+their own document: the store_report stage sends it with the analysis to
+/api/render_report. Slimming is off by default (ML_SLIM_ENABLED) because
+it needs an ML service that provides that endpoint. Webhook mode always
+sends the original, as the report comes back with the callback.
+
+A font program is only dropped when the font has a ToUnicode map, so the
+text still decodes without it. The copy is kept only when it is at least
+ML_SLIM_MIN_SAVING smaller than the original; documents without a text
+layer (scans) are always sent as they are.
+"""
+import logging
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+
+try:
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import NameObject
+except ImportError:  # pragma: no cover - slimming is optional
+    PdfReader = PdfWriter = None
+
+logger = logging.getLogger(__name__)
+
+SLIM_DIR = 'ml-slim'
+
+_FONT_FILES = ('/FontFile', '/FontFile2', '/FontFile3')
+
+
+def slim_name(submission_id):
+    return f'{SLIM_DIR}/{submission_id}.pdf'
+
+
+def has_slim(submission):
+    return submission.file.storage.exists(slim_name(submission.id))
+
+
+def analysis_name(submission):
+    """Stored name of the file to send for analysis: the slim copy, if any"""
+    return slim_name(submission.id) if has_slim(submission) else submission.file.name
+
+
+def _has_text_layer(reader):
+    characters = 0
+    for page in reader.pages:
+        characters += len((page.extract_text() or '').strip())
+        if characters >= settings.ML_TEXT_MIN_CHARS:
+            return True
+    return False
+
+
+def _strip_font_programs(page):
+    """Drop embedded font programs of fonts that map their glyphs to Unicode"""
+    if '/Resources' not in page or '/Font' not in page['/Resources']:
+        return
+    fonts = page['/Resources']['/Font']
+    for key in fonts:
+        font = fonts[key]
+        if '/ToUnicode' not in font:
+            continue
+        descendants = font['/DescendantFonts'] if '/DescendantFonts' in font else [font]
+        for descendant in descendants:
+            descendant = descendant.get_object()
+            if '/FontDescriptor' not in descendant:
+                continue
+            descriptor = descendant['/FontDescriptor']
+            for font_file in _FONT_FILES:
+                if font_file in descriptor:
+                    del descriptor[NameObject(font_file)]
+
+
+def slim_pdf(submission):
+    """
+    Validate the submission's PDF and store a slim copy for analysis when
+    it pays off; returns (page count, bytes to send), or (None, file size)
+    when pypdf cannot read the PDF and it is sent untouched.
+    """
+    discard_slim(submission)
+    if PdfReader is None:
+        return None, submission.file_size
+
+    storage = submission.file.storage
+    try:
+        with storage.open(submission.file.name, 'rb') as source:
+            reader = PdfReader(source)
+            page_count = len(reader.pages)
+            if not settings.ML_SLIM_ENABLED or not _has_text_layer(reader):
+                return page_count, submission.file_size
+
+            with tempfile.TemporaryFile() as slim:
+                writer = PdfWriter(clone_from=reader)
+                writer.remove_images()
+                for page in writer.pages:
+                    if '/Thumb' in page:
+                        del page[NameObject('/Thumb')]
+                    _strip_font_programs(page)
+                    page.compress_content_streams()
+                writer.write(slim)
+
+                slim_size = slim.tell()
+                if slim_size > submission.file_size * (1 - settings.ML_SLIM_MIN_SAVING):
+                    return page_count, submission.file_size
+                slim.seek(0)
+                storage.save(slim_name(submission.id), File(slim))
+    except Exception as exc:
+        logger.warning("Could not read PDF of submission %s, sending it as is: %s", submission.id, exc)
+        return None, submission.file_size
+
+    logger.info(
+        "Slimmed submission %s (%d pages) from %d to %d bytes",
+        submission.id, page_count, submission.file_size, slim_size,
+    )
+    return page_count, slim_size
+
+
+def discard_slim(submission):
+    name = slim_name(submission.id)
+    try:
+        if submission.file.storage.exists(name):
+            submission.file.storage.delete(name)
+    except Exception as exc:
+        logger.warning("Could not delete slim copy %s: %s", name, exc)
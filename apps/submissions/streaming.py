@@ -0,0 +1,158 @@
+"""
+Streaming transfer helpers.
+
+Stored PDFs are piped to the ML service chunk by chunk so a worker never
+holds a whole upload (up to MAX_UPLOAD_SIZE) in memory. With S3/MinIO
+storage the object body is read straight from the GET response instead of
+being downloaded to a local temp file first.
+"""
+import uuid
+
+from django.conf import settings
+
+
+def is_s3_storage(storage):
+    """True when the storage backend is django-storages' S3Boto3Storage"""
+    return hasattr(storage, 'bucket') and hasattr(storage, 'bucket_name')
+
+
+def s3_key(storage, name):
+    """Full object key for a storage-relative file name"""
+    from storages.utils import clean_name
+    return storage._normalize_name(clean_name(name))
+
+
+def iter_file_chunks(field_file, chunk_size=None):
+    """Yield the bytes of a stored file in fixed-size chunks"""
+    return iter_stored_chunks(field_file.storage, field_file.name, chunk_size)
+
+
+def iter_stored_chunks(storage, name, chunk_size=None):
+    """Yield the bytes of a storage object in fixed-size chunks"""
+    chunk_size = chunk_size or settings.ML_UPLOAD_CHUNK_SIZE
+
+    if is_s3_storage(storage):
+        body = storage.bucket.Object(s3_key(storage, name)).get()['Body']
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+        return
+
+    with storage.open(name, 'rb') as fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class MultipartFileStream:
+    """
+    Lazily encoded multipart/form-data body with one file field and
+    optional plain form fields sent ahead of it.
+
+    The length is known up front, so HTTP clients send a Content-Length
+    header and consume the body as an iterator without buffering it.
+    """
+
+    def __init__(self, chunks, size, filename, field_name='file', content_type='application/pdf', fields=None):
+        self.boundary = uuid.uuid4().hex
+        self._chunks = chunks
+        self._size = size
+        safe_filename = _safe_filename(filename)
+        form_fields = ''.join(
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f'{value}\r\n'
+            for name, value in (fields or {}).items()
+        )
+        self._head = (
+            f'{form_fields}'
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{safe_filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        for chunk in self._chunks:
+            yield chunk
+        yield self._tail
+
+
+class MultipartBatchStream:
+    """
+    Lazily encoded multipart/form-data body carrying several files under
+    one field name, in order. `files` holds (chunks, size, filename) tuples.
+    """
+
+    def __init__(self, files, field_name='files', content_type='application/pdf'):
+        self.boundary = uuid.uuid4().hex
+        self._parts = [
+            (
+                (
+                    f'--{self.boundary}\r\n'
+                    f'Content-Disposition: form-data; name="{field_name}"; filename="{_safe_filename(filename)}"\r\n'
+                    f'Content-Type: {content_type}\r\n\r\n'
+                ).encode('utf-8'),
+                chunks,
+                size,
+            )
+            for chunks, size, filename in files
+        ]
+        self._tail = f'--{self.boundary}--\r\n'.encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return sum(len(head) + size + 2 for head, _, size in self._parts) + len(self._tail)
+
+    def __iter__(self):
+        for head, chunks, _ in self._parts:
+            yield head
+            for chunk in chunks:
+                yield chunk
+            yield b'\r\n'
+        yield self._tail
+
+
+def _safe_filename(filename):
+    return filename.replace('"', '%22').replace('\r', '').replace('\n', '')
+
+
+def multipart_for_batch(submissions):
+    """Build one streaming multipart body holding several submissions' PDFs"""
+    return MultipartBatchStream([
+        (iter_file_chunks(submission.file), submission.file.size, submission.original_filename)
+        for submission in submissions
+    ])
+
+
+def multipart_for_submission(submission, fields=None, name=None):
+    """
+    Build a streaming multipart body for a submission's stored PDF, or for
+    another stored file of the submission (a page-range shard) by `name`.
+    """
+    if name is None:
+        chunks, size = iter_file_chunks(submission.file), submission.file.size
+    else:
+        storage = submission.file.storage
+        chunks, size = iter_stored_chunks(storage, name), storage.size(name)
+    return MultipartFileStream(
+        chunks,
+        size=size,
+        filename=submission.original_filename,
+        fields=fields,
+    )
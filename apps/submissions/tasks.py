@@ -299,15 +299,36 @@
 #     )
 
 
-from celery import shared_task
+from celery import chord, shared_task
 from django.utils import timezone
 from django.conf import settings
-import requests
 import re
+import time
+import uuid
 import base64
+import tempfile
+from contextlib import contextmanager
+from functools import partial
+from itertools import chain
+from django.core.files import File
 from django.core.files.base import ContentFile
-from .models import Submission
+from django.db import transaction
+from django.db.models import F
+from redis.exceptions import RedisError
+from .models import Submission, UploadSession
+from . import (
+    analysis_cache, async_executor, batching, cancellation, checkpoints, estimates, locks, ml_guard,
+    paragraph_cache, revisions, scheduler, sharding, slimming, text_extraction,
+)
+from .cancellation import SubmissionCancelled
+from .ml_client import get_client
+from .locks import SubmissionLease, handed_off_lease, release_handed_off_lease
+from .ml_guard import MLUnavailable
+from .ml_stream import Base64StreamDecoder, encode_ml_events, iter_batch_results, iter_ml_events
+from .streaming import iter_file_chunks
+from .webhooks import await_callback, callback_fields, overdue_callbacks, stop_waiting
 from apps.results.models import Result, ParagraphResult
+from apps.results.features import extract_features
 import logging
 
 logger = logging.getLogger(__name__)
@@ -327,9 +348,9 @@ def extract_pdf_bytes(payload):
         if not payload:
             return None
         if payload.startswith('http'):
-            response = requests.get(payload, timeout=600)
-            if response.status_code == 200 and response.content.startswith(b'%PDF'):
-                return response.content
+            content = get_client().download(payload)
+            if content and content.startswith(b'%PDF'):
+                return content
             return None
         try:
             decoded = base64.b64decode(payload, validate=False)
@@ -373,6 +394,34 @@ def save_report_pdf(result, report_payload):
     logger.info("PDF report saved for submission %s", result.submission.id)
 
 
+def save_report_stream(result, segments):
+    """Decode a streamed base64 report through a temp file into result.report_pdf"""
+    segments = iter(segments)
+    first = next(segments, '').lstrip()
+    if first.startswith('http'):
+        save_report_pdf(result, first + ''.join(segments))
+        return bool(result.report_pdf)
+
+    decoder = Base64StreamDecoder()
+    with tempfile.TemporaryFile() as report_file:
+        report_file.write(decoder.decode(first))
+        for segment in segments:
+            report_file.write(decoder.decode(segment))
+        report_file.write(decoder.flush())
+
+        report_file.seek(0)
+        if report_file.read(4) != b'%PDF':
+            logger.warning("Could not extract PDF bytes for submission %s", result.submission.id)
+            return False
+
+        report_file.seek(0)
+        filename = f"report_{result.submission.id}.pdf"
+        result.report_pdf.save(filename, File(report_file), save=True)
+
+    logger.info("PDF report saved for submission %s", result.submission.id)
+    return True
+
+
 #
 # Paragraph helpers
 #
@@ -409,23 +458,34 @@ def _build_result_and_paragraphs(submission, ml_data: dict):
 
     logger.info("Received analysis for %d paragraphs", paragraph_count)
 
-    document_summary = ml_data['document_summary']
-
     result = Result.objects.create(
         submission=submission,
-        ai_percentage=document_summary['average_ai_percentage'],
-        human_percentage=document_summary['average_human_percentage'],
-        grammar_score=(
+        **_summary_fields(ml_data['document_summary'], paragraph_count),
+    )
+    _insert_paragraphs(result, paragraphs)
+    return result, paragraph_count
+
+
+def _summary_fields(document_summary: dict, paragraph_count: int) -> dict:
+    return {
+        'ai_percentage': document_summary['average_ai_percentage'],
+        'human_percentage': document_summary['average_human_percentage'],
+        'grammar_score': (
             document_summary.get('average_grammar_score')
             or document_summary.get('grammar_score', 0)
         ),
-        total_paragraphs=paragraph_count,
-        ai_paragraphs=document_summary['paragraphs_flagged_as_ai'],
-        is_complete=True,
-        completed_paragraphs=paragraph_count,
-    )
+        'total_paragraphs': paragraph_count,
+        'ai_paragraphs': document_summary['paragraphs_flagged_as_ai'],
+        'is_complete': True,
+        'completed_paragraphs': paragraph_count,
+    }
+
 
-    paragraph_records = [
+def _insert_paragraphs(result, paragraphs: list, start: int = 0, numbers=None) -> int:
+    """Bulk insert paragraphs numbered after `start` (or with `numbers`); returns the last number used"""
+    numbers = numbers or range(start + 1, start + len(paragraphs) + 1)
+    features = extract_features([para_data['paragraph_text'] for para_data in paragraphs])
+    ParagraphResult.objects.bulk_create([
         ParagraphResult(
             result=result,
             paragraph_number=idx,
@@ -437,150 +497,1077 @@ def _build_result_and_paragraphs(submission, ml_data: dict):
             sentence_highlights=[],
             highlighted_html='',
             features={
+                **text_features,
                 'bert_score': para_data.get('bert'),
                 'perplexity': para_data.get('perplexity'),
             },
         )
-        for idx, para_data in enumerate(paragraphs, start=1)
-    ]
+        for idx, para_data, text_features in zip(numbers, paragraphs, features)
+    ])
+    return start + len(paragraphs)
+
+
+def _persist_streamed_analysis(submission, chunks, with_report=True):
+    """
+    Persist an ML response while it is being decoded: paragraphs go to the
+    database in batches of ML_PARAGRAPH_BATCH_SIZE and the base64 report is
+    decoded straight into storage, so memory stays flat for long documents.
+    With with_report=False the report is skipped for the store_report stage.
+    """
+    batch_size = settings.ML_PARAGRAPH_BATCH_SIZE
+    fields = {}
+    pending = []
+    paragraph_count = 0
+    report_saved = False
+
+    with transaction.atomic():
+        result = Result.objects.create(submission=submission, is_complete=False)
+
+        for event in iter_ml_events(chunks):
+            if event[0] == 'paragraph':
+                pending.append(event[1])
+                # A lone first paragraph is held back in case it needs splitting
+                if len(pending) >= batch_size and paragraph_count + len(pending) > 1:
+                    paragraph_count = _insert_paragraphs(result, pending, paragraph_count)
+                    paragraph_cache.remember_many(pending)
+                    pending = []
+            elif event[0] == 'report':
+                if with_report:
+                    report_saved = save_report_stream(result, event[1]) or report_saved
+                else:
+                    for _ in event[1]:
+                        pass
+            else:
+                fields[event[1]] = event[2]
+
+        unsplit = pending
+        if paragraph_count == 0:
+            pending = _split_single_paragraph(pending)
+        paragraph_count = _insert_paragraphs(result, pending, paragraph_count)
+        # Pieces of a locally split paragraph only carry the whole one's score
+        if pending is unsplit:
+            paragraph_cache.remember_many(pending)
+
+        if paragraph_count == 0:
+            raise ValueError('ML service returned no paragraph data')
+
+        logger.info("Received analysis for %d paragraphs", paragraph_count)
+
+        for field, value in _summary_fields(fields['document_summary'], paragraph_count).items():
+            setattr(result, field, value)
+        result.save()
+
+    if with_report and not report_saved:
+        save_report_pdf(result, fields.get('pdf_report_base64'))
 
-    ParagraphResult.objects.bulk_create(paragraph_records)
     return result, paragraph_count
 
 
+def save_rendered_report(result, checkpoint):
+    """Have the ML service render the report on the original PDF for an analysis of text or a slim copy"""
+    analysis = b''.join(checkpoints.iter_checkpoint(checkpoint)).decode('utf-8')
+    with get_client().render_report(result.submission, analysis) as response, \
+            tempfile.TemporaryFile() as report_file:
+        for chunk in response.iter_bytes(settings.ML_RESPONSE_CHUNK_SIZE):
+            report_file.write(chunk)
+
+        report_file.seek(0)
+        if report_file.read(4) != b'%PDF':
+            logger.warning("ML service rendered no PDF report for submission %s", result.submission.id)
+            return False
+
+        report_file.seek(0)
+        filename = f"report_{result.submission.id}.pdf"
+        result.report_pdf.save(filename, File(report_file), save=True)
+
+    logger.info("PDF report rendered for submission %s", result.submission.id)
+    return True
+
+
+def _save_provisional_result(submission, paragraph_count, numbers, chunks):
+    """
+    Store a Result estimated from the sampled paragraphs at `numbers`,
+    flagged provisional; returns the sampled ML paragraph entries.
+    """
+    paragraphs, fields = [], {}
+    for event in iter_ml_events(chunks):
+        if event[0] == 'paragraph':
+            paragraphs.append(event[1])
+        elif event[0] == 'field':
+            fields[event[1]] = event[2]
+
+    summary = _summary_fields(fields['document_summary'], len(paragraphs))
+    summary.update(
+        total_paragraphs=paragraph_count,
+        ai_paragraphs=round(summary['ai_paragraphs'] * paragraph_count / len(paragraphs)),
+        is_complete=False,
+        is_provisional=True,
+    )
+    with transaction.atomic():
+        result = Result.objects.create(submission=submission, **summary)
+        _insert_paragraphs(result, paragraphs, numbers=numbers)
+
+    logger.info(
+        "Provisional estimate for submission %s from %d of %d paragraphs: %s%% AI",
+        submission.id, len(paragraphs), paragraph_count, summary['ai_percentage'],
+    )
+    return paragraphs
+
+
+def save_report_from_response(result, chunks):
+    """Save only the PDF report carried in a streamed ML response"""
+    fields = {}
+    for event in iter_ml_events(chunks):
+        if event[0] == 'report':
+            if save_report_stream(result, event[1]):
+                return
+        elif event[0] == 'field':
+            fields[event[1]] = event[2]
+    save_report_pdf(result, fields.get('pdf_report_base64'))
+
+
+def _mark_completed(submission, paragraph_count):
+    submission.total_paragraphs = paragraph_count
+    submission.processed_paragraphs = paragraph_count
+    submission.status = 'completed'
+    submission.processed_at = timezone.now()
+    submission.save(update_fields=[
+        'total_paragraphs', 'processed_paragraphs', 'status', 'processed_at', 'model_version'
+    ])
+
+
+def _complete_from_cache(submission):
+    """Finish a submission from the analysis cache; returns None on a miss"""
+    if not settings.ANALYSIS_CACHE_ENABLED:
+        return None
+
+    if not submission.content_hash:
+        submission.content_hash = analysis_cache.hash_chunks(iter_file_chunks(submission.file))
+        submission.save(update_fields=['content_hash'])
+
+    cached_result = analysis_cache.lookup(submission)
+    if not cached_result:
+        return None
+
+    result, paragraph_count = analysis_cache.clone_result(cached_result, submission)
+    submission.model_version = settings.ML_MODEL_VERSION
+    _mark_completed(submission, paragraph_count)
+    logger.info("Submission %s completed from analysis cache", submission.id)
+    return paragraph_count
+
+
+def _persist_and_complete(submission, chunks):
+    """Persist a streamed ML response and mark the submission completed"""
+    result, paragraph_count = _persist_streamed_analysis(submission, chunks)
+    submission.model_version = settings.ML_MODEL_VERSION
+    _mark_completed(submission, paragraph_count)
+    analysis_cache.remember(submission)
+    return paragraph_count
+
+
+def complete_from_callback(submission, chunks):
+    """
+    Store an ML response delivered by webhook: what the persist, report and
+    finalize stages do for a polled one. Webhook mode only sends the
+    original PDF, so the report carried in the response is drawn on it.
+    """
+    try:
+        return _persist_and_complete(submission, chunks)
+    finally:
+        _discard_work_files(submission)
+
+
+def _persist_checkpoint(submission, checkpoint):
+    """Persist a checkpointed ML response, replacing leftovers of a failed attempt"""
+    Result.objects.filter(submission=submission).delete()
+    paragraph_count = _persist_and_complete(submission, checkpoints.iter_checkpoint(checkpoint))
+    checkpoints.discard_checkpoint(submission)
+    return paragraph_count
+
+
 #
 # Fallback helper
 #
 
-def _defer_and_process_next(self, submission_id, exc):
+def _defer_and_process_next(self, submission_id, exc, lease=None):
+    """
+    Retry a failed stage later and let the scheduler start the next
+    submission in its slot meanwhile; the retry runs outside the in-flight
+    cap. Once retries are exhausted the submission is marked failed. A
+    stage that adopted `lease` hands it to its retry.
+    """
     RETRY_DELAY = 60
 
-    next_submission = (
-        Submission.objects
-        .filter(status='pending')
-        .exclude(id=submission_id)
-        .order_by('created_at')
-        .first()
+    if self.request.retries >= self.max_retries:
+        logger.error("Submission %s failed after %d retries", submission_id, self.request.retries)
+        Submission.objects.filter(id=submission_id).exclude(status='terminated').update(status='failed')
+        submission = Submission.objects.filter(id=submission_id).first()
+        if submission is not None:
+            _discard_work_files(submission)
+        return {'status': 'failed', 'submission_id': str(submission_id)}
+
+    logger.info(
+        "Submission %s failed — processing next submission first, retrying in %ds",
+        submission_id, RETRY_DELAY,
     )
+    if lease is not None:
+        lease.hand_off(settings.SUBMISSION_HANDOFF_SECONDS)
+    raise self.retry(exc=exc, countdown=RETRY_DELAY)
 
-    if next_submission:
-        logger.info(
-            "Submission %s failed — processing next submission %s first, "
-            "will retry %s in %ds",
-            submission_id, next_submission.id, submission_id, RETRY_DELAY,
-        )
-        extract_paragraphs_from_pdf.apply_async(
-            args=[next_submission.id],
-            queue='submissions',
-        )
-    else:
-        logger.info(
-            "Submission %s failed and no other submissions pending — "
-            "retrying in %ds",
-            submission_id, RETRY_DELAY,
-        )
 
-    raise self.retry(exc=exc, countdown=RETRY_DELAY)
+def _discard_work_files(submission):
+    """Delete the intermediate files of a submission that will not continue"""
+    checkpoints.discard_checkpoint(submission)
+    text_extraction.discard_paragraphs(submission)
+    slimming.discard_slim(submission)
+    sharding.discard_all_shards(submission)
+
+
+def _release_slot(submission_id):
+    """Give the submission's pipeline slot to the next scheduled submission"""
+    scheduler.release(submission_id)
+    dispatch_submissions.delay()
+
+
+def _park_submission(submission, retry_after):
+    """
+    Hold a submission while the ML service is shedding load. Parking does
+    not consume a retry; the task is simply scheduled again later.
+    """
+    countdown = max(int(retry_after), settings.ML_DEFER_SECONDS)
+    # Back through the scheduler, so parked work waits its turn again
+    task_result = schedule_submission.apply_async(
+        args=[str(submission.id)],
+        countdown=countdown,
+    )
+    Submission.objects.filter(id=submission.id).exclude(status='terminated').update(
+        status='deferred',
+        task_id=str(task_result.id),
+    )
+    logger.info("Submission %s deferred for %ds: ML service unavailable", submission.id, countdown)
+    return countdown
 
 
 #
-# Celery tasks
+# Staged pipeline
+#
+# extract_paragraphs_from_pdf (preflight) -> analyze_submission ->
+# persist_paragraphs -> store_report -> finalize_submission
+#
+# Large PDFs branch off in the analyze stage: a chord of analyze_shard
+# tasks, one per page range, joined by merge_shards (see sharding.py).
+#
+# Each stage is routed to its own queue (see config/celery.py) so ML-bound,
+# database-bound and storage-bound work can be scaled separately. Stages
+# hand over explicitly rather than through celery.chain so an early exit
+# (cache hit, termination, webhook hand-off, parking) ends the pipeline.
+# The ML response checkpoint is the hand-off between analyze and the later
+# stages, and the submission lease travels along as a token.
+#
+# Stage boundaries (and shards, for large PDFs) are where a pause takes
+# effect: the stage stops, frees its worker slot and records itself in
+# Submission.resume_stage so resume_processing() can continue from there.
+#
+# Pipelines are started by the fair-share scheduler (see scheduler.py);
+# every way out of the pipeline frees its slot for the next submission.
 #
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def extract_paragraphs_from_pdf(self, submission_id):
-    submission = None
+@contextmanager
+def _timed_stage(submission_id, stage):
+    """Record how long a stage took in Submission.stage_timings"""
+    started_at = timezone.now()
+    started = time.monotonic()
     try:
-        submission = Submission.objects.get(id=submission_id)
+        yield
+    finally:
+        _record_stage_timing(submission_id, stage, started_at, time.monotonic() - started)
 
-        # ── Check if terminated BEFORE starting ──────────────────────
-        submission.refresh_from_db()
-        if submission.status == 'terminated':
-            logger.info("Submission %s was terminated — skipping", submission_id)
-            return {'status': 'terminated', 'submission_id': str(submission_id)}
 
-        submission.status = 'processing'
-        submission.save(update_fields=['status'])
+def _record_stage_timing(submission_id, stage, started_at, seconds):
+    timings = (
+        Submission.objects.filter(id=submission_id)
+        .values_list('stage_timings', flat=True)
+        .first()
+    )
+    if timings is not None:
+        timings[stage] = {
+            'started_at': started_at.isoformat(),
+            'seconds': round(seconds, 3),
+        }
+        Submission.objects.filter(id=submission_id).update(stage_timings=timings)
 
-        logger.info("Processing submission %s", submission_id)
 
-        pdf_file = submission.file.open('rb')
-        ml_service_url = f"{settings.ML_SERVICE_URL}/api/analyze_pdf"
-        headers = {
-            'X-API-Key': settings.ML_SERVICE_API_KEY or 'ai-content-evaluator-by-salman-and-ali'
-        }
+def _start_next_stage(task, stage_task, submission_id, lease):
+    """Queue the next stage and hand it the submission's lease"""
+    if stage_task is analyze_submission and settings.SUBMISSION_EXECUTION_MODE == 'async':
+        # The async executor multiplexes the ML call of many submissions
+        lease.hand_off(settings.SUBMISSION_HANDOFF_SECONDS)
+        try:
+            async_executor.submit(submission_id, lease.token)
+            return
+        except RedisError as exc:
+            logger.warning("Executor queue unavailable, analyzing %s in a stage: %s", submission_id, exc)
+
+    _queue_stage(
+        stage_task, submission_id, lease,
+        priority=(task.request.delivery_info or {}).get('priority'),
+    )
 
-        response = requests.post(
-            ml_service_url,
-            files={'file': (submission.original_filename, pdf_file, 'application/pdf')},
-            headers=headers,
-            timeout=600,
-        )
-        pdf_file.close()
 
-        # ── Check if terminated AFTER ML call returns ─────────────────
-        submission.refresh_from_db()
-        if submission.status == 'terminated':
-            logger.info("Submission %s terminated during ML call — discarding result", submission_id)
-            return {'status': 'terminated', 'submission_id': str(submission_id)}
+def _queue_stage(stage_task, submission_id, lease, priority=None, countdown=None):
+    """Queue a stage and hand it the submission's lease"""
+    lease.hand_off(settings.SUBMISSION_HANDOFF_SECONDS)
+    # Record the id first; the stage may run (and re-queue itself) before apply_async returns
+    task_id = str(uuid.uuid4())
+    Submission.objects.filter(id=submission_id).update(task_id=task_id)
+    stage_task.apply_async(
+        args=[str(submission_id), lease.token],
+        task_id=task_id,
+        priority=priority,
+        countdown=countdown,
+    )
 
-        if response.status_code != 200:
-            raise Exception(f"ML service error {response.status_code}: {response.text}")
 
-        ml_data = response.json()
+def _run_stage(task, stage, submission_id, lease, work):
+    """
+    Run one pipeline stage under the submission's lease. `work(task,
+    submission, lease)` returns the task result and the next stage task,
+    or None when the pipeline ends here.
+    """
+    submission = None
+    pipeline_done = True
+    try:
+        with _timed_stage(submission_id, stage):
+            submission = Submission.objects.get(id=submission_id)
 
-        result, paragraph_count = _build_result_and_paragraphs(submission, ml_data)
-        save_report_pdf(result, ml_data.get('pdf_report_base64'))
+            # ── Stop as soon as a teacher terminates the submission ──
+            if submission.status == 'terminated':
+                logger.info("Submission %s was terminated — stopping at %s", submission_id, stage)
+                _discard_work_files(submission)
+                return {'status': 'terminated', 'submission_id': str(submission_id)}
 
-        submission.total_paragraphs = paragraph_count
-        submission.processed_paragraphs = paragraph_count
-        submission.status = 'completed'
-        submission.processed_at = timezone.now()
-        submission.save(update_fields=[
-            'total_paragraphs', 'processed_paragraphs', 'status', 'processed_at'
-        ])
+            # ── Give up the slot while a teacher has the submission paused ──
+            if submission.is_paused:
+                return _pause_at_stage(submission, stage)
 
-        logger.info("Submission %s completed (%d paragraphs)", submission_id, paragraph_count)
+            outcome, next_stage = work(task, submission, lease)
 
-        return {
-            'status': 'success',
-            'submission_id': str(submission_id),
-            'paragraphs': paragraph_count,
-        }
+        if next_stage is not None:
+            if lease.lost:
+                # Another worker may own the submission now; leave the rest to it
+                logger.warning("Submission %s lease lost after %s — stopping", submission_id, stage)
+                pipeline_done = False
+                return {'status': 'duplicate', 'submission_id': str(submission_id)}
+            _start_next_stage(task, next_stage, submission_id, lease)
+            pipeline_done = False
+        elif outcome['status'] == 'sharded':
+            # merge_shards carries on with the slot
+            pipeline_done = False
+        return outcome
 
     except Submission.DoesNotExist:
         logger.error("Submission %s not found", submission_id)
         return {'status': 'error', 'message': 'Submission not found'}
 
+    except SubmissionCancelled:
+        logger.info("Submission %s terminated during %s — stopped", submission_id, stage)
+        _discard_work_files(submission)
+        return {'status': 'terminated', 'submission_id': str(submission_id)}
+
+    except MLUnavailable as exc:
+        countdown = _park_submission(submission, exc.retry_after)
+        return {'status': 'deferred', 'submission_id': str(submission_id), 'retry_in': countdown}
+
     except Exception as exc:
-        logger.exception("Submission %s failed: %s", submission_id, exc)
+        logger.exception("Submission %s failed in %s stage: %s", submission_id, stage, exc)
 
         if submission is not None:
             submission.refresh_from_db()
             # ── Don't overwrite terminated status ────────────────────
             if submission.status != 'terminated':
-                submission.status = 'pending'
+                submission.status = 'processing'
                 submission.save(update_fields=['status'])
 
-        _defer_and_process_next(self, submission_id, exc)
+        # The preflight retry acquires a new lease; later stages adopt theirs again
+        retry_lease = None if stage == 'preflight' else lease
+        return _defer_and_process_next(task, submission_id, exc, lease=retry_lease)
 
+    finally:
+        lease.release()
+        if pipeline_done:
+            _release_slot(submission_id)
 
-@shared_task
-def queue_submission_processing(submission_id, user_role, is_teacher_view=False):
-    if is_teacher_view:
-        priority = 10
-    elif user_role == 'student':
-        priority = 5
+
+def _pause_at_stage(submission, stage):
+    # Shard results are only usable through a fresh chord, so merge resumes at analyze
+    resume_stage = 'analyze' if stage == 'merge' else stage
+    Submission.objects.filter(id=submission.id).update(resume_stage=resume_stage)
+    logger.info("Submission %s paused — will resume at %s", submission.id, resume_stage)
+    return {'status': 'paused', 'submission_id': str(submission.id), 'resume_stage': resume_stage}
+
+
+def resume_processing(submission):
+    """Continue a paused submission from the stage where it stopped; returns the stage"""
+    stage = submission.resume_stage
+    if not stage:
+        return None
+
+    # The paused stage gave up its slot; wait for a new one like any upload
+    schedule_submission(str(submission.id))
+    logger.info("Submission %s resumed at %s", submission.id, stage)
+    return stage
+
+
+def _start_submission(submission_id):
+    """Start (or continue, after a pause) the pipeline of a scheduled submission"""
+    stage = (
+        Submission.objects.filter(id=submission_id)
+        .values_list('resume_stage', flat=True)
+        .first()
+    )
+    resuming = stage and stage != 'preflight'
+    if resuming:
+        # The paused stage released its lease; hand the resumed stage a new one
+        lease_token = handed_off_lease(submission_id, settings.SUBMISSION_HANDOFF_SECONDS)
+        if lease_token is None:
+            logger.info("Submission %s is already being processed — not resuming", submission_id)
+            return
+
+    task_id = str(uuid.uuid4())
+    Submission.objects.filter(id=submission_id).update(task_id=task_id, resume_stage='')
+    if resuming:
+        _STAGE_TASKS[stage].apply_async(args=[str(submission_id), lease_token], task_id=task_id)
     else:
-        priority = 1
+        extract_paragraphs_from_pdf.apply_async(args=[str(submission_id)], task_id=task_id)
 
-    task_result = extract_paragraphs_from_pdf.apply_async(
-        args=[submission_id],
-        priority=priority,
-        queue='submissions',
+
+def _adopt_lease(submission_id, lease_token, stage):
+    lease = SubmissionLease(submission_id, token=lease_token)
+    if lease.adopt():
+        return lease
+    if not _restart_orphaned_stage(submission_id, stage):
+        logger.info("Submission %s was claimed by another worker — skipping stage", submission_id)
+    return None
+
+
+def _restart_orphaned_stage(submission_id, stage):
+    """
+    Queue `stage` again under a new lease when the lease handed to it
+    expired before it ran (a chord or a queue slower than the hand-off);
+    nothing else would move the submission on. False when another worker
+    holds the submission or it is no longer processing.
+    """
+    if not Submission.objects.filter(id=submission_id, status='processing', is_paused=False).exists():
+        return False
+    # Taking the new lease is the claim; only one late delivery gets it
+    lease_token = handed_off_lease(submission_id, settings.SUBMISSION_HANDOFF_SECONDS)
+    if lease_token is None:
+        return False
+
+    # Shard results are only usable through a fresh chord, so merge restarts at analyze
+    stage = 'analyze' if stage == 'merge' else stage
+    task_id = str(uuid.uuid4())
+    Submission.objects.filter(id=submission_id).update(task_id=task_id)
+    _STAGE_TASKS[stage].apply_async(args=[str(submission_id), lease_token], task_id=task_id)
+    logger.warning("Submission %s lost its lease before the %s stage — restarted it", submission_id, stage)
+    return True
+
+
+def _preflight(task, submission, lease):
+    if submission.status == 'completed':
+        logger.info("Submission %s is already completed — skipping duplicate", submission.id)
+        return {'status': 'duplicate', 'submission_id': str(submission.id)}, None
+
+    submission.status = 'processing'
+    submission.stage_timings = {}
+    submission.save(update_fields=['status', 'stage_timings'])
+
+    logger.info("Processing submission %s", submission.id)
+
+    # ── Reuse an earlier analysis of the exact same file ─────────
+    paragraph_count = _complete_from_cache(submission)
+    if paragraph_count is not None:
+        return {
+            'status': 'success',
+            'submission_id': str(submission.id),
+            'paragraphs': paragraph_count,
+            'cached': True,
+        }, None
+
+    # ── Send extracted text instead of the PDF when enabled ──────
+    paragraph_count = text_extraction.extract_paragraphs(submission)
+    if paragraph_count:
+        return {
+            'status': 'preflighted',
+            'submission_id': str(submission.id),
+            'extracted_paragraphs': paragraph_count,
+        }, analyze_submission
+
+    # ── Otherwise send a copy without images and font programs ───
+    page_count, upload_size = slimming.slim_pdf(submission)
+    return {
+        'status': 'preflighted',
+        'submission_id': str(submission.id),
+        'extracted_paragraphs': 0,
+        'pages': page_count,
+        'upload_bytes': upload_size,
+    }, analyze_submission
+
+
+def _analyze(task, submission, lease):
+    # ── Resume from a stored ML response if an earlier attempt got one ──
+    checkpoint = checkpoints.latest_checkpoint(submission)
+    if checkpoint:
+        logger.info("Submission %s resuming from checkpoint %s", submission.id, checkpoint)
+        return {'status': 'analyzed', 'submission_id': str(submission.id)}, persist_paragraphs
+
+    # ── Analyze text extracted in preflight; unchanged paragraphs of a ──
+    # ── previous draft and cached paragraphs are not sent again ──────
+    paragraphs = text_extraction.stored_paragraphs(submission)
+    if paragraphs:
+        known, grammar_score = revisions.previous_paragraphs(submission)
+        with cancellation.watch(submission.id) as cancel_token:
+            # ── Long documents get a quick provisional estimate first ──
+            if estimates.wants_estimate(submission, paragraphs):
+                numbers = estimates.stratified_sample(submission.id, len(paragraphs))
+                sampled = _save_provisional_result(
+                    submission,
+                    len(paragraphs),
+                    numbers,
+                    paragraph_cache.iter_text_analysis(
+                        [paragraphs[number - 1] for number in numbers],
+                        cancel_token=cancel_token,
+                        known=known,
+                    ),
+                )
+                known = {
+                    **known,
+                    **{paragraph_cache.normalize_text(entry['paragraph_text']): entry for entry in sampled},
+                }
+            checkpoints.save_checkpoint(
+                submission,
+                task.request.retries,
+                paragraph_cache.iter_text_analysis(
+                    paragraphs,
+                    cancel_token=cancel_token,
+                    known=known,
+                    grammar_score=grammar_score,
+                ),
+            )
+        return {'status': 'analyzed', 'submission_id': str(submission.id)}, persist_paragraphs
+
+    callback = None
+    if settings.ML_COMPLETION_MODE == 'webhook':
+        callback = callback_fields(submission)
+    else:
+        page_ranges = sharding.plan_shards(submission)
+        if page_ranges:
+            _start_shard_chord(submission, page_ranges, lease)
+            return {
+                'status': 'sharded',
+                'submission_id': str(submission.id),
+                'shards': len(page_ranges),
+            }, None
+
+        page_ranges = sharding.plan_chunks(submission)
+        if page_ranges:
+            return _analyze_in_chunks(task, submission, page_ranges)
+
+    # A callback brings the report with it, so webhook mode sends the original it is drawn on
+    name = slimming.slim_name(submission.id) if callback is None and slimming.has_slim(submission) else None
+    started = time.monotonic()
+    with cancellation.watch(submission.id) as cancel_token, get_client().analyze_pdf(
+        submission, callback=callback, name=name, cancel_token=cancel_token,
+    ) as response:
+        if response.status_code == 202:
+            # ML service accepted the job and will POST results back
+            logger.info("Submission %s handed to ML service, awaiting callback", submission.id)
+            # Keep duplicates away until the callback releases the lease
+            lease.hand_off(settings.ML_CALLBACK_TOKEN_MAX_AGE)
+            await_callback(submission.id)
+            return {'status': 'submitted', 'submission_id': str(submission.id)}, None
+
+        checkpoints.save_checkpoint(
+            submission,
+            task.request.retries,
+            cancel_token.iter_checked(response.iter_bytes(settings.ML_RESPONSE_CHUNK_SIZE)),
+        )
+    upload_size = submission.file.storage.size(name) if name else submission.file_size
+    scheduler.record_ml_time(upload_size, time.monotonic() - started)
+
+    return {'status': 'analyzed', 'submission_id': str(submission.id)}, persist_paragraphs
+
+
+def _analyze_in_chunks(task, submission, page_ranges):
+    """Analyze page-range chunks one after another, stopping between them while paused"""
+    chunk_checkpoints = []
+    for start, end in page_ranges:
+        checkpoint = sharding.existing_chunk_checkpoint(submission.id, start, end)
+        if checkpoint is None:
+            # ── Give up the slot between chunks; finished ones are kept ──
+            submission.refresh_from_db(fields=['is_paused'])
+            if submission.is_paused:
+                return _pause_at_stage(submission, 'analyze'), None
+
+            name = sharding.write_shard(submission, start, end)
+            started = time.monotonic()
+            with cancellation.watch(submission.id) as cancel_token, get_client().analyze_pdf(
+                submission, name=name, cancel_token=cancel_token,
+            ) as response:
+                checkpoint = sharding.save_chunk_checkpoint(
+                    submission.id,
+                    start,
+                    end,
+                    cancel_token.iter_checked(response.iter_bytes(settings.ML_RESPONSE_CHUNK_SIZE)),
+                )
+            scheduler.record_ml_time(submission.file.storage.size(name), time.monotonic() - started)
+            Submission.objects.filter(id=submission.id).update(
+                processed_paragraphs=F('processed_paragraphs') + sharding.count_paragraphs(checkpoint),
+            )
+        chunk_checkpoints.append(checkpoint)
+
+    checkpoints.save_checkpoint(
+        submission,
+        task.request.retries,
+        sharding.iter_merged_response(chunk_checkpoints),
+    )
+    sharding.discard_chunks(submission, page_ranges)
+    return {
+        'status': 'analyzed',
+        'submission_id': str(submission.id),
+        'chunks': len(page_ranges),
+    }, persist_paragraphs
+
+
+def _start_shard_chord(submission, page_ranges, lease):
+    """Fan page-range shards out across the ML pool, then merge them"""
+    shard_names = [sharding.write_shard(submission, start, end) for start, end in page_ranges]
+    logger.info("Submission %s split into %d shards", submission.id, len(shard_names))
+
+    # Shards may queue behind other work; keep duplicates away meanwhile
+    lease.hand_off(settings.SUBMISSION_HANDOFF_SECONDS)
+    task_id = str(uuid.uuid4())
+    Submission.objects.filter(id=submission.id).update(task_id=task_id)
+    chord(
+        analyze_shard.s(str(submission.id), index, name)
+        for index, name in enumerate(shard_names)
+    )(merge_shards.s(str(submission.id), lease.token, shard_names).set(task_id=task_id))
+
+
+def _merge_shards(task, submission, lease, shard_checkpoints, shard_names):
+    if sharding.SHARD_PAUSED in shard_checkpoints:
+        # Finished shards keep their checkpoints for the resumed chord
+        return _pause_at_stage(submission, 'merge'), None
+
+    failed = [index for index, checkpoint in enumerate(shard_checkpoints) if checkpoint is None]
+    if failed:
+        logger.error("Submission %s failed: shards %s could not be analyzed", submission.id, failed)
+        submission.status = 'failed'
+        submission.save(update_fields=['status'])
+        sharding.discard_shards(submission, shard_names)
+        _discard_work_files(submission)
+        return {'status': 'failed', 'submission_id': str(submission.id), 'failed_shards': failed}, None
+
+    checkpoints.save_checkpoint(
+        submission,
+        task.request.retries,
+        sharding.iter_merged_response(shard_checkpoints),
+    )
+    sharding.discard_shards(submission, shard_names)
+    return {
+        'status': 'merged',
+        'submission_id': str(submission.id),
+        'shards': len(shard_checkpoints),
+    }, persist_paragraphs
+
+
+def _persist(task, submission, lease):
+    checkpoint = checkpoints.latest_checkpoint(submission)
+    if not checkpoint:
+        logger.warning("Submission %s has no ML response checkpoint — analyzing again", submission.id)
+        return {'status': 'reanalyzing', 'submission_id': str(submission.id)}, analyze_submission
+
+    # A failed earlier attempt may have left a Result behind
+    Result.objects.filter(submission=submission).delete()
+    _, paragraph_count = _persist_streamed_analysis(
+        submission, checkpoints.iter_checkpoint(checkpoint), with_report=False,
+    )
+    return {
+        'status': 'persisted',
+        'submission_id': str(submission.id),
+        'paragraphs': paragraph_count,
+    }, store_report
+
+
+def _store_report(task, submission, lease):
+    checkpoint = checkpoints.latest_checkpoint(submission)
+    if not checkpoint:
+        logger.warning("Submission %s has no ML response checkpoint — no report stored", submission.id)
+    elif text_extraction.has_paragraphs(submission) or slimming.has_slim(submission):
+        # Analyzed from text or a slim copy; the original PDF goes out to have the report drawn
+        save_rendered_report(submission.result, checkpoint)
+    else:
+        save_report_from_response(submission.result, checkpoints.iter_checkpoint(checkpoint))
+    return {'status': 'reported', 'submission_id': str(submission.id)}, finalize_submission
+
+
+def _finalize(task, submission, lease):
+    result = submission.result
+    submission.model_version = settings.ML_MODEL_VERSION
+    _mark_completed(submission, result.total_paragraphs)
+    analysis_cache.remember(submission)
+    _discard_work_files(submission)
+
+    submission.refresh_from_db(fields=['stage_timings'])
+    result.processing_time = round(
+        sum(timing['seconds'] for timing in submission.stage_timings.values()), 3,
     )
-    # ✅ Save the REAL processing task id (extract_paragraphs_from_pdf)
-    Submission.objects.filter(id=submission_id).update(task_id=str(task_result.id))
+    result.save(update_fields=['processing_time'])
+
+    logger.info("Submission %s completed (%d paragraphs)", submission.id, result.total_paragraphs)
+    return {
+        'status': 'success',
+        'submission_id': str(submission.id),
+        'paragraphs': result.total_paragraphs,
+    }, None
+
+
+#
+# Celery tasks
+#
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def extract_paragraphs_from_pdf(self, submission_id):
+    """Pipeline entry: claim the submission, skip duplicates, try the cache"""
+    lease = SubmissionLease(submission_id)
+    if not lease.acquire():
+        logger.info("Submission %s is already being processed — skipping duplicate", submission_id)
+        return {'status': 'duplicate', 'submission_id': str(submission_id)}
+
+    return _run_stage(self, 'preflight', submission_id, lease, _preflight)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def analyze_submission(self, submission_id, lease_token):
+    """Send the PDF to the ML service and checkpoint its response"""
+    lease = _adopt_lease(submission_id, lease_token, 'analyze')
+    if lease is None:
+        return {'status': 'duplicate', 'submission_id': str(submission_id)}
+    return _run_stage(self, 'analyze', submission_id, lease, _analyze)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def analyze_shard(self, submission_id, index, name):
+    """Analyze one page-range shard; returns its checkpoint, or None on failure"""
+    checkpoint = sharding.existing_shard_checkpoint(submission_id, index)
+    if checkpoint:
+        return checkpoint
+
+    submission = Submission.objects.filter(id=submission_id).first()
+    if submission is None:
+        # Deleted meanwhile; merge_shards sees a failed shard and stops
+        logger.error("Submission %s not found", submission_id)
+        return None
+    if submission.status == 'terminated':
+        return None
+    if submission.is_paused:
+        return sharding.SHARD_PAUSED
+
+    try:
+        started = time.monotonic()
+        with cancellation.watch(submission_id) as cancel_token, get_client().analyze_pdf(
+            submission, name=name, cancel_token=cancel_token,
+        ) as response:
+            checkpoint = sharding.save_shard_checkpoint(
+                submission_id,
+                index,
+                cancel_token.iter_checked(response.iter_bytes(settings.ML_RESPONSE_CHUNK_SIZE)),
+            )
+        scheduler.record_ml_time(submission.file.storage.size(name), time.monotonic() - started)
+    except SubmissionCancelled:
+        logger.info("Shard %d of submission %s cancelled", index, submission_id)
+        return None
+    except MLUnavailable as exc:
+        if self.request.retries >= settings.ML_SHARD_MAX_DEFERRALS:
+            logger.error("Shard %d of submission %s gave up waiting for the ML service", index, submission_id)
+            return None
+        # Wait for the ML service without spending a retry
+        countdown = max(int(exc.retry_after), settings.ML_DEFER_SECONDS)
+        raise self.retry(exc=exc, countdown=countdown, max_retries=None)
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            logger.exception("Shard %d of submission %s failed: %s", index, submission_id, exc)
+            return None
+        raise self.retry(exc=exc)
+
+    Submission.objects.filter(id=submission_id).update(
+        processed_paragraphs=F('processed_paragraphs') + sharding.count_paragraphs(checkpoint),
+    )
+    return checkpoint
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def merge_shards(self, shard_checkpoints, submission_id, lease_token, shard_names):
+    """Chord callback: combine shard responses into the submission's checkpoint"""
+    lease = _adopt_lease(submission_id, lease_token, 'merge')
+    if lease is None:
+        return {'status': 'duplicate', 'submission_id': str(submission_id)}
+    work = partial(_merge_shards, shard_checkpoints=shard_checkpoints, shard_names=shard_names)
+    return _run_stage(self, 'merge', submission_id, lease, work)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def persist_paragraphs(self, submission_id, lease_token):
+    """Write the Result and paragraph rows from the checkpointed response"""
+    lease = _adopt_lease(submission_id, lease_token, 'persist')
+    if lease is None:
+        return {'status': 'duplicate', 'submission_id': str(submission_id)}
+    return _run_stage(self, 'persist', submission_id, lease, _persist)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def store_report(self, submission_id, lease_token):
+    """Decode the PDF report from the checkpointed response into storage"""
+    lease = _adopt_lease(submission_id, lease_token, 'report')
+    if lease is None:
+        return {'status': 'duplicate', 'submission_id': str(submission_id)}
+    return _run_stage(self, 'report', submission_id, lease, _store_report)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def finalize_submission(self, submission_id, lease_token):
+    """Mark the submission completed and drop its checkpoint"""
+    lease = _adopt_lease(submission_id, lease_token, 'finalize')
+    if lease is None:
+        return {'status': 'duplicate', 'submission_id': str(submission_id)}
+    return _run_stage(self, 'finalize', submission_id, lease, _finalize)
+
+
+@shared_task(bind=True)
+def analyze_batch(self, submission_ids):
+    """
+    Analyze a claimed deadline batch with one ML request and hand each
+    analysis to the persist stage of its submission (see batching.py).
+    """
+    claimed = Submission.objects.filter(id__in=submission_ids, status='processing', task_id=self.request.id)
+    by_id = {str(submission.id): submission for submission in claimed}
+    batch = []
+    for submission_id in submission_ids:
+        submission = by_id.get(submission_id)
+        if submission is None:
+            continue
+        if submission.is_paused:
+            # Waits for the next flush once it is resumed
+            Submission.objects.filter(id=submission.id).update(status='batched')
+            continue
+        lease = SubmissionLease(submission.id)
+        if not lease.acquire():
+            continue
+        submission.stage_timings = {}
+        submission.save(update_fields=['stage_timings'])
+        if _complete_from_cache(submission) is not None:
+            lease.release()
+            continue
+        batch.append((submission, lease))
+
+    if not batch:
+        return {'status': 'empty', 'submissions': 0}
+
+    started_at = timezone.now()
+    started = time.monotonic()
+    analyzed = set()
+    try:
+        with get_client().analyze_batch([submission for submission, _ in batch]) as response:
+            results = iter_batch_results(response.iter_bytes(settings.ML_RESPONSE_CHUNK_SIZE))
+            for (submission, lease), events in zip(batch, results):
+                first = next(events, None)
+                if first is None or first[:2] == ('field', 'error'):
+                    logger.warning("Batch could not analyze submission %s: %s", submission.id, first)
+                    continue
+                checkpoints.save_checkpoint(submission, 0, encode_ml_events(chain([first], events)))
+                Submission.objects.filter(id=submission.id).update(stage_timings={'analyze': {
+                    'started_at': started_at.isoformat(),
+                    'seconds': round(time.monotonic() - started, 3),
+                }})
+                _start_next_stage(self, persist_paragraphs, submission.id, lease)
+                analyzed.add(submission.id)
+        scheduler.record_ml_time(sum(submission.file_size for submission, _ in batch), time.monotonic() - started)
+    except Exception as exc:
+        logger.exception("Batch of %d submissions failed: %s", len(batch), exc)
+
+    # Whatever the batch did not analyze goes through the regular pipeline
+    for submission, lease in batch:
+        lease.release()
+        if submission.id not in analyzed:
+            Submission.objects.filter(id=submission.id, status='processing').update(status='queued')
+            schedule_submission.delay(str(submission.id))
+
+    logger.info("Batch analyzed %d of %d submissions", len(analyzed), len(batch))
+    return {'status': 'analyzed', 'submissions': len(analyzed), 'fell_back': len(batch) - len(analyzed)}
+
+
+def _flush_batches(assignment_id):
+    for task_id, submission_ids in batching.claim_batches(assignment_id):
+        analyze_batch.apply_async(args=[submission_ids], task_id=task_id)
+
+
+@shared_task
+def flush_assignment_batches():
+    """Periodic: send the collected submissions of assignments past their deadline"""
+    assignment_ids = list(batching.due_assignments())
+    for assignment_id in assignment_ids:
+        _flush_batches(assignment_id)
+    return len(assignment_ids)
+
+
+@shared_task
+def reap_overdue_callbacks():
+    """Periodic: fail submissions whose ML callback never arrived"""
+    try:
+        overdue = overdue_callbacks()
+    except RedisError as exc:
+        logger.warning("Could not check pending ML callbacks: %s", exc)
+        return 0
+
+    reaped = 0
+    for submission_id in overdue:
+        # A callback arriving right now, or another reaper, may have taken it
+        if not stop_waiting(submission_id):
+            continue
+        failed = Submission.objects.filter(id=submission_id, status='processing').update(status='failed')
+        release_handed_off_lease(submission_id)
+        _release_slot(submission_id)
+        if failed:
+            logger.error(
+                "Submission %s failed: no ML callback within %ds", submission_id, settings.ML_CALLBACK_TIMEOUT,
+            )
+            submission = Submission.objects.filter(id=submission_id).first()
+            if submission is not None:
+                _discard_work_files(submission)
+            reaped += 1
+    return reaped
+
+
+@shared_task
+def reap_stale_submissions():
+    """
+    Periodic: requeue processing submissions that no worker holds a lease
+    on for STALE_SUBMISSION_SECONDS, e.g. after a worker was killed
+    """
+    # Resumed submissions wait for a slot without a lease; resume_stage marks them
+    waiting = Submission.objects.filter(status='processing', is_paused=False, resume_stage='')
+    candidates = waiting.values_list('id', flat=True)
+    try:
+        stale = locks.unleased_for(candidates, settings.STALE_SUBMISSION_SECONDS)
+    except RedisError as exc:
+        logger.warning("Could not check submission leases: %s", exc)
+        return 0
+
+    requeued = 0
+    for submission_id in stale:
+        locks.forget_unleased(submission_id)
+        if not waiting.filter(id=submission_id).update(status='queued'):
+            continue
+        # The analysis resumes from its checkpoint if the dead worker got that far
+        logger.warning("Submission %s was left processing without a worker — requeued", submission_id)
+        stop_waiting(submission_id)
+        scheduler.release(submission_id)
+        schedule_submission.delay(submission_id)
+        requeued += 1
+    return requeued
+
+
+@shared_task
+def expire_direct_uploads():
+    """Periodic: delete direct uploads and upload sessions that were never finished"""
+    from datetime import timedelta
+    from .direct_uploads import abort_session, discard_upload
+
+    # Leave time for an upload that started just before the form expired
+    cutoff = timezone.now() - timedelta(seconds=settings.DIRECT_UPLOAD_EXPIRY * 2)
+    expired = list(Submission.objects.filter(status='uploading', submitted_at__lt=cutoff))
+    for submission in expired:
+        discard_upload(submission)
+        submission.delete()
+
+    cutoff = timezone.now() - timedelta(seconds=settings.RESUMABLE_UPLOAD_EXPIRY)
+    sessions = list(UploadSession.objects.filter(completed_at__isnull=True, created_at__lt=cutoff))
+    for session in sessions:
+        abort_session(session)
+        session.delete()
+
+    if expired or sessions:
+        logger.info(
+            "Expired %d unfinished direct uploads and %d upload sessions", len(expired), len(sessions),
+        )
+    return len(expired) + len(sessions)
+
+
+_STAGE_TASKS = {
+    'analyze': analyze_submission,
+    'persist': persist_paragraphs,
+    'report': store_report,
+    'finalize': finalize_submission,
+}
+
+
+@shared_task
+def probe_ml_nodes():
+    """Periodic health probe that ejects and re-admits ML nodes"""
+    from .ml_pool import probe_nodes
+    return probe_nodes()
+
+
+@shared_task
+def run_async_executor():
+    """Drive many queued submissions concurrently from one worker slot"""
+    from .async_executor import run_executor
+    return run_executor()
+
+
+@shared_task
+def dispatch_submissions():
+    """Start scheduled submissions while pipeline slots are free"""
+    if not ml_guard.is_accepting():
+        # They would only be parked again; the breaker's half-open probe comes first
+        return 0
+    try:
+        return scheduler.dispatch(_start_submission)
+    except RedisError as exc:
+        logger.warning("Scheduler unavailable, nothing dispatched: %s", exc)
+        return 0
+
+
+@shared_task
+def schedule_submission(submission_id, user_role=None, is_teacher_view=False):
+    """Queue a submission in the fair-share scheduler and dispatch what is due"""
+    submission = Submission.objects.select_related('user', 'assignment').filter(id=submission_id).first()
+    if submission is None or submission.status == 'terminated':
+        return
+    try:
+        scheduler.enqueue(submission, user_role, is_teacher_view)
+    except RedisError as exc:
+        logger.warning("Scheduler unavailable, starting submission %s directly: %s", submission_id, exc)
+        _start_submission(submission_id)
+        return
+    dispatch_submissions()
+
+
+@shared_task
+def queue_submission_processing(submission_id, user_role, is_teacher_view=False):
+    # A re-evaluation must not be stopped by an earlier termination
+    cancellation.clear(submission_id)
+
+    # Deadline batch mode: wait for the rest of the class
+    submission = Submission.objects.select_related('assignment').filter(id=submission_id).first()
+    if submission is not None and batching.collects(submission):
+        if batching.hold(submission) >= settings.ML_BATCH_SIZE:
+            _flush_batches(submission.assignment_id)
+        return
+
+    # Fair share across classes and users replaces the broker priority,
+    # which the Redis transport ignores; the task id is recorded at dispatch
+    schedule_submission(submission_id, user_role, is_teacher_view)
 
 
 def queue_paragraph_tasks(submission_id, user_role, is_teacher_view=False):
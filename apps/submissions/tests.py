@@ -1,3 +1,603 @@
-from django.test import TestCase
+"""
+Behaviour tests for the submission pipeline's coordination pieces: the
+processing lease and its stage hand-off, scheduler slots, report-stage
+selection, chunked analysis, the deadline check of completed uploads,
+report downloads and incremental decoding of ML responses.
 
-# Create your tests here.
+Redis is replaced by fakeredis (with Lua, for the scripts) and the ML
+service by mocks, so no broker, Redis server or ML node is needed.
+"""
+import base64
+import json
+import os
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+import fakeredis
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.authentication.models import User
+from apps.classes.models import Assignment, Class
+from apps.core import redis_client
+from . import locks, ml_client, scheduler, tasks, views
+from .ml_stream import (
+    Base64StreamDecoder,
+    MLStreamError,
+    encode_ml_events,
+    iter_batch_results,
+    iter_ml_events,
+)
+from .models import Submission, UploadSession
+
+
+class FakeRedisMixin:
+    """Point apps.core.redis_client at a private fakeredis instance"""
+
+    def setUp(self):
+        super().setUp()
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        for name, value in (('_client', self.redis), ('_client_pid', os.getpid())):
+            patcher = mock.patch.object(redis_client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+def _user(role='student'):
+    return User.objects.create_user(
+        email=f'{uuid.uuid4().hex[:8]}@example.com',
+        username=uuid.uuid4().hex[:8],
+        password='x',
+        role=role,
+    )
+
+
+def _submission(user, **fields):
+    # Only the file name is stored; none of these tests read the file
+    return Submission.objects.create(
+        user=user,
+        assignment_name='Essay',
+        file='submissions/test.pdf',
+        original_filename='test.pdf',
+        file_size=5,
+        **fields,
+    )
+
+
+def _chunked(body, size):
+    return (body[i:i + size] for i in range(0, len(body), size))
+
+
+class SubmissionLeaseTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.submission_id = uuid.uuid4()
+
+    def _lease(self, **kwargs):
+        lease = locks.SubmissionLease(self.submission_id, **kwargs)
+        self.addCleanup(lease.release)
+        return lease
+
+    def test_second_acquire_is_refused(self):
+        self.assertTrue(self._lease().acquire())
+        self.assertFalse(self._lease().acquire())
+
+    def test_release_frees_the_submission(self):
+        lease = self._lease()
+        lease.acquire()
+        lease.release()
+        self.assertTrue(self._lease().acquire())
+
+    def test_adopt_needs_a_hand_off(self):
+        lease = self._lease()
+        lease.acquire()
+        self.assertFalse(self._lease(token=lease.token).adopt())
+
+    def test_handed_off_lease_is_adopted_once(self):
+        lease = self._lease()
+        lease.acquire()
+        lease.hand_off(30)
+
+        self.assertEqual(self.redis.get(locks._key(self.submission_id)), f'handed:{lease.token}')
+        self.assertTrue(self._lease(token=lease.token).adopt())
+        # A duplicate delivery of the same stage message
+        self.assertFalse(self._lease(token=lease.token).adopt())
+
+    def test_released_lease_cannot_be_adopted(self):
+        lease = self._lease()
+        lease.acquire()
+        lease.hand_off(30)
+        adopted = self._lease(token=lease.token)
+        adopted.adopt()
+        adopted.release()
+        self.assertFalse(self._lease(token=lease.token).adopt())
+
+    def test_hand_off_keeps_duplicates_out(self):
+        lease = self._lease()
+        lease.acquire()
+        lease.hand_off(30)
+        self.assertFalse(self._lease().acquire())
+
+    def test_hand_off_does_not_take_a_lease_back(self):
+        lease = self._lease()
+        lease.acquire()
+        self.redis.set(locks._key(self.submission_id), 'someone-else')
+        lease.hand_off(30)
+        self.assertEqual(self.redis.get(locks._key(self.submission_id)), 'someone-else')
+
+    def test_resumed_stage_gets_a_handed_off_lease(self):
+        token = locks.handed_off_lease(self.submission_id, 30)
+        self.assertIsNotNone(token)
+        self.assertIsNone(locks.handed_off_lease(self.submission_id, 30))
+        self.assertTrue(self._lease(token=token).adopt())
+
+    def test_handed_off_lease_released_for_callback(self):
+        lease = self._lease()
+        lease.acquire()
+        lease.hand_off(30)
+        locks.release_handed_off_lease(self.submission_id)
+        self.assertFalse(self.redis.exists(locks._key(self.submission_id)))
+
+
+class StageHandOffTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.submission = _submission(_user(), status='processing')
+        self.task = mock.Mock()
+        self.task.request.delivery_info = {'priority': 3}
+
+    def test_next_stage_adopts_the_lease(self):
+        lease = locks.SubmissionLease(self.submission.id)
+        lease.acquire()
+        stage_task = mock.Mock()
+
+        tasks._start_next_stage(self.task, stage_task, self.submission.id, lease)
+
+        kwargs = stage_task.apply_async.call_args.kwargs
+        self.assertEqual(kwargs['args'], [str(self.submission.id), lease.token])
+        self.assertEqual(kwargs['priority'], 3)
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.task_id, kwargs['task_id'])
+
+        adopted = tasks._adopt_lease(self.submission.id, lease.token, 'persist')
+        self.assertIsNotNone(adopted)
+        self.assertIsNone(tasks._adopt_lease(self.submission.id, lease.token, 'persist'))
+        adopted.release()
+
+    def test_late_duplicate_of_a_finished_pipeline_is_skipped(self):
+        Submission.objects.filter(id=self.submission.id).update(status='completed')
+        stage_task = mock.Mock()
+        with mock.patch.dict(tasks._STAGE_TASKS, {'persist': stage_task}):
+            self.assertIsNone(tasks._adopt_lease(self.submission.id, 'stale-token', 'persist'))
+        stage_task.apply_async.assert_not_called()
+
+    def test_expired_hand_off_restarts_the_stage(self):
+        stage_task = mock.Mock()
+        with mock.patch.dict(tasks._STAGE_TASKS, {'analyze': stage_task}):
+            # merge_shards found its lease gone: the chord runs again
+            self.assertIsNone(tasks._adopt_lease(self.submission.id, 'expired-token', 'merge'))
+            self.assertIsNone(tasks._adopt_lease(self.submission.id, 'expired-token', 'merge'))
+
+        stage_task.apply_async.assert_called_once()
+        submission_id, lease_token = stage_task.apply_async.call_args.kwargs['args']
+        self.assertEqual(submission_id, str(self.submission.id))
+        self.assertIsNotNone(tasks._adopt_lease(self.submission.id, lease_token, 'analyze'))
+
+    def test_failed_stage_hands_its_lease_to_the_retry(self):
+        lease = locks.SubmissionLease(self.submission.id)
+        lease.acquire()
+        self.task.request.retries = 0
+        self.task.max_retries = 3
+        self.task.retry.side_effect = RuntimeError('retry')
+
+        with self.assertRaisesMessage(RuntimeError, 'retry'):
+            tasks._defer_and_process_next(self.task, self.submission.id, ValueError('boom'), lease=lease)
+
+        retried = tasks._adopt_lease(self.submission.id, lease.token, 'persist')
+        self.assertIsNotNone(retried)
+        retried.release()
+
+    def test_exhausted_retries_fail_the_submission(self):
+        self.task.request.retries = 3
+        self.task.max_retries = 3
+
+        with mock.patch.object(tasks, '_discard_work_files') as discard:
+            outcome = tasks._defer_and_process_next(self.task, self.submission.id, ValueError('boom'))
+
+        self.assertEqual(outcome['status'], 'failed')
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.status, 'failed')
+        discard.assert_called_once()
+
+
+@override_settings(SCHEDULER_MAX_IN_FLIGHT=1)
+class SchedulerSlotTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = _user()
+
+    def _in_flight(self, submission):
+        return self.redis.zscore(scheduler.INFLIGHT_KEY, str(submission.id)) is not None
+
+    def test_pop_takes_a_slot_up_to_the_cap(self):
+        first, second = _submission(self.user), _submission(self.user)
+        scheduler.enqueue(first)
+        scheduler.enqueue(second)
+
+        self.assertEqual(scheduler.pop(), str(first.id))
+        self.assertTrue(self._in_flight(first))
+        self.assertIsNone(scheduler.pop())
+
+    def test_release_frees_the_slot_once(self):
+        first, second = _submission(self.user), _submission(self.user)
+        scheduler.enqueue(first)
+        scheduler.enqueue(second)
+        scheduler.pop()
+
+        self.assertTrue(scheduler.release(first.id))
+        self.assertFalse(scheduler.release(first.id))
+        self.assertFalse(self._in_flight(first))
+        self.assertEqual(scheduler.pop(), str(second.id))
+
+    def test_dispatch_releases_the_slot_when_start_fails(self):
+        submission = _submission(self.user)
+        scheduler.enqueue(submission)
+
+        with self.assertRaises(RuntimeError):
+            scheduler.dispatch(mock.Mock(side_effect=RuntimeError('broker down')))
+        self.assertFalse(self._in_flight(submission))
+
+    @mock.patch('apps.submissions.views.dispatch_submissions')
+    @mock.patch('celery.current_app.control.revoke')
+    def test_terminate_releases_lease_and_slot(self, revoke, dispatch):
+        submission = _submission(self.user, status='processing', task_id='stage-task')
+        scheduler.enqueue(submission)
+        scheduler.pop()
+        lease = locks.SubmissionLease(submission.id)
+        lease.acquire()
+        lease.hand_off(30)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(f'/api/submissions/{submission.id}/terminate/')
+
+        self.assertEqual(response.status_code, 200)
+        revoke.assert_called_once()
+        dispatch.delay.assert_called_once_with()
+        self.assertFalse(self._in_flight(submission))
+        self.assertFalse(self.redis.exists(locks._key(submission.id)))
+        submission.refresh_from_db()
+        self.assertEqual(submission.status, 'terminated')
+
+
+@override_settings(STALE_SUBMISSION_SECONDS=300)
+@mock.patch.object(tasks.schedule_submission, 'delay')
+class StaleSubmissionTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.submission = _submission(_user(), status='processing')
+
+    def _missing_since(self, seconds_ago):
+        self.redis.zadd(locks.UNLEASED_KEY, {str(self.submission.id): locks.time.time() - seconds_ago})
+
+    def test_leased_submission_is_left_alone(self, schedule):
+        lease = locks.SubmissionLease(self.submission.id)
+        lease.acquire()
+        self.addCleanup(lease.release)
+        self._missing_since(600)
+
+        self.assertEqual(tasks.reap_stale_submissions(), 0)
+        schedule.assert_not_called()
+        # Having a lease again resets the clock
+        self.assertIsNone(self.redis.zscore(locks.UNLEASED_KEY, str(self.submission.id)))
+
+    def test_unleased_submission_gets_a_grace_period(self, schedule):
+        self.assertEqual(tasks.reap_stale_submissions(), 0)
+        self._missing_since(60)
+        self.assertEqual(tasks.reap_stale_submissions(), 0)
+        schedule.assert_not_called()
+
+    def test_abandoned_submission_is_requeued(self, schedule):
+        scheduler.enqueue(self.submission)
+        scheduler.pop()
+        self._missing_since(600)
+
+        self.assertEqual(tasks.reap_stale_submissions(), 1)
+        schedule.assert_called_once_with(str(self.submission.id))
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.status, 'queued')
+        self.assertIsNone(self.redis.zscore(scheduler.INFLIGHT_KEY, str(self.submission.id)))
+
+    def test_paused_submission_is_not_requeued(self, schedule):
+        Submission.objects.filter(id=self.submission.id).update(is_paused=True, resume_stage='analyze')
+        self._missing_since(600)
+
+        self.assertEqual(tasks.reap_stale_submissions(), 0)
+        schedule.assert_not_called()
+
+
+@mock.patch('apps.submissions.views.queue_submission_processing')
+@mock.patch.object(views.direct_uploads, 'verify_upload')
+@mock.patch.object(views.direct_uploads, 'complete_session')
+@mock.patch.object(views.direct_uploads, 'missing_parts', return_value=[])
+@mock.patch.object(views.direct_uploads, 'uploaded_parts', return_value=[])
+class UploadDeadlineTests(TestCase):
+
+    def setUp(self):
+        self.student = _user()
+        teacher = _user(role='teacher')
+        class_obj = Class.objects.create(name='Class', teacher=teacher)
+        self.assignment = Assignment.objects.create(
+            class_obj=class_obj,
+            title='Essay',
+            deadline=timezone.now() - timedelta(hours=1),
+            created_by=teacher,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def _complete(self):
+        session = UploadSession.objects.create(
+            user=self.student,
+            assignment=self.assignment,
+            assignment_name='Essay',
+            original_filename='essay.pdf',
+            file_size=5,
+            part_size=5,
+            file_name='submissions/essay.pdf',
+            multipart_upload_id='upload',
+        )
+        return self.client.post(f'/api/submissions/uploads/{session.id}/complete/')
+
+    def test_deadline_passed_during_upload(self, uploaded, missing, complete, verify, queue):
+        response = self._complete()
+
+        self.assertEqual(response.status_code, 400)
+        complete.assert_not_called()
+        queue.delay.assert_not_called()
+        self.assertFalse(Submission.objects.exists())
+
+    def test_late_submissions_allowed(self, uploaded, missing, complete, verify, queue):
+        self.assignment.allow_late_submissions = True
+        self.assignment.save()
+
+        response = self._complete()
+
+        self.assertEqual(response.status_code, 201)
+        complete.assert_called_once()
+        queue.delay.assert_called_once()
+
+    def test_direct_upload_finalized_after_the_deadline(self, uploaded, missing, complete, verify, queue):
+        submission = _submission(self.student, assignment=self.assignment, status='uploading')
+
+        response = self.client.post(f'/api/submissions/{submission.id}/finalize/')
+
+        self.assertEqual(response.status_code, 400)
+        verify.assert_not_called()
+        queue.delay.assert_not_called()
+        submission.refresh_from_db()
+        self.assertEqual(submission.status, 'uploading')
+
+
+@mock.patch.object(tasks, 'get_client')
+@mock.patch.object(tasks.checkpoints, 'iter_checkpoint', return_value=iter([b'{}']))
+@mock.patch.object(tasks.checkpoints, 'latest_checkpoint', return_value='checkpoint')
+class ReportStageTests(SimpleTestCase):
+
+    def setUp(self):
+        self.submission = mock.Mock(id=uuid.uuid4())
+
+    def _store_report(self, has_paragraphs=False, has_slim=False):
+        with mock.patch.object(tasks.text_extraction, 'has_paragraphs', return_value=has_paragraphs), \
+                mock.patch.object(tasks.slimming, 'has_slim', return_value=has_slim), \
+                mock.patch.object(tasks, 'save_rendered_report') as rendered, \
+                mock.patch.object(tasks, 'save_report_from_response') as from_response:
+            outcome, next_stage = tasks._store_report(mock.Mock(), self.submission, mock.Mock())
+        self.assertEqual(outcome['status'], 'reported')
+        self.assertIs(next_stage, tasks.finalize_submission)
+        return rendered, from_response
+
+    def test_pdf_analysis_keeps_the_report_from_the_response(self, latest, iter_checkpoint, get_client):
+        rendered, from_response = self._store_report()
+        rendered.assert_not_called()
+        from_response.assert_called_once_with(self.submission.result, iter_checkpoint.return_value)
+
+    def test_slimmed_pdf_has_the_report_rendered_on_the_original(self, latest, iter_checkpoint, get_client):
+        rendered, from_response = self._store_report(has_slim=True)
+        rendered.assert_called_once_with(self.submission.result, 'checkpoint')
+        from_response.assert_not_called()
+
+    def test_text_analysis_has_the_report_rendered(self, latest, iter_checkpoint, get_client):
+        rendered, from_response = self._store_report(has_paragraphs=True)
+        rendered.assert_called_once_with(self.submission.result, 'checkpoint')
+        from_response.assert_not_called()
+
+    def test_no_checkpoint_no_report(self, latest, iter_checkpoint, get_client):
+        latest.return_value = None
+        rendered, from_response = self._store_report(has_paragraphs=True)
+        rendered.assert_not_called()
+        from_response.assert_not_called()
+
+    def test_callback_cleans_up_like_finalize(self, latest, iter_checkpoint, get_client):
+        with mock.patch.object(tasks, '_persist_and_complete', return_value=4) as persist, \
+                mock.patch.object(tasks, '_discard_work_files') as discard:
+            self.assertEqual(tasks.complete_from_callback(self.submission, iter([b'{}'])), 4)
+            persist.side_effect = MLStreamError('truncated')
+            with self.assertRaises(MLStreamError):
+                tasks.complete_from_callback(self.submission, iter([b'{']))
+        self.assertEqual(discard.call_count, 2)
+
+
+@mock.patch.object(tasks, 'get_client')
+@mock.patch.object(tasks.sharding, 'count_paragraphs', return_value=3)
+@mock.patch.object(tasks.sharding, 'write_shard', return_value='ml-shards/chunk.pdf')
+class ChunkedAnalysisTests(FakeRedisMixin, TestCase):
+
+    page_ranges = [(0, 20), (20, 40), (40, 50)]
+
+    def setUp(self):
+        super().setUp()
+        self.submission = _submission(_user(), status='processing')
+        self.task = mock.Mock()
+        self.task.request.retries = 0
+        for name, value in (
+            ('save_chunk_checkpoint', mock.DEFAULT),
+            ('existing_chunk_checkpoint', mock.DEFAULT),
+            ('discard_chunks', mock.DEFAULT),
+        ):
+            patcher = mock.patch.object(tasks.sharding, name, value)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.save_chunk_checkpoint.side_effect = lambda submission_id, start, end, chunks: f'chunk-{start}'
+        self.existing_chunk_checkpoint.return_value = None
+
+    def _analyze(self):
+        with mock.patch.object(tasks.scheduler, 'record_ml_time'), \
+                mock.patch.object(self.submission.file.storage, 'size', return_value=5), \
+                mock.patch.object(tasks.checkpoints, 'save_checkpoint') as save_checkpoint, \
+                mock.patch.object(tasks.sharding, 'iter_merged_response', side_effect=list) as merged:
+            outcome, next_stage = tasks._analyze_in_chunks(self.task, self.submission, self.page_ranges)
+        return outcome, next_stage, save_checkpoint, merged
+
+    def test_chunks_are_merged_with_progress(self, write_shard, count_paragraphs, get_client):
+        outcome, next_stage, save_checkpoint, merged = self._analyze()
+
+        self.assertIs(next_stage, tasks.persist_paragraphs)
+        self.assertEqual(get_client.return_value.analyze_pdf.call_count, 3)
+        merged.assert_called_once_with(['chunk-0', 'chunk-20', 'chunk-40'])
+        save_checkpoint.assert_called_once()
+        self.discard_chunks.assert_called_once_with(self.submission, self.page_ranges)
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.processed_paragraphs, 9)
+
+    def test_pause_stops_between_chunks(self, write_shard, count_paragraphs, get_client):
+        def pause_after_first(submission_id, start, end, chunks):
+            Submission.objects.filter(id=submission_id).update(is_paused=True)
+            return f'chunk-{start}'
+        self.save_chunk_checkpoint.side_effect = pause_after_first
+
+        outcome, next_stage, save_checkpoint, merged = self._analyze()
+
+        self.assertEqual(outcome['status'], 'paused')
+        self.assertIsNone(next_stage)
+        self.assertEqual(get_client.return_value.analyze_pdf.call_count, 1)
+        save_checkpoint.assert_not_called()
+        self.discard_chunks.assert_not_called()
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.resume_stage, 'analyze')
+        self.assertEqual(self.submission.processed_paragraphs, 3)
+
+    def test_resume_skips_analyzed_chunks(self, write_shard, count_paragraphs, get_client):
+        self.existing_chunk_checkpoint.side_effect = lambda submission_id, start, end: (
+            f'chunk-{start}' if start < 40 else None
+        )
+
+        outcome, next_stage, save_checkpoint, merged = self._analyze()
+
+        self.assertIs(next_stage, tasks.persist_paragraphs)
+        self.assertEqual(get_client.return_value.analyze_pdf.call_count, 1)
+        merged.assert_called_once_with(['chunk-0', 'chunk-20', 'chunk-40'])
+
+
+@override_settings(ML_SERVICE_URLS=['http://ml-1:8001', 'http://ml-2:8001'])
+@mock.patch.object(ml_client.httpx, 'get')
+class ReportDownloadTests(SimpleTestCase):
+
+    def setUp(self):
+        self.client = ml_client.MLClient()
+        self.client.close()
+        self.client._http = mock.Mock()
+
+    def test_ml_node_url_uses_the_pooled_client(self, plain_get):
+        self.client._http.get.return_value = mock.Mock(status_code=200, content=b'%PDF')
+
+        self.assertEqual(self.client.download('http://ml-2:8001/reports/1.pdf'), b'%PDF')
+        plain_get.assert_not_called()
+
+    def test_other_hosts_do_not_get_the_api_key(self, plain_get):
+        plain_get.return_value = mock.Mock(status_code=200, content=b'%PDF')
+
+        for url in ('https://bucket.s3.amazonaws.com/report.pdf', 'http://ml-1:9000/report.pdf'):
+            self.assertEqual(self.client.download(url), b'%PDF')
+        self.client._http.get.assert_not_called()
+        self.assertNotIn('headers', plain_get.call_args.kwargs)
+
+
+class MLStreamTests(SimpleTestCase):
+
+    analysis = {
+        'paragraphs': [
+            {'paragraph_number': 1, 'paragraph_text': 'Café "quoted" \\ text\n', 'ai_score': 0.25},
+            {'paragraph_number': 2, 'paragraph_text': '— \U0001F600', 'ai_score': 0.9},
+        ],
+        'document_summary': {'ai_percentage': 50.0, 'total_paragraphs': 2},
+        'pdf_report_base64': base64.b64encode(b'%PDF-1.4 report bytes' * 20).decode('ascii'),
+        'model': None,
+    }
+
+    def _events(self, body, size):
+        events = []
+        for event in iter_ml_events(_chunked(body, size)):
+            if event[0] == 'report':
+                decoder = Base64StreamDecoder()
+                report = b''.join(decoder.decode(segment) for segment in event[1]) + decoder.flush()
+                events.append(('report', report))
+            else:
+                events.append(event)
+        return events
+
+    def test_decodes_independently_of_chunk_boundaries(self):
+        body = json.dumps(self.analysis).encode('utf-8')
+        expected = [
+            ('paragraph', self.analysis['paragraphs'][0]),
+            ('paragraph', self.analysis['paragraphs'][1]),
+            ('field', 'document_summary', self.analysis['document_summary']),
+            ('report', b'%PDF-1.4 report bytes' * 20),
+            ('field', 'model', None),
+        ]
+        for size in (1, 3, 7, 64, len(body)):
+            with self.subTest(chunk_size=size):
+                self.assertEqual(self._events(body, size), expected)
+
+    def test_unread_report_is_skipped(self):
+        body = json.dumps(self.analysis).encode('utf-8')
+        kinds = [event[0] for event in iter_ml_events(_chunked(body, 5))]
+        self.assertEqual(kinds, ['paragraph', 'paragraph', 'field', 'report', 'field'])
+
+    def test_empty_paragraphs(self):
+        events = list(iter_ml_events([b'{"paragraphs": [], "document_summary": {}}']))
+        self.assertEqual(events, [('field', 'document_summary', {})])
+
+    def test_batch_results_in_upload_order(self):
+        second = {'paragraphs': [{'paragraph_number': 1, 'ai_score': 0.5}], 'document_summary': {}}
+        body = json.dumps({'results': [self.analysis, second], 'count': 2}).encode('utf-8')
+
+        analyses = [
+            [event[0] for event in events]
+            for events in iter_batch_results(_chunked(body, 11))
+        ]
+        self.assertEqual(analyses, [
+            ['paragraph', 'paragraph', 'field', 'report', 'field'],
+            ['paragraph', 'field'],
+        ])
+
+    def test_encode_round_trips(self):
+        body = json.dumps(self.analysis).encode('utf-8')
+        encoded = b''.join(encode_ml_events(iter_ml_events(_chunked(body, 9))))
+        self.assertEqual(json.loads(encoded), self.analysis)
+
+    def test_malformed_body_raises(self):
+        for body in (b'[1, 2]', b'{"paragraphs": [{"a": 1} {"b": 2}]}', b'{"document_summary": {'):
+            with self.subTest(body=body), self.assertRaises(MLStreamError):
+                list(iter_ml_events(_chunked(body, 4)))
+
+    def test_invalid_base64_report_raises(self):
+        decoder = Base64StreamDecoder()
+        with self.assertRaises(MLStreamError):
+            decoder.decode('a===')
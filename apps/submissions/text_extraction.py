@@ -0,0 +1,162 @@
+"""
+Local text extraction from submitted PDFs.
+
+With ML_TEXT_EXTRACTION on, the preflight stage extracts the paragraphs of
+a PDF in the worker and stores them next to the ML checkpoints. The analyze
+stage then sends compact paragraph texts to /api/analyze_text (through the
+paragraph cache) instead of uploading the whole PDF with its images and
+fonts, and the PDF itself is only sent to the ML service to render the
+report (store_report stage). Both /api/analyze_text and /api/render_report
+must be provided by the ML service, which is why the mode is off by
+default.
+
+Pages are read one at a time with pypdf, so memory is bounded by the
+largest page plus the extracted text. Paragraph boundaries are guessed
+from the text layout:
+
+- a blank line, or a line that ends a sentence and stops well short of
+  the page's full line width, ends a paragraph,
+- a paragraph cut off at the bottom of a page continues on the next one,
+  past a page number on a line of its own,
+- fragments shorter than PARAGRAPH_MIN_WORDS (headings, captions, page
+  numbers) are joined to the paragraph that follows.
+
+Documents without a usable text layer (scans) keep the PDF path.
+"""
+import gzip
+import json
+import logging
+import re
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from . import checkpoints
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover - extraction is optional
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r'[.!?:;"”’)]$')
+_HYPHENATED = re.compile(r'\w-$')
+_PAGE_NUMBER = re.compile(r'^(page\s*)?[-–]?\s*\d+\s*[-–]?$', re.IGNORECASE)
+
+# A line this much shorter than the page's longest line may end a paragraph
+_SHORT_LINE = 0.8
+
+
+def text_name(submission_id):
+    return f'{checkpoints.CHECKPOINT_DIR}/{submission_id}/paragraphs.json.gz'
+
+
+def iter_page_texts(submission):
+    """Yield the text of each page of the submission's PDF in order"""
+    with submission.file.storage.open(submission.file.name, 'rb') as fh:
+        for page in PdfReader(fh).pages:
+            yield page.extract_text() or ''
+
+
+def _page_paragraphs(text):
+    """Split one page's text into paragraph fragments; the last may be unfinished"""
+    lines = [line.strip() for line in text.splitlines()]
+    lines = [line for line in lines if not _PAGE_NUMBER.match(line)]
+    width = max((len(line) for line in lines), default=0)
+    paragraphs, current = [], []
+    for line in lines:
+        if not line:
+            if current:
+                paragraphs.append(current)
+                current = []
+            continue
+        current.append(line)
+        if _SENTENCE_END.search(line) and len(line) < width * _SHORT_LINE:
+            paragraphs.append(current)
+            current = []
+    if current:
+        paragraphs.append(current)
+    return [_join_lines(paragraph) for paragraph in paragraphs]
+
+
+def _join_lines(lines):
+    text = ''
+    for line in lines:
+        if _HYPHENATED.search(text):
+            text = text[:-1] + line
+        else:
+            text = f'{text} {line}' if text else line
+    return text
+
+
+def iter_paragraphs(page_texts):
+    """Yield document paragraphs from page texts, joining across page breaks"""
+    min_words = settings.PARAGRAPH_MIN_WORDS
+    carry = ''
+    for page_text in page_texts:
+        fragments = _page_paragraphs(page_text)
+        for index, fragment in enumerate(fragments):
+            if carry:
+                fragment = _join_lines([carry, fragment])
+                carry = ''
+            unfinished = index == len(fragments) - 1 and not _SENTENCE_END.search(fragment)
+            if unfinished or len(fragment.split()) < min_words:
+                carry = fragment
+                continue
+            yield fragment
+    if carry:
+        yield carry
+
+
+def extract_paragraphs(submission):
+    """
+    Extract and store the submission's paragraphs; returns how many were
+    found, or 0 when the PDF has too little text and must be sent whole.
+    """
+    if PdfReader is None or not settings.ML_TEXT_EXTRACTION:
+        return 0
+    # A retried preflight must not leave a stale copy behind
+    discard_paragraphs(submission)
+    try:
+        paragraphs = list(iter_paragraphs(iter_page_texts(submission)))
+    except Exception as exc:
+        logger.warning("Could not extract text of submission %s, sending the PDF: %s", submission.id, exc)
+        return 0
+
+    characters = sum(len(paragraph) for paragraph in paragraphs)
+    if characters < settings.ML_TEXT_MIN_CHARS:
+        logger.info("Submission %s has no usable text layer, sending the PDF", submission.id)
+        return 0
+
+    checkpoints.write_checkpoint(
+        text_name(submission.id),
+        [json.dumps(paragraphs).encode('utf-8')],
+    )
+    logger.info(
+        "Extracted %d paragraphs (%d characters) from submission %s",
+        len(paragraphs), characters, submission.id,
+    )
+    return len(paragraphs)
+
+
+def has_paragraphs(submission):
+    return default_storage.exists(text_name(submission.id))
+
+
+def stored_paragraphs(submission):
+    """Paragraphs extracted by preflight, or None to analyze the PDF"""
+    name = text_name(submission.id)
+    if not has_paragraphs(submission):
+        return None
+    with default_storage.open(name, 'rb') as fh, gzip.GzipFile(fileobj=fh) as compressed:
+        return json.loads(compressed.read().decode('utf-8'))
+
+
+def discard_paragraphs(submission):
+    name = text_name(submission.id)
+    try:
+        if default_storage.exists(name):
+            default_storage.delete(name)
+    except Exception as exc:
+        logger.warning("Could not delete extracted text %s: %s", name, exc)
@@ -3,13 +3,16 @@ Submissions app URLs
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import SubmissionViewSet
+from .views import SubmissionViewSet, UploadSessionViewSet, MLCallbackView
 
 router = DefaultRouter()
+# Before the submissions at the root, whose detail route would match 'uploads/'
+router.register(r'uploads', UploadSessionViewSet, basename='upload-session')
 router.register(r'', SubmissionViewSet, basename='submission')
 
 app_name = 'submissions'
 
 urlpatterns = [
+    path('ml-callback/<uuid:submission_id>/', MLCallbackView.as_view(), name='ml-callback'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
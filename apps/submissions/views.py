@@ -464,23 +464,39 @@ from django.shortcuts import render
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.views import APIView
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.http import Http404
 from django.utils import timezone
 from django.db.models import Q
 from apps.dashboard import serializers
 from apps.authentication.permissions import IsStudent, IsTeacher
-from .tasks import queue_paragraph_tasks, queue_submission_processing
+from .tasks import (
+    complete_from_callback, dispatch_submissions, queue_submission_processing, resume_processing,
+    _discard_work_files,
+)
+from .webhooks import stop_waiting, verify_callback_token
+from .cancellation import cancel as cancel_submission
+from .locks import release_handed_off_lease
+from .ml_pool import node_stats
+from . import direct_uploads, scheduler
+from redis.exceptions import RedisError
 from celery.app.control import Control
 import celery
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Models
-from .models import Submission
+from .models import Submission, UploadSession
 from apps.classes.models import Assignment
 # Serializers
 from .serializers import (
     SubmissionSerializer,
     SubmissionCreateSerializer,
+    DirectUploadSerializer,
     ExtensionRequestSerializer
 )
 
@@ -492,6 +508,8 @@ class SubmissionViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action == 'create':
             return SubmissionCreateSerializer
+        elif self.action == 'start_upload':
+            return DirectUploadSerializer
         elif self.action == 'request_extension':
             return ExtensionRequestSerializer
         return SubmissionSerializer
@@ -652,13 +670,90 @@ class SubmissionViewSet(viewsets.ModelViewSet):
         #     user_role=self.request.user.role,
         #     is_teacher_view=False
         # )
-        task_result = queue_submission_processing.delay(  # 👈 renamed to task_result
+        # The scheduler records the pipeline's task id when it starts it
+        queue_submission_processing.delay(
             submission_id=str(submission.id),
             user_role=self.request.user.role,
             is_teacher_view=False
         )
-        submission.task_id = str(task_result.id)  # 👈 task_result.id
-        submission.save(update_fields=['task_id'])
+
+    @action(detail=False, methods=['post'], url_path='upload')
+    def start_upload(self, request):
+        """Create a submission and return a presigned POST to upload its PDF to storage"""
+        if not direct_uploads.available():
+            return Response(
+                {'error': 'Direct uploads are not available, upload the file instead'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        # Admission control: keep guests out while their backlog is too long
+        if request.user.is_guest():
+            retry_after = scheduler.guest_retry_after()
+            if retry_after:
+                return Response(
+                    {'error': 'The service is busy, please try again later', 'retry_after': retry_after},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
+                    headers={'Retry-After': str(retry_after)},
+                )
+
+        submission = Submission(
+            user=request.user,
+            assignment=data.get('assignment'),
+            assignment_name=data['assignment_name'],
+            original_filename=data['filename'],
+            file_size=data['file_size'],
+            status='uploading'
+        )
+        direct_uploads.assign_upload_name(submission)
+        submission.save()
+
+        return Response({
+            'id': str(submission.id),
+            'upload': direct_uploads.presigned_post(submission),
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Check a directly uploaded PDF and queue it for processing"""
+        submission = self.get_object()
+
+        if submission.user != request.user:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        if submission.status != 'uploading':
+            return Response(
+                {'error': f'Submission is {submission.status}, not awaiting an upload'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # The deadline may have passed while the file was uploading
+        if not submission.can_submit():
+            return Response(
+                {'error': 'Deadline has passed. Request an extension.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            direct_uploads.verify_upload(submission)
+        except direct_uploads.UploadRejected as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Only one of concurrent finalize calls queues the submission
+        claimed = Submission.objects.filter(id=submission.id, status='uploading').update(status='queued')
+        if claimed:
+            queue_submission_processing.delay(
+                submission_id=str(submission.id),
+                user_role=request.user.role,
+                is_teacher_view=False
+            )
+
+        submission.refresh_from_db()
+        serializer = SubmissionSerializer(submission, context=self.get_serializer_context())
+        return Response(serializer.data)
 
     @action(detail=True, methods=['post'], permission_classes=[IsStudent])
     def request_extension(self, request, pk=None):
@@ -706,6 +801,22 @@ class SubmissionViewSet(viewsets.ModelViewSet):
         """Get submission processing status"""
         submission = self.get_object()
 
+        # Where the submission stands in the scheduler, while it is there
+        estimate = None
+        if submission.status in ('queued', 'deferred', 'processing'):
+            try:
+                estimate = scheduler.estimate(submission)
+            except RedisError as exc:
+                logger.warning("Could not estimate submission %s: %s", submission.id, exc)
+        estimate = estimate or {}
+
+        # A provisional Result holds the quick estimate until the full analysis replaces it
+        result = getattr(submission, 'result', None)
+        if result is None:
+            analysis_phase = None
+        else:
+            analysis_phase = 'provisional' if result.is_provisional else 'final'
+
         return Response({
             'id': str(submission.id),
             'status': submission.status,
@@ -715,6 +826,12 @@ class SubmissionViewSet(viewsets.ModelViewSet):
             'is_complete': submission.status == 'completed',
             'is_paused': submission.is_paused,
             'paused_at': submission.paused_at,
+            'queue_position': estimate.get('queue_position'),
+            'estimated_wait_seconds': estimate.get('estimated_wait_seconds'),
+            'estimated_completion_at': estimate.get('estimated_completion_at'),
+            'analysis_phase': analysis_phase,
+            'ai_percentage': result.ai_percentage if result is not None else None,
+            'sampled_paragraphs': result.completed_paragraphs if analysis_phase == 'provisional' else None,
         })
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
@@ -748,13 +865,15 @@ class SubmissionViewSet(viewsets.ModelViewSet):
             return Response({'message': 'Not paused'})
 
         submission.resume()
-        pending_count = 0
-        if hasattr(submission, 'result'):
-            pending_count = submission.result.paragraphs.filter(status='pending').count()
-            if pending_count > 0:
-                queue_paragraph_tasks(str(submission.id), submission.user.role)
+        # Continue from the stage the pipeline stopped at; None if it never stopped
+        resumed_stage = resume_processing(submission)
+        pending_count = max(submission.total_paragraphs - submission.processed_paragraphs, 0)
 
-        return Response({'message': 'Submission resumed', 'pending_paragraphs': pending_count})
+        return Response({
+            'message': 'Submission resumed',
+            'resumed_stage': resumed_stage,
+            'pending_paragraphs': pending_count,
+        })
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def terminate(self, request, pk=None):
@@ -767,16 +886,26 @@ class SubmissionViewSet(viewsets.ModelViewSet):
                 return Response({'error': 'Access denied'}, status=status.HTTP_403_FORBIDDEN)
 
         # Set terminated flag — task checks this and stops itself
+        task_id = submission.task_id
         submission.status = 'terminated'
         submission.task_id = None
         submission.save(update_fields=['status', 'task_id'])
 
-        # Try revoke anyway (works on Linux, no-op on Windows)
-        if submission.task_id:
+        # Fire the cancellation token so in-flight ML calls stop right away
+        cancel_submission(submission.id)
+
+        # Revoke the running stage too (works on Linux, no-op on Windows)
+        if task_id:
             celery.current_app.control.revoke(
-                submission.task_id, terminate=True, signal='SIGTERM'
+                task_id, terminate=True, signal='SIGTERM'
             )
 
+        # A killed stage never reaches its cleanup; free its lease, slot and files here
+        release_handed_off_lease(submission.id)
+        _discard_work_files(submission)
+        if scheduler.release(submission.id):
+            dispatch_submissions.delay()
+
         # Delete existing results
         if hasattr(submission, 'result'):
             submission.result.paragraphs.all().delete()
@@ -800,7 +929,7 @@ class SubmissionViewSet(viewsets.ModelViewSet):
 
         submissions = Submission.objects.filter(
             id__in=submission_ids,
-            class_obj__teacher=request.user
+            assignment__class_obj__teacher=request.user
         )
 
         paused_count = 0
@@ -821,15 +950,14 @@ class SubmissionViewSet(viewsets.ModelViewSet):
 
         submissions = Submission.objects.filter(
             id__in=submission_ids,
-            class_obj__teacher=request.user,
+            assignment__class_obj__teacher=request.user,
             is_paused=True
         )
 
         resumed_count = 0
         for submission in submissions:
             submission.resume()
-            if hasattr(submission, 'result'):
-                queue_paragraph_tasks(str(submission.id), submission.user.role)
+            resume_processing(submission)
             resumed_count += 1
 
         return Response({
@@ -837,6 +965,16 @@ class SubmissionViewSet(viewsets.ModelViewSet):
             'resumed_count': resumed_count
         })
 
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser], url_path='ml-nodes')
+    def ml_nodes(self, request):
+        """Admin: per-node load, latency and health of the ML pool"""
+        return Response(node_stats())
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser], url_path='queue')
+    def queue(self, request):
+        """Admin: scheduler backlog, busy slots and throughput"""
+        return Response(scheduler.queue_stats())
+
     @action(detail=False, methods=['post'])
     def evaluate_document(self, request):
         """Teacher/Guest evaluates their own document (no assignment)"""
@@ -855,6 +993,16 @@ class SubmissionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        # Admission control: keep guests out while their backlog is too long
+        if request.user.is_guest():
+            retry_after = scheduler.guest_retry_after()
+            if retry_after:
+                return Response(
+                    {'error': 'The service is busy, please try again later', 'retry_after': retry_after},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
+                    headers={'Retry-After': str(retry_after)},
+                )
+
         submission = Submission.objects.create(
             user=request.user,
             assignment=None,
@@ -873,4 +1021,205 @@ class SubmissionViewSet(viewsets.ModelViewSet):
         )
 
         serializer = self.get_serializer(submission)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionViewSet(viewsets.GenericViewSet):
+    """
+    Resumable multipart uploads of large PDFs
+    POST   /api/submissions/uploads/                  start, returns the part layout
+    POST   /api/submissions/uploads/{id}/parts/       presigned PUT URLs for parts
+    GET    /api/submissions/uploads/{id}/             received offset and parts (also HEAD)
+    POST   /api/submissions/uploads/{id}/complete/    assemble and create the submission
+    DELETE /api/submissions/uploads/{id}/             abandon the upload
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = DirectUploadSerializer
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def _progress(self, session):
+        parts = direct_uploads.uploaded_parts(session) if not session.completed_at else []
+        offset = session.file_size if session.completed_at else direct_uploads.received_offset(session, parts)
+        return Response({
+            'id': str(session.id),
+            'file_size': session.file_size,
+            'part_size': session.part_size,
+            'part_count': session.part_count,
+            'offset': offset,
+            'received_parts': [part['PartNumber'] for part in parts],
+            'submission': str(session.submission_id) if session.submission_id else None,
+        }, headers={
+            'Upload-Offset': str(offset),
+            'Upload-Length': str(session.file_size),
+        })
+
+    def create(self, request):
+        if not direct_uploads.available():
+            return Response(
+                {'error': 'Direct uploads are not available, upload the file instead'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        # Admission control: keep guests out while their backlog is too long
+        if request.user.is_guest():
+            retry_after = scheduler.guest_retry_after()
+            if retry_after:
+                return Response(
+                    {'error': 'The service is busy, please try again later', 'retry_after': retry_after},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
+                    headers={'Retry-After': str(retry_after)},
+                )
+
+        session = direct_uploads.new_session(
+            request.user,
+            data['filename'],
+            data['file_size'],
+            assignment=data.get('assignment'),
+            assignment_name=data['assignment_name'],
+        )
+        response = self._progress(session)
+        response.status_code = status.HTTP_201_CREATED
+        return response
+
+    def retrieve(self, request, pk=None):
+        """Where to resume: the contiguous offset received and the parts present"""
+        return self._progress(self.get_object())
+
+    @action(detail=True, methods=['post'])
+    def parts(self, request, pk=None):
+        session = self.get_object()
+        if session.completed_at:
+            return Response({'error': 'Upload is already complete'}, status=status.HTTP_400_BAD_REQUEST)
+
+        numbers = request.data.get('part_numbers') or range(1, session.part_count + 1)
+        try:
+            numbers = sorted({int(number) for number in numbers})
+        except (TypeError, ValueError):
+            numbers = []
+        if not numbers or numbers[0] < 1 or numbers[-1] > session.part_count:
+            return Response(
+                {'error': f'part_numbers must be between 1 and {session.part_count}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'parts': [
+                {
+                    'part_number': number,
+                    'offset': (number - 1) * session.part_size,
+                    'url': direct_uploads.presigned_part_url(session, number),
+                }
+                for number in numbers
+            ],
+            'expires_in': settings.DIRECT_UPLOAD_EXPIRY,
+        })
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """Assemble the parts, check the PDF and create the submission"""
+        with transaction.atomic():
+            # Concurrent completions wait here; the later ones find the submission
+            session = self.get_queryset().select_for_update().get(pk=self.get_object().pk)
+            if session.submission_id:
+                return Response(SubmissionSerializer(session.submission, context=self.get_serializer_context()).data)
+
+            parts = direct_uploads.uploaded_parts(session)
+            missing = direct_uploads.missing_parts(session, parts)
+            if missing:
+                return Response(
+                    {'error': 'Upload is incomplete', 'missing_parts': missing},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            submission = Submission(
+                user=request.user,
+                assignment=session.assignment,
+                assignment_name=session.assignment_name,
+                original_filename=session.original_filename,
+                file_size=session.file_size,
+                status='queued'
+            )
+            # The deadline may have passed while the parts were uploading; the
+            # session stays, so a deadline extended meanwhile lets it complete
+            if not submission.can_submit():
+                return Response(
+                    {'error': 'Deadline has passed. Request an extension.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            direct_uploads.complete_session(session, parts)
+            submission.file.name = session.file_name
+            try:
+                direct_uploads.verify_upload(submission)
+            except direct_uploads.UploadRejected as exc:
+                session.delete()
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+            submission.save()
+            session.submission = submission
+            session.completed_at = timezone.now()
+            session.save(update_fields=['submission', 'completed_at'])
+
+        queue_submission_processing.delay(
+            submission_id=str(submission.id),
+            user_role=request.user.role,
+            is_teacher_view=False
+        )
+        serializer = SubmissionSerializer(submission, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def destroy(self, request, pk=None):
+        session = self.get_object()
+        if session.completed_at:
+            return Response({'error': 'Upload is already complete'}, status=status.HTTP_400_BAD_REQUEST)
+        direct_uploads.abort_session(session)
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class MLCallbackView(APIView):
+    """
+    Receives analysis results pushed by the ML service in webhook mode
+    POST /api/submissions/ml-callback/{submission_id}/
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, submission_id):
+        token = request.headers.get('X-Callback-Token', '')
+        if not verify_callback_token(token, submission_id):
+            return Response({'error': 'Invalid callback token'}, status=status.HTTP_403_FORBIDDEN)
+
+        submission = Submission.objects.filter(id=submission_id).first()
+        if not submission:
+            return Response({'error': 'Submission not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Keep reap_overdue_callbacks away from it
+        stop_waiting(submission_id)
+
+        # Duplicate delivery, or the submission was terminated meanwhile
+        if submission.status != 'processing':
+            return Response({'message': f'Ignored, submission is {submission.status}'})
+
+        # Read the raw body in chunks so the payload is decoded incrementally
+        chunks = iter(lambda: request.read(settings.ML_RESPONSE_CHUNK_SIZE), b'')
+        try:
+            paragraph_count = complete_from_callback(submission, chunks)
+        except IntegrityError:
+            return Response({'message': 'Ignored, result already stored'})
+        except Exception as exc:
+            logger.exception("ML callback for submission %s failed: %s", submission_id, exc)
+            submission.status = 'failed'
+            submission.save(update_fields=['status'])
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            release_handed_off_lease(submission_id)
+
+        logger.info("Submission %s completed via ML callback (%d paragraphs)", submission_id, paragraph_count)
+        return Response({'message': 'Result stored', 'paragraphs': paragraph_count})
@@ -0,0 +1,75 @@
+"""
+Webhook completion mode for ML analysis.
+
+With ML_COMPLETION_MODE = 'webhook' the task sends the PDF together with a
+callback URL and a signed token, then returns straight away. The ML service
+later POSTs the analysis to MLCallbackView with the token in the
+X-Callback-Token header. The view persists it, so Celery slots are no
+longer held for the length of the inference.
+
+Every submission handed to the ML service this way is recorded with a
+deadline ML_CALLBACK_TIMEOUT ahead. reap_overdue_callbacks fails the ones
+whose callback never arrived and frees their lease and scheduler slot.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from redis.exceptions import RedisError
+
+from apps.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_SALT = 'submissions.ml-callback'
+
+# Submissions awaiting a callback, scored by their deadline
+PENDING_KEY = 'ml:callbacks:pending'
+
+
+def sign_callback_token(submission_id):
+    return signing.TimestampSigner(salt=CALLBACK_SALT).sign(str(submission_id))
+
+
+def verify_callback_token(token, submission_id):
+    """True when the token was issued for this submission and has not expired"""
+    try:
+        value = signing.TimestampSigner(salt=CALLBACK_SALT).unsign(
+            token, max_age=settings.ML_CALLBACK_TOKEN_MAX_AGE,
+        )
+    except signing.BadSignature:
+        return False
+    return value == str(submission_id)
+
+
+def callback_fields(submission):
+    """Form fields that ask the ML service to deliver results by callback"""
+    path = reverse('submissions:ml-callback', args=[submission.id])
+    return {
+        'callback_url': f"{settings.ML_CALLBACK_BASE_URL.rstrip('/')}{path}",
+        'callback_token': sign_callback_token(submission.id),
+    }
+
+
+def await_callback(submission_id):
+    """Start the clock on a submission handed to the ML service"""
+    try:
+        get_redis().zadd(PENDING_KEY, {str(submission_id): time.time() + settings.ML_CALLBACK_TIMEOUT})
+    except RedisError as exc:
+        logger.warning("Could not track callback of submission %s: %s", submission_id, exc)
+
+
+def stop_waiting(submission_id):
+    """Stop the clock on a submission's callback; True if it was still awaited"""
+    try:
+        return bool(get_redis().zrem(PENDING_KEY, str(submission_id)))
+    except RedisError as exc:
+        logger.warning("Could not track callback of submission %s: %s", submission_id, exc)
+        return False
+
+
+def overdue_callbacks():
+    """Ids of submissions whose callback deadline has passed"""
+    return get_redis().zrangebyscore(PENDING_KEY, '-inf', time.time())
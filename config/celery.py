@@ -4,6 +4,7 @@ Celery configuration for AI Detection Backend
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 from django.conf import settings
 
 # Set the default Django settings module
@@ -21,6 +22,21 @@ app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 # Optional: Configure task routes
 app.conf.task_routes = {
     'apps.submissions.tasks.process_submission': {'queue': 'submissions'},
+    # Staged submission pipeline, one queue per stage
+    'apps.submissions.tasks.extract_paragraphs_from_pdf': {'queue': 'preflight'},
+    'apps.submissions.tasks.analyze_submission': {'queue': 'submissions'},
+    'apps.submissions.tasks.analyze_shard': {'queue': 'submissions'},
+    'apps.submissions.tasks.analyze_batch': {'queue': 'submissions'},
+    'apps.submissions.tasks.merge_shards': {'queue': 'persist'},
+    'apps.submissions.tasks.persist_paragraphs': {'queue': 'persist'},
+    'apps.submissions.tasks.store_report': {'queue': 'reports'},
+    'apps.submissions.tasks.finalize_submission': {'queue': 'finalize'},
+    'apps.submissions.tasks.schedule_submission': {'queue': 'preflight'},
+    'apps.submissions.tasks.dispatch_submissions': {'queue': 'preflight'},
+    'apps.submissions.tasks.flush_assignment_batches': {'queue': 'preflight'},
+    'apps.submissions.tasks.reap_overdue_callbacks': {'queue': 'preflight'},
+    'apps.submissions.tasks.reap_stale_submissions': {'queue': 'preflight'},
+    'apps.submissions.tasks.expire_direct_uploads': {'queue': 'maintenance'},
     'apps.core.tasks.cleanup_old_files': {'queue': 'maintenance'},
 }
 
@@ -30,8 +46,45 @@ app.conf.beat_schedule = {
         'task': 'apps.core.tasks.cleanup_old_files',
         'schedule': 86400.0,  # Run daily (24 hours)
     },
+    'probe-ml-nodes': {
+        'task': 'apps.submissions.tasks.probe_ml_nodes',
+        'schedule': 15.0,  # Every 15 seconds
+    },
+    'dispatch-submissions': {
+        'task': 'apps.submissions.tasks.dispatch_submissions',
+        'schedule': 10.0,  # Every 10 seconds, picks up slots freed by crashed workers
+    },
+    'flush-assignment-batches': {
+        'task': 'apps.submissions.tasks.flush_assignment_batches',
+        'schedule': 60.0,  # Every minute, sends batches of assignments past their deadline
+    },
+    'reap-overdue-callbacks': {
+        'task': 'apps.submissions.tasks.reap_overdue_callbacks',
+        'schedule': 60.0,  # Every minute, fails submissions whose ML callback never came
+    },
+    'reap-stale-submissions': {
+        'task': 'apps.submissions.tasks.reap_stale_submissions',
+        'schedule': 60.0,  # Every minute, requeues submissions abandoned by a dead worker
+    },
+    'expire-direct-uploads': {
+        'task': 'apps.submissions.tasks.expire_direct_uploads',
+        'schedule': 3600.0,  # Hourly, removes presigned uploads that were never finalized
+    },
 }
 
+@worker_process_init.connect
+def init_worker_ml_client(**kwargs):
+    """Give each worker process its own pooled ML client"""
+    from apps.submissions.ml_client import init_client
+    init_client()
+
+
+@worker_process_shutdown.connect
+def close_worker_ml_client(**kwargs):
+    from apps.submissions.ml_client import close_client
+    close_client()
+
+
 @app.task(bind=True)
 def debug_task(self):
     """Debug task for testing Celery"""
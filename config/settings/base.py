@@ -199,10 +199,11 @@ CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 
 # Redis Cache
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/1')
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': config('REDIS_URL', default='redis://localhost:6379/1'),
+        'LOCATION': REDIS_URL,
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
         },
@@ -215,6 +216,10 @@ CACHES = {
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10 MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10 MB
 MAX_UPLOAD_SIZE = 52428800  # 50 MB for PDFs
+DIRECT_UPLOADS_ENABLED = config('DIRECT_UPLOADS_ENABLED', default=True, cast=bool)  # presigned uploads, needs S3/MinIO storage
+DIRECT_UPLOAD_EXPIRY = config('DIRECT_UPLOAD_EXPIRY', default=3600, cast=int)  # seconds a presigned upload stays valid
+RESUMABLE_UPLOAD_PART_SIZE = config('RESUMABLE_UPLOAD_PART_SIZE', default=8 * 1024 * 1024, cast=int)  # S3 needs at least 5 MB
+RESUMABLE_UPLOAD_EXPIRY = config('RESUMABLE_UPLOAD_EXPIRY', default=24 * 60 * 60, cast=int)  # unfinished upload sessions are aborted after this
 
 ALLOWED_UPLOAD_EXTENSIONS = ['pdf']
 
@@ -281,10 +286,113 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 
 # ML Service Configuration
 ML_SERVICE_URL = config('ML_SERVICE_URL', default='http://localhost:8001')
+# Comma-separated pool of ML nodes; defaults to the single ML_SERVICE_URL
+ML_SERVICE_URLS = config(
+    'ML_SERVICE_URLS',
+    default=ML_SERVICE_URL,
+    cast=lambda v: [s.strip().rstrip('/') for s in v.split(',') if s.strip()]
+)
 ML_SERVICE_API_KEY = config('ML_SERVICE_API_KEY', default='ai-content-evaluator-by-salman-and-ali')
+ML_MODEL_VERSION = config('ML_MODEL_VERSION', default='v1')
+
+
+# ML completion mode: 'sync' waits for the analysis, 'webhook' hands the PDF
+# over with a signed callback URL and frees the worker immediately
+ML_COMPLETION_MODE = config('ML_COMPLETION_MODE', default='sync')
+ML_CALLBACK_BASE_URL = config('ML_CALLBACK_BASE_URL', default='http://localhost:8000')
+ML_CALLBACK_TOKEN_MAX_AGE = config('ML_CALLBACK_TOKEN_MAX_AGE', default=24 * 60 * 60, cast=int)  # 1 day
+ML_CALLBACK_TIMEOUT = config('ML_CALLBACK_TIMEOUT', default=30 * 60, cast=int)  # fail submissions whose callback is this late
+
+# ML node health probing and ejection
+ML_NODE_HEALTH_PATH = config('ML_NODE_HEALTH_PATH', default='/health')
+ML_NODE_PROBE_TIMEOUT = config('ML_NODE_PROBE_TIMEOUT', default=5, cast=float)
+ML_NODE_SLOW_PROBE_SECONDS = config('ML_NODE_SLOW_PROBE_SECONDS', default=3, cast=float)
+ML_NODE_MAX_FAILURES = config('ML_NODE_MAX_FAILURES', default=3, cast=int)
+ML_NODE_EJECT_SECONDS = config('ML_NODE_EJECT_SECONDS', default=60, cast=int)
+ML_NODE_LATENCY_ALPHA = config('ML_NODE_LATENCY_ALPHA', default=0.2, cast=float)
+
+# Page-range sharding of large PDFs across the ML pool, or chunking in one worker (needs pypdf)
+ML_SHARDING_ENABLED = config('ML_SHARDING_ENABLED', default=False, cast=bool)
+ML_SHARD_MIN_BYTES = config('ML_SHARD_MIN_BYTES', default=2 * 1024 * 1024, cast=int)  # smaller files are never sharded
+ML_SHARD_PAGES = config('ML_SHARD_PAGES', default=25, cast=int)  # target pages per shard
+ML_SHARD_BYTES = config('ML_SHARD_BYTES', default=8 * 1024 * 1024, cast=int)  # target bytes per shard
+ML_SHARD_MAX_SHARDS = config('ML_SHARD_MAX_SHARDS', default=8, cast=int)
+ML_SHARD_MAX_DEFERRALS = config('ML_SHARD_MAX_DEFERRALS', default=20, cast=int)  # a shard fails after this many waits for the ML service
+ML_CHUNK_PAGES = config('ML_CHUNK_PAGES', default=20, cast=int)  # longer unsharded PDFs go in chunks of this many pages; 0 sends them whole
+ML_TEXT_EXTRACTION = config('ML_TEXT_EXTRACTION', default=False, cast=bool)  # send locally extracted text instead of the PDF
+ML_TEXT_MIN_CHARS = config('ML_TEXT_MIN_CHARS', default=200, cast=int)  # less extracted text than this sends the PDF (scans)
+ML_SLIM_ENABLED = config('ML_SLIM_ENABLED', default=False, cast=bool)  # send a copy without images and font programs; needs /api/render_report
+ML_SLIM_MIN_SAVING = config('ML_SLIM_MIN_SAVING', default=0.2, cast=float)  # keep the slim copy only if this much smaller
+QUICK_ESTIMATE_ENABLED = config('QUICK_ESTIMATE_ENABLED', default=True, cast=bool)  # provisional result from a sample first (text path)
+QUICK_ESTIMATE_MIN_PARAGRAPHS = config('QUICK_ESTIMATE_MIN_PARAGRAPHS', default=40, cast=int)  # shorter documents skip the estimate
+QUICK_ESTIMATE_SAMPLE = config('QUICK_ESTIMATE_SAMPLE', default=12, cast=int)  # paragraphs sampled for the estimate
+
+# Shared circuit breaker and AIMD concurrency limiter for ML calls
+ML_BREAKER_FAILURE_THRESHOLD = config('ML_BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+ML_BREAKER_RESET_SECONDS = config('ML_BREAKER_RESET_SECONDS', default=30, cast=int)
+ML_LIMIT_INITIAL = config('ML_LIMIT_INITIAL', default=8, cast=float)
+ML_LIMIT_MIN = config('ML_LIMIT_MIN', default=1, cast=float)
+ML_LIMIT_MAX = config('ML_LIMIT_MAX', default=64, cast=float)
+ML_LIMIT_BACKOFF = config('ML_LIMIT_BACKOFF', default=0.7, cast=float)
+ML_LIMIT_LATENCY_FRACTION = config('ML_LIMIT_LATENCY_FRACTION', default=0.5, cast=float)
+ML_DEFER_SECONDS = config('ML_DEFER_SECONDS', default=30, cast=int)  # parked submissions retry after
+
+# ML client connection pool (one per worker process)
+ML_CLIENT_MAX_CONNECTIONS = config('ML_CLIENT_MAX_CONNECTIONS', default=20, cast=int)
+ML_CLIENT_MAX_KEEPALIVE = config('ML_CLIENT_MAX_KEEPALIVE', default=10, cast=int)
+ML_CLIENT_KEEPALIVE_EXPIRY = config('ML_CLIENT_KEEPALIVE_EXPIRY', default=60, cast=float)
+
+# ML client timeouts in seconds; read/write budgets grow with file size
+ML_CONNECT_TIMEOUT = config('ML_CONNECT_TIMEOUT', default=10, cast=float)
+ML_POOL_TIMEOUT = config('ML_POOL_TIMEOUT', default=30, cast=float)
+ML_WRITE_TIMEOUT_BASE = config('ML_WRITE_TIMEOUT_BASE', default=30, cast=float)
+ML_WRITE_TIMEOUT_PER_MB = config('ML_WRITE_TIMEOUT_PER_MB', default=5, cast=float)
+ML_READ_TIMEOUT_BASE = config('ML_READ_TIMEOUT_BASE', default=60, cast=float)
+ML_READ_TIMEOUT_PER_MB = config('ML_READ_TIMEOUT_PER_MB', default=30, cast=float)
+ML_READ_TIMEOUT_MAX = config('ML_READ_TIMEOUT_MAX', default=600, cast=float)
+
+ML_UPLOAD_CHUNK_SIZE = config('ML_UPLOAD_CHUNK_SIZE', default=256 * 1024, cast=int)  # 256 KB
+ML_RESPONSE_CHUNK_SIZE = config('ML_RESPONSE_CHUNK_SIZE', default=64 * 1024, cast=int)  # 64 KB
+ML_PARAGRAPH_BATCH_SIZE = config('ML_PARAGRAPH_BATCH_SIZE', default=200, cast=int)
+
+# Submission execution: 'prefork' runs one submission per Celery slot,
+# 'async' lets one slot drive many concurrent ML calls
+SUBMISSION_EXECUTION_MODE = config('SUBMISSION_EXECUTION_MODE', default='prefork')
+SUBMISSION_LEASE_SECONDS = config('SUBMISSION_LEASE_SECONDS', default=60, cast=int)  # per-submission processing lock, heartbeat-extended
+STALE_SUBMISSION_SECONDS = config('STALE_SUBMISSION_SECONDS', default=5 * 60, cast=int)  # processing without a lease this long gets requeued
+SUBMISSION_HANDOFF_SECONDS = config('SUBMISSION_HANDOFF_SECONDS', default=60 * 60, cast=int)  # how long a queued stage may take to adopt the lease
+SUBMISSION_CANCEL_TTL = config('SUBMISSION_CANCEL_TTL', default=24 * 60 * 60, cast=int)  # how long a termination flag is kept
+
+# Fair-share scheduling of submissions (see apps/submissions/scheduler.py)
+SCHEDULER_MAX_IN_FLIGHT = config('SCHEDULER_MAX_IN_FLIGHT', default=16, cast=int)  # pipelines running at once
+SCHEDULER_MAX_WAIT = config('SCHEDULER_MAX_WAIT', default=15 * 60, cast=int)  # seconds before a waiting submission jumps the queue
+SCHEDULER_GUEST_EVERY = config('SCHEDULER_GUEST_EVERY', default=4, cast=int)  # guests get 1 in N dispatches while others wait
+SCHEDULER_TEACHER_VIEW_WEIGHT = config('SCHEDULER_TEACHER_VIEW_WEIGHT', default=4, cast=int)  # share of teacher-triggered evaluations
+SCHEDULER_SLOT_TTL = config('SCHEDULER_SLOT_TTL', default=60 * 60, cast=int)  # slots of crashed pipelines expire after
+SCHEDULER_RATE_WINDOW = config('SCHEDULER_RATE_WINDOW', default=10 * 60, cast=int)  # time constant of the completion-rate average
+SCHEDULER_SECONDS_PER_MB = config('SCHEDULER_SECONDS_PER_MB', default=20.0, cast=float)  # ML speed assumed before any call is timed
+SCHEDULER_ADMISSION_CONTROL = config('SCHEDULER_ADMISSION_CONTROL', default=False, cast=bool)  # 429 guest uploads when backlogged
+SCHEDULER_GUEST_MAX_BACKLOG = config('SCHEDULER_GUEST_MAX_BACKLOG', default=30 * 60, cast=int)  # seconds of guest backlog admitted
+
+# Assignment-deadline batch analysis (see apps/submissions/batching.py)
+ML_BATCH_SIZE = config('ML_BATCH_SIZE', default=8, cast=int)  # PDFs per batched ML request, also the early-flush threshold
+ML_BATCH_MAX_BYTES = config('ML_BATCH_MAX_BYTES', default=32 * 1024 * 1024, cast=int)  # upload size cap of one batch
+ASYNC_EXECUTOR_MAX_IN_FLIGHT = config('ASYNC_EXECUTOR_MAX_IN_FLIGHT', default=100, cast=int)
+ASYNC_EXECUTOR_CLAIM_BATCH = config('ASYNC_EXECUTOR_CLAIM_BATCH', default=25, cast=int)
+ASYNC_EXECUTOR_RUN_SECONDS = config('ASYNC_EXECUTOR_RUN_SECONDS', default=15 * 60, cast=int)  # stop taking work, finish in-flight calls and hand over
+ASYNC_EXECUTOR_SPOOL_SIZE = config('ASYNC_EXECUTOR_SPOOL_SIZE', default=1024 * 1024, cast=int)  # 1 MB
+
+# Analysis cache (identical PDFs + same model version reuse earlier results)
+ANALYSIS_CACHE_ENABLED = config('ANALYSIS_CACHE_ENABLED', default=True, cast=bool)
+ANALYSIS_CACHE_TIMEOUT = config('ANALYSIS_CACHE_TIMEOUT', default=7 * 24 * 60 * 60, cast=int)  # 7 days
+
+# Paragraph cache (shared paragraphs reuse earlier scores, see apps/submissions/paragraph_cache.py)
+PARAGRAPH_CACHE_ENABLED = config('PARAGRAPH_CACHE_ENABLED', default=True, cast=bool)
+PARAGRAPH_CACHE_TIMEOUT = config('PARAGRAPH_CACHE_TIMEOUT', default=30 * 24 * 60 * 60, cast=int)  # 30 days
 
 # Processing settings
 PARAGRAPH_MIN_WORDS = 50 
+PARAGRAPH_FEATURES_ENABLED = config('PARAGRAPH_FEATURES_ENABLED', default=True, cast=bool)  # local linguistic features per paragraph
 
 # File Storage Configuration
 USE_MINIO = config('USE_MINIO', default=False, cast=bool)
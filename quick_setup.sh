@@ -94,5 +94,5 @@ echo "4. Admin: http://localhost:8000/admin/"
 echo "5. API Docs: http://localhost:8000/api/docs/"
 echo ""
 echo "For Celery worker:"
-echo "  celery -A config worker -l info"
+echo "  celery -A config worker -l info -Q submissions,preflight,persist,reports,finalize,maintenance,default,celery"
 echo ""
\ No newline at end of file